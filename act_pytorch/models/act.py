@@ -6,9 +6,8 @@ import numpy as np
 
 from act_pytorch.models.backbone import build_backbone
 from act_pytorch.models.transformer import build_transformer, TransformerEncoder, TransformerEncoderLayer
-
-import IPython
-e = IPython.embed
+from act_pytorch.models.token_reducer import build_token_reducer
+from act_pytorch.utils.image_cache import get_image_sizes
 
 
 def reparametrize(mu, logvar):
@@ -29,7 +28,8 @@ def get_sinusoid_encoding_table(n_position, d_hid):
 
 class ACT(nn.Module):
 
-    def __init__(self, backbone, transformer, encoder, state_dim, action_dim, num_queries, latent_dim, camera_names):
+    def __init__(self, backbone, transformer, encoder, state_dim, action_dim, num_queries, latent_dim, camera_names,
+                 image_sizes=None, token_reducer=None):
         """ACT model, a variant of DERT VAE model
         Params:
         
@@ -48,10 +48,20 @@ class ACT(nn.Module):
             latent dim: dimension of latent z's mu and logvar
 
             camera_names: a list of camera names (str)
+
+            image_sizes: input resolution (height, width) of each camera, None if all cameras
+            are fed at the resolution of the input image
+
+            token_reducer: module reducing the image tokens of all cameras before the
+            Transformer, None to feed every token
         """
         super().__init__()
         self.num_queries = num_queries
         self.camera_names = camera_names
+        self.image_sizes = image_sizes
+        self.token_reducer = token_reducer
+        # frozen camera encoders replacing backbone + input_proj at CPU inference (see cpu_inference.py)
+        self.camera_encoders = None
         self.transformer = transformer
         self.encoder = encoder
         self.state_dim = state_dim
@@ -93,22 +103,83 @@ class ACT(nn.Module):
         ### VAE encoder
         latent_input, mu, logvar = self.encode(qpos, actions, is_pad)
         ### VAE decoder
-        # Image observation features and their position embeddings
+        src, pos = self.image_features(image)
+        a_hat = self.decode(qpos, src, pos, latent_input)
+        return a_hat, (mu, logvar)
+
+    def image_features(self, image):
+        """Image observation features (batch, dim, H, W * num_cam) and their position
+        embeddings (1, dim, H, W * num_cam), i.e. everything that depends on the image only.
+        With a token reducer, the reduced tokens are returned instead (batch, dim, 1, N), with
+        position embeddings of shape (1 or batch, dim, 1, N)"""
         all_cam_features = []
         all_cam_pos = []
         for cam_id,_ in enumerate(self.camera_names):
-            features, pos = self.backbones[cam_id](image[:, cam_id])
-            # If "return_interm_layers" is set to True, the backbone 
-            # will return features from intermediate layers
-            features = features[0]  # take the feature from the last layer
-            pos = pos[0]  # take the pos from the last layer
-            all_cam_features.append(self.input_proj(features))
+            features, pos = self.camera_features(image, cam_id)
+            all_cam_features.append(features)
             all_cam_pos.append(pos)
-        # proprioception features (joint positions embedding)
-        proprio_input = self.input_proj_robot_state(qpos)
+        return self.fuse_features(all_cam_features, all_cam_pos)
+
+    def camera_features(self, image, cam_id):
+        """Projected backbone features (batch, dim, h, w) and position embeddings (1, dim, h, w)
+        of camera `cam_id`, which only depend on the frame of that camera"""
+        cam_image = image[:, cam_id]
+        if self.image_sizes is not None:
+            # crop the camera from the canvas shared by all cameras
+            h, w = self.image_sizes[cam_id]
+            cam_image = cam_image[..., :h, :w]
+        return self.encode_camera(cam_image, cam_id)
+
+    def encode_camera(self, cam_image, cam_id):
+        """`camera_features` of the frames (batch, c, h, w) of camera `cam_id`, at its input resolution"""
+        if self.camera_encoders is not None:
+            return self.camera_encoders[cam_id](cam_image)
+        features, pos = self.backbones[cam_id](cam_image)
+        # If "return_interm_layers" is set to True, the backbone 
+        # will return features from intermediate layers
+        features = features[0]  # take the feature from the last layer
+        pos = pos[0]  # take the pos from the last layer
+        return self.input_proj(features), pos
+
+    def fuse_features(self, all_cam_features, all_cam_pos):
+        """Image tokens of all cameras from their `camera_features`"""
+        if self.token_reducer is not None:
+            return self.token_reducer(all_cam_features, all_cam_pos)
         # fold camera dimension into width dimension
         src = torch.cat(all_cam_features, axis=3)
         pos = torch.cat(all_cam_pos, axis=3)
+        return src, pos
+
+    def sample(self, qpos, image, num_samples, generator=None):
+        """
+        Action sequences (num_samples, batch, num_queries, action_dim) decoded from
+        `num_samples` latents drawn from the prior. The image features are computed once and
+        shared by all latents, which are decoded in a single batched Transformer call. Only
+        meaningful for models trained with the CVAE encoder (which exports drop, the prior
+        needs no encoder).
+        """
+        bs = qpos.shape[0]
+        src, pos = self.image_features(image)
+        latent_sample = torch.randn(num_samples * bs, self.latent_dim, generator=generator,
+                                    dtype=src.dtype, device=src.device)
+        latent_input = self.latent_out_proj(latent_sample)
+        # broadcast the observations over the latents, sample k of observation b is k * bs + b
+        src = src.repeat(num_samples, 1, 1, 1)
+        if pos.shape[0] > 1:
+            pos = pos.repeat(num_samples, 1, 1, 1)
+        a_hat = self.decode(qpos.repeat(num_samples, 1), src, pos, latent_input)
+        return a_hat.view(num_samples, bs, *a_hat.shape[1:])
+
+    def decode(self, qpos, src, pos, latent_input):
+        """Predict action sequences from image features, joint positions and latent z embedding"""
+        hs = self.decode_hidden(qpos, src, pos, latent_input)
+        a_hat = self.action_head(hs)
+        return a_hat
+
+    def decode_hidden(self, qpos, src, pos, latent_input):
+        """Transformer decoder output (batch, num_queries, hidden_dim) the actions are predicted from"""
+        # proprioception features (joint positions embedding)
+        proprio_input = self.input_proj_robot_state(qpos)
         hs = self.transformer(
             src,
             None,
@@ -118,8 +189,7 @@ class ACT(nn.Module):
             proprio_input,
             self.additional_pos_embed.weight
         )[0]
-        a_hat = self.action_head(hs)
-        return a_hat, (mu, logvar)
+        return hs
     
     def encode(self, qpos, actions=None, is_pad=None):
         """Obtain latent z and project it to embedding"""
@@ -190,7 +260,8 @@ def build_encoder(args):
     encoder = TransformerEncoder(
         encoder_layer,
         num_encoder_layers,
-        encoder_norm
+        encoder_norm,
+        activation_checkpointing=getattr(args, "activation_checkpointing", False)
     )
     return encoder
 
@@ -213,7 +284,9 @@ def build_ACT_model_and_optimizer(args):
         action_dim=args.action_dim,
         num_queries=args.action_horizon,
         latent_dim = args.latent_dim,
-        camera_names=args.cameras
+        camera_names=args.cameras,
+        image_sizes=get_image_sizes(args),
+        token_reducer=build_token_reducer(args)
     )
     # Build optimizer
     param_dicts = [
@@ -1,16 +1,12 @@
 import torch
-import torchvision
 from torch import nn
 from torch import Tensor
-from torchvision.models._utils import IntermediateLayerGetter
-from torchvision.models import ResNet18_Weights
-from typing import Optional, List
+from collections import OrderedDict
+from torch.utils.checkpoint import checkpoint
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
 
 from act_pytorch.models.position_encoding import build_position_encoding
 
-import IPython
-e = IPython.embed
-
 
 class NestedTensor(object):
     def __init__(self, tensors, mask: Optional[Tensor]):
@@ -40,8 +36,9 @@ class NestedTensor(object):
 class FrozenBatchNorm2d(nn.Module):
     """BatchNorm2d where the batch statistics and the affine parameters are fixed"""
   
-    def __init__(self, n):
+    def __init__(self, n, eps=1e-5):
         super(FrozenBatchNorm2d, self).__init__()
+        self.eps = eps
         self.register_buffer("weight", torch.ones(n))
         self.register_buffer("bias", torch.zeros(n))
         self.register_buffer("running_mean", torch.zeros(n))
@@ -65,22 +62,127 @@ class FrozenBatchNorm2d(nn.Module):
         b = self.bias.reshape(1, -1, 1, 1)
         rv = self.running_var.reshape(1, -1, 1, 1)
         rm = self.running_mean.reshape(1, -1, 1, 1)
-        eps = 1e-5
-        scale = w * (rv + eps).rsqrt()
+        scale = w * (rv + self.eps).rsqrt()
         bias = b - rm * scale
         return x * scale + bias
 
 
+def freeze_batch_norm(module: nn.Module) -> nn.Module:
+    """Replace every BatchNorm2d of `module` by a FrozenBatchNorm2d with its statistics and parameters"""
+    if isinstance(module, nn.BatchNorm2d):
+        frozen = FrozenBatchNorm2d(module.num_features, module.eps)
+        frozen.weight.copy_(module.weight.detach())
+        frozen.bias.copy_(module.bias.detach())
+        frozen.running_mean.copy_(module.running_mean)
+        frozen.running_var.copy_(module.running_var)
+        return frozen
+    for name, child in module.named_children():
+        setattr(module, name, freeze_batch_norm(child))
+    return module
+
+
+class BackboneSpec(NamedTuple):
+    """
+    build: builder of the torchvision classifier without weights, `build(dilation)`
+
+    weights: name of its torchvision weights enum (e.g. "ResNet18_Weights")
+
+    num_channels: channels of the last feature map (stride 32)
+
+    stages: feature stages of the classifier in order, `stages(model) -> OrderedDict`
+
+    feature_layers: stages whose outputs are returned, the last one is the final feature map
+    """
+    build: Callable
+    weights: str
+    num_channels: int
+    stages: Callable
+    feature_layers: Tuple[str, ...]
+
+
+BACKBONES: Dict[str, BackboneSpec] = {}
+
+
+def register_backbone(name: str, spec: BackboneSpec):
+    """Make a backbone available to `Backbone` (and the "backbone" config option) under `name`"""
+    BACKBONES[name] = spec
+
+
+def _resnet(name):
+    def build(dilation):
+        import torchvision
+        return getattr(torchvision.models, name)(replace_stride_with_dilation=[False, False, dilation])
+    return build
+
+
+def _torchvision(name):
+    def build(dilation):
+        import torchvision
+        if dilation:
+            raise ValueError(f"Dilation is not supported by {name}.")
+        return getattr(torchvision.models, name)()
+    return build
+
+
+def _resnet_stages(model):
+    return OrderedDict((name, module) for name, module in model.named_children() if name not in ("avgpool", "fc"))
+
+
+def _features_stages(model):
+    # MobileNet, EfficientNet: model.features is a sequence of blocks
+    return OrderedDict(model.features.named_children())
+
+
+def _regnet_stages(model):
+    return OrderedDict([("stem", model.stem)] + list(model.trunk_output.named_children()))
+
+
+for _name, _weights, _num_channels in [("resnet18", "ResNet18_Weights", 512),
+                                       ("resnet34", "ResNet34_Weights", 512),
+                                       ("resnet50", "ResNet50_Weights", 2048)]:
+    register_backbone(_name, BackboneSpec(_resnet(_name), _weights, _num_channels, _resnet_stages,
+                                          ("layer1", "layer2", "layer3", "layer4")))
+for _name, _weights, _num_channels, _last in [("mobilenet_v3_small", "MobileNet_V3_Small_Weights", 576, "12"),
+                                              ("mobilenet_v3_large", "MobileNet_V3_Large_Weights", 960, "16"),
+                                              ("efficientnet_b0", "EfficientNet_B0_Weights", 1280, "8")]:
+    register_backbone(_name, BackboneSpec(_torchvision(_name), _weights, _num_channels, _features_stages, (_last,)))
+for _name, _weights, _num_channels in [("regnet_x_400mf", "RegNet_X_400MF_Weights", 400),
+                                       ("regnet_y_400mf", "RegNet_Y_400MF_Weights", 440),
+                                       ("regnet_y_800mf", "RegNet_Y_800MF_Weights", 784)]:
+    register_backbone(_name, BackboneSpec(_torchvision(_name), _weights, _num_channels, _regnet_stages, ("block4",)))
+
+
+def load_backbone_weights(model: nn.Module, spec: BackboneSpec, weights_path: Optional[str] = None):
+    """Load ImageNet weights into a torchvision classifier, from `weights_path` (a state dict
+    saved with torch.save or as safetensors) if given, without any download, or else from
+    torchvision (downloaded once into the torch hub cache)"""
+    if weights_path:
+        if weights_path.endswith(".safetensors"):
+            from safetensors.torch import load_file
+            state_dict = load_file(weights_path)
+        else:
+            state_dict = torch.load(weights_path, map_location="cpu", weights_only=True)
+    else:
+        import torchvision
+        state_dict = getattr(torchvision.models, spec.weights).DEFAULT.get_state_dict(progress=True)
+    model.load_state_dict(state_dict)
+
+
 class BackboneBase(nn.Module):
 
   
-    def __init__(self, backbone: nn.Module, num_channels: int, return_interm_layers: bool):
+    def __init__(self, stages: OrderedDict, feature_layers: Tuple[str, ...], num_channels: int,
+                 return_interm_layers: bool, activation_checkpointing: bool = False):
         super().__init__()
+        # torchvision is slow to import, only import it when a backbone is built
+        from torchvision.models._utils import IntermediateLayerGetter
         if return_interm_layers:
-            return_layers = {"layer1": "0", "layer2": "1", "layer3": "2", "layer4": "3"}
+            if len(feature_layers) < 2:
+                raise ValueError("Intermediate layers are only available for ResNet backbones.")
+            return_layers = {name: str(i) for i, name in enumerate(feature_layers)}
         else:
-            return_layers = {'layer4': "0"} # only return the final output
-        self.body = IntermediateLayerGetter(backbone, return_layers=return_layers)
+            return_layers = {feature_layers[-1]: "0"} # only return the final output
+        self.body = IntermediateLayerGetter(nn.Sequential(stages), return_layers=return_layers)
         """IntermediateLayerGetter
         Return the outputs of the specified layers
         Output format: dictionary
@@ -89,24 +191,48 @@ class BackboneBase(nn.Module):
         
         """
         self.num_channels = num_channels
+        self.return_layers = return_layers
+        # recompute the activations of each stage during backward instead of storing them
+        self.activation_checkpointing = activation_checkpointing
 
   
     def forward(self, tensor):
-        xs = self.body(tensor)
+        if not (self.activation_checkpointing and self.training and torch.is_grad_enabled()):
+            return self.body(tensor)
+        xs = OrderedDict()
+        x = tensor
+        for name, module in self.body.items():
+            # stages are sequences of blocks (e.g. ResNet layers), single modules are cheap to store
+            if isinstance(module, nn.Sequential):
+                x = checkpoint(module, x, use_reentrant=False)
+            else:
+                x = module(x)
+            if name in self.return_layers:
+                xs[self.return_layers[name]] = x
         return xs
 
 
 class Backbone(BackboneBase):
-    """Visual encoder backbone (ResNet with frozen BatchNorm)"""
+    """Visual encoder backbone (a registered ImageNet classifier, with frozen BatchNorm by default)"""
   
     def __init__(self, name: str,
                 return_interm_layers: bool,
-                dilation: bool):
-        backbone = getattr(torchvision.models, name)(
-            replace_stride_with_dilation=[False, False, dilation],
-            weights=ResNet18_Weights.DEFAULT, norm_layer=FrozenBatchNorm2d)
-        num_channels = 512 if name in ('resnet18', 'resnet34') else 2048
-        super().__init__(backbone, num_channels, return_interm_layers)
+                dilation: bool,
+                activation_checkpointing: bool = False,
+                pretrained: bool = True,
+                frozen_bn: bool = True,
+                weights_path: Optional[str] = None):
+        if name not in BACKBONES:
+            raise ValueError(f"Unknown backbone {name}, expected one of {', '.join(BACKBONES)}.")
+        spec = BACKBONES[name]
+        backbone = spec.build(dilation)
+        # skip the ImageNet weights if they are overwritten by a checkpoint anyway
+        if pretrained:
+            load_backbone_weights(backbone, spec, weights_path)
+        if frozen_bn:
+            backbone = freeze_batch_norm(backbone)
+        super().__init__(spec.stages(backbone), spec.feature_layers, spec.num_channels,
+                         return_interm_layers, activation_checkpointing)
 
 
 class Joiner(nn.Sequential):
@@ -136,7 +262,15 @@ class Joiner(nn.Sequential):
 
 def build_backbone(args):
     position_embedding = build_position_encoding(args)
-    backbone = Backbone(args.backbone, False, False)
+    backbone = Backbone(
+        args.backbone,
+        False,
+        False,
+        activation_checkpointing=getattr(args, "activation_checkpointing", False),
+        pretrained=getattr(args, "pretrained_backbone", True),
+        frozen_bn=getattr(args, "frozen_bn", True),
+        weights_path=getattr(args, "backbone_weights", None)
+    )
     model = Joiner(backbone, position_embedding)
     model.num_channels = backbone.num_channels
   
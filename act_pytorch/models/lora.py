@@ -0,0 +1,90 @@
+import math
+import torch
+from torch import nn, Tensor
+from torch.nn.utils import parametrize
+from typing import Dict, List
+
+from act_pytorch.models.backbone import freeze_batch_norm
+from act_pytorch.models.transformer import TransformerEncoderLayer, TransformerDecoderLayer
+
+# weights of the attention and feedforward linears of a Transformer layer that get an adapter
+ADAPTED_WEIGHTS = (
+    ("self_attn", "in_proj_weight"),
+    ("self_attn.out_proj", "weight"),
+    ("multihead_attn", "in_proj_weight"),
+    ("multihead_attn.out_proj", "weight"),
+    ("linear1", "weight"),
+    ("linear2", "weight"),
+)
+
+
+class LoRA(nn.Module):
+    """
+    Low-rank adapter of a frozen (out_features, in_features) weight, registered as its
+    parametrization: the weight becomes W + B A * alpha / rank, with A (rank, in_features)
+    and B (out_features, rank). B starts at zero, so the adapted model starts as the
+    pretrained one.
+    """
+    def __init__(self, weight: Tensor, rank: int, alpha: float):
+        super().__init__()
+        out_features, in_features = weight.shape
+        self.lora_A = nn.Parameter(torch.empty(rank, in_features, dtype=weight.dtype, device=weight.device))
+        self.lora_B = nn.Parameter(torch.zeros(out_features, rank, dtype=weight.dtype, device=weight.device))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))
+        self.scaling = alpha / rank
+
+    def forward(self, weight: Tensor) -> Tensor:
+        return weight + (self.lora_B @ self.lora_A) * self.scaling
+
+
+def add_adapters(model: nn.Module, rank: int, alpha: float) -> List[nn.Parameter]:
+    """Freeze `model` (BatchNorm statistics included) and add a LoRA adapter to the attention
+    and feedforward linears of its Transformer layers, the adapters are the only trainable
+    parameters and are returned"""
+    if rank <= 0:
+        raise ValueError(f"The adapter rank must be positive, got {rank}.")
+    device = next(model.parameters()).device
+    for param in model.parameters():
+        param.requires_grad_(False)
+    # frozen weights, but train mode would still update the running statistics
+    freeze_batch_norm(model).to(device)
+    adapters = []
+    for layer in model.modules():
+        if not isinstance(layer, (TransformerEncoderLayer, TransformerDecoderLayer)):
+            continue
+        for module_name, weight_name in ADAPTED_WEIGHTS:
+            if not hasattr(layer, module_name.split(".")[0]):
+                continue
+            module = layer.get_submodule(module_name)
+            adapter = LoRA(getattr(module, weight_name), rank, alpha)
+            parametrize.register_parametrization(module, weight_name, adapter)
+            adapters.extend(adapter.parameters())
+    return adapters
+
+
+def adapter_state_dict(model: nn.Module) -> Dict[str, Tensor]:
+    """Adapter weights of `model`, all that a fine-tuning checkpoint has to store"""
+    return {k: v for k, v in model.state_dict().items() if k.endswith((".lora_A", ".lora_B"))}
+
+
+def load_adapters(model: nn.Module, state_dict: Dict[str, Tensor]):
+    """Load adapter weights (of `adapter_state_dict`) into a model with adapters"""
+    expected = adapter_state_dict(model).keys()
+    missing = expected - state_dict.keys()
+    unexpected = state_dict.keys() - expected
+    if missing or unexpected:
+        raise KeyError(f"Adapters do not match the model, missing: {sorted(missing)}, "
+                       f"unexpected: {sorted(unexpected)}.")
+    model.load_state_dict(state_dict, strict=False)
+
+
+def merge_adapters(model: nn.Module) -> nn.Module:
+    """Fold every adapter into the weight it adapts, leaving plain (trainable) linears with
+    the state dict keys of the pretrained model and no extra cost at inference"""
+    for module in list(model.modules()):
+        if not parametrize.is_parametrized(module):
+            continue
+        for weight_name in list(module.parametrizations.keys()):
+            parametrize.remove_parametrizations(module, weight_name, leave_parametrized=True)
+            getattr(module, weight_name).requires_grad_(True)
+    return model
@@ -0,0 +1,99 @@
+import math
+import torch
+from torch import nn, Tensor
+import torch.nn.functional as F
+from typing import List, Tuple
+
+
+def _flatten(all_cam_features: List[Tensor], all_cam_pos: List[Tensor]) -> Tuple[Tensor, Tensor]:
+    """Tokens of all cameras (B, N, dim) and their position embeddings (B, N, dim)"""
+    src = torch.cat([features.flatten(2) for features in all_cam_features], axis=2).transpose(1, 2)
+    pos = torch.cat([pos.flatten(2) for pos in all_cam_pos], axis=2).transpose(1, 2)
+    return src, pos.expand(src.shape[0], -1, -1)
+
+
+def _unflatten(src: Tensor, pos: Tensor) -> Tuple[Tensor, Tensor]:
+    """(B, N, dim) tokens back to the (B, dim, 1, N) layout the Transformer flattens"""
+    return src.transpose(1, 2).unsqueeze(2), pos.transpose(1, 2).unsqueeze(2)
+
+
+class StridedPool(nn.Module):
+    """Average `stride` x `stride` windows of the feature map of every camera"""
+
+    def __init__(self, stride=2):
+        super().__init__()
+        self.stride = stride
+
+    def forward(self, all_cam_features, all_cam_pos):
+        src = [F.avg_pool2d(features, self.stride, ceil_mode=True) for features in all_cam_features]
+        pos = [F.avg_pool2d(pos, self.stride, ceil_mode=True) for pos in all_cam_pos]
+        # fold camera dimension into width dimension
+        return torch.cat(src, axis=3), torch.cat(pos, axis=3)
+
+
+class AttentionPool(nn.Module):
+    """
+    Pool the tokens of all cameras into `num_tokens` tokens with learned queries. The
+    position embedding of a pooled token is the attention-weighted mean of the position
+    embeddings it pools.
+    """
+
+    def __init__(self, d_model, num_tokens=64, nhead=8):
+        super().__init__()
+        self.query = nn.Embedding(num_tokens, d_model)
+        self.attn = nn.MultiheadAttention(d_model, nhead, batch_first=True)
+        self.norm = nn.LayerNorm(d_model)
+
+    def forward(self, all_cam_features, all_cam_pos):
+        src, pos = _flatten(all_cam_features, all_cam_pos)
+        query = self.query.weight.unsqueeze(0).expand(src.shape[0], -1, -1)
+        pooled, weights = self.attn(query, src + pos, src, need_weights=True)  # weights (B, K, N), mean of heads
+        return _unflatten(self.norm(pooled + query), torch.bmm(weights, pos))
+
+
+class TopKSelect(nn.Module):
+    """
+    Keep the `num_tokens` tokens of all cameras with the highest learned saliency. Kept
+    tokens are scaled by their sigmoid saliency so that the scorer gets gradients.
+    """
+
+    def __init__(self, d_model, num_tokens=64):
+        super().__init__()
+        self.num_tokens = num_tokens
+        self.score = nn.Linear(d_model, 1)
+
+    def forward(self, all_cam_features, all_cam_pos):
+        src, pos = _flatten(all_cam_features, all_cam_pos)
+        score = self.score(src).squeeze(-1)  # (B, N)
+        k = min(self.num_tokens, src.shape[1])
+        # keep the spatial order of the selected tokens
+        index = score.topk(k, dim=1).indices.sort(dim=1).values
+        gate = torch.sigmoid(score.gather(1, index)).unsqueeze(-1)
+        index = index.unsqueeze(-1).expand(-1, -1, src.shape[2])
+        return _unflatten(src.gather(1, index) * gate, pos.gather(1, index))
+
+
+def num_reduced_tokens(args, tokens_per_cam: Tuple[int, int], num_cam: int) -> int:
+    """Image tokens fed to the Transformer for `num_cam` feature maps of (H, W) tokens"""
+    reducer = getattr(args, "token_reducer", "none")
+    h, w = tokens_per_cam
+    if reducer == "pool":
+        stride = args.pool_stride
+        return math.ceil(h / stride) * math.ceil(w / stride) * num_cam
+    if reducer in ("attention", "topk"):
+        return args.reduced_tokens if reducer == "attention" else min(args.reduced_tokens, h * w * num_cam)
+    return h * w * num_cam
+
+
+def build_token_reducer(args):
+    """Token reducer between the image projection and the Transformer, None to feed every token"""
+    reducer = getattr(args, "token_reducer", "none")
+    if reducer == "none":
+        return None
+    if reducer == "pool":
+        return StridedPool(args.pool_stride)
+    if reducer == "attention":
+        return AttentionPool(args.hidden_dim, args.reduced_tokens, args.nheads)
+    if reducer == "topk":
+        return TopKSelect(args.hidden_dim, args.reduced_tokens)
+    raise ValueError(f"Unknown token reducer {reducer}, expected none, pool, attention or topk.")
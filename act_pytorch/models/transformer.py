@@ -2,11 +2,9 @@ import copy
 import torch
 import torch.nn.functional as F
 from torch import nn, Tensor
+from torch.utils.checkpoint import checkpoint
 from typing import Optional
 
-import IPython
-e = IPython.embed
-
 
 class Transformer(nn.Module):
 
@@ -14,7 +12,7 @@ class Transformer(nn.Module):
     def __init__(self, d_model=512, nhead=8, num_encoder_layers=6,
                  num_decoder_layers=6, dim_feedforward=2048, dropout=0.1,
                  activation="relu", normalize_before=False,
-                 return_intermediate_dec=False):
+                 return_intermediate_dec=False, activation_checkpointing=False):
         super().__init__()
 
         self.d_model = d_model
@@ -23,13 +21,15 @@ class Transformer(nn.Module):
         encoder_layer = TransformerEncoderLayer(d_model, nhead, dim_feedforward,
                                                 dropout, activation, normalize_before)
         encoder_norm = nn.LayerNorm(d_model) if normalize_before else None
-        self.encoder = TransformerEncoder(encoder_layer, num_encoder_layers, encoder_norm)
+        self.encoder = TransformerEncoder(encoder_layer, num_encoder_layers, encoder_norm,
+                                          activation_checkpointing=activation_checkpointing)
 
         decoder_layer = TransformerDecoderLayer(d_model, nhead, dim_feedforward,
                                                 dropout, activation, normalize_before)
         decoder_norm = nn.LayerNorm(d_model)
         self.decoder = TransformerDecoder(decoder_layer, num_decoder_layers, decoder_norm,
-                                          return_intermediate=return_intermediate_dec)
+                                          return_intermediate=return_intermediate_dec,
+                                          activation_checkpointing=activation_checkpointing)
 
         self._reset_parameters()
 
@@ -53,7 +53,7 @@ class Transformer(nn.Module):
         """ 
         bs, c, h, w = src.shape
         src = src.flatten(2).permute(2, 0, 1)  # (H*W, B, dim)
-        pos_embed = pos_embed.flatten(2).permute(2, 0, 1).repeat(1, bs, 1)  # (H*W, B, dim)
+        pos_embed = pos_embed.flatten(2).permute(2, 0, 1).expand(-1, bs, -1)  # (H*W, B, dim), shared or per sample
         query_embed = query_embed.unsqueeze(1).repeat(1, bs, 1)  # (action_seq, B, dim)
 
         additional_pos_embed = additional_pos_embed.unsqueeze(1).repeat(1, bs, 1)  # (2, B, dim)
@@ -80,11 +80,13 @@ class Transformer(nn.Module):
 class TransformerEncoder(nn.Module):
 
   
-    def __init__(self, encoder_layer, num_layers, norm=None):
+    def __init__(self, encoder_layer, num_layers, norm=None, activation_checkpointing=False):
         super().__init__()
         self.layers = _get_clones(encoder_layer, num_layers)
         self.num_layers = num_layers
         self.norm = norm
+        # recompute the activations of each layer during backward instead of storing them
+        self.activation_checkpointing = activation_checkpointing
 
   
     def forward(self, src,
@@ -100,8 +102,13 @@ class TransformerEncoder(nn.Module):
         output = src
 
         for layer in self.layers:
-            output = layer(output, src_mask=mask,
-                           src_key_padding_mask=src_key_padding_mask, pos=pos)
+            if self.activation_checkpointing and self.training and torch.is_grad_enabled():
+                output = checkpoint(layer, output, src_mask=mask,
+                                    src_key_padding_mask=src_key_padding_mask, pos=pos,
+                                    use_reentrant=False)
+            else:
+                output = layer(output, src_mask=mask,
+                               src_key_padding_mask=src_key_padding_mask, pos=pos)
 
         if self.norm is not None:
             output = self.norm(output)
@@ -112,12 +119,15 @@ class TransformerEncoder(nn.Module):
 class TransformerDecoder(nn.Module):
 
 
-    def __init__(self, decoder_layer, num_layers, norm=None, return_intermediate=False):
+    def __init__(self, decoder_layer, num_layers, norm=None, return_intermediate=False,
+                 activation_checkpointing=False):
         super().__init__()
         self.layers = _get_clones(decoder_layer, num_layers)
         self.num_layers = num_layers
         self.norm = norm
         self.return_intermediate = return_intermediate
+        # recompute the activations of each layer during backward instead of storing them
+        self.activation_checkpointing = activation_checkpointing
 
 
     def forward(self, tgt, memory,
@@ -142,11 +152,19 @@ class TransformerDecoder(nn.Module):
         intermediate = []
 
         for layer in self.layers:
-            output = layer(output, memory, tgt_mask=tgt_mask,
-                           memory_mask=memory_mask,
-                           tgt_key_padding_mask=tgt_key_padding_mask,
-                           memory_key_padding_mask=memory_key_padding_mask,
-                           pos=pos, query_pos=query_pos)
+            if self.activation_checkpointing and self.training and torch.is_grad_enabled():
+                output = checkpoint(layer, output, memory, tgt_mask=tgt_mask,
+                                    memory_mask=memory_mask,
+                                    tgt_key_padding_mask=tgt_key_padding_mask,
+                                    memory_key_padding_mask=memory_key_padding_mask,
+                                    pos=pos, query_pos=query_pos,
+                                    use_reentrant=False)
+            else:
+                output = layer(output, memory, tgt_mask=tgt_mask,
+                               memory_mask=memory_mask,
+                               tgt_key_padding_mask=tgt_key_padding_mask,
+                               memory_key_padding_mask=memory_key_padding_mask,
+                               pos=pos, query_pos=query_pos)
             if self.return_intermediate:
                 intermediate.append(self.norm(output))
 
@@ -343,4 +361,5 @@ def build_transformer(args):
         num_decoder_layers=args.dec_layers,
         normalize_before=args.pre_norm,
         return_intermediate_dec=True,
+        activation_checkpointing=getattr(args, "activation_checkpointing", False),
     )
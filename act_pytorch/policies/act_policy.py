@@ -1,12 +1,10 @@
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
-import torchvision.transforms as transforms
 
 from act_pytorch.models.act import build_ACT_model_and_optimizer
-
-import IPython
-e = IPython.embed
+from act_pytorch.models.lora import add_adapters
+from act_pytorch.utils.image_cache import get_image_sizes, resize_frames, resize_images
 
 class ACTPolicy(nn.Module):
     def __init__(self, args):
@@ -15,27 +13,67 @@ class ACTPolicy(nn.Module):
         self.model = model
         self.optimizer = optimizer
         self.kl_weight = args.kl_weight
+        self.image_sizes = get_image_sizes(args)
+        self.args = args
         
-    def __call__(self, qpos, image, actions=None, is_pad=None):
-        # ImageNet normalization
-        normalize = transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225]
-        )
-        image = normalize(image)
+    def __call__(self, qpos, image, actions=None, is_pad=None, return_metrics=False):
+        image = self.preprocess(image)
         ### Training
         if actions is not None:
             a_hat, (mu, logvar) = self.model(qpos, image, actions, is_pad)
             all_l1 = F.l1_loss(actions, a_hat, reduction='none')
             l1 = (all_l1 * ~is_pad.unsqueeze(-1)).mean()
-            total_kld, _, _ = self.kl_divergence(mu, logvar)
+            total_kld, dimension_wise_kld, _ = self.kl_divergence(mu, logvar)
             loss = l1 + total_kld[0] * self.kl_weight
+            if return_metrics:
+                # loss terms as (detached) device tensors, reading them is up to the caller
+                metrics = {"l1": l1.detach(), "kl": total_kld[0].detach(),
+                           "kl_per_dim": dimension_wise_kld.detach()}
+                return loss, metrics
             return loss
         ### Inference
         else:
             a_hat, (_, _) = self.model(qpos, image)
             return a_hat
     
+    def sample(self, qpos, image, num_samples, generator=None):
+        """Action sequences (num_samples, num_queries, action_dim) of one observation, one per
+        latent drawn from the prior (e.g. to estimate their spread, or to average them), for
+        about the cost of a single backbone pass"""
+        if qpos.shape[0] != 1:
+            raise ValueError(f"Expected a single observation, got a batch of {qpos.shape[0]}.")
+        return self.model.sample(qpos, self.preprocess(image), num_samples, generator)[:, 0]
+
+    def preprocess(self, image):
+        """Resize (if configured) and normalize images in [0, 1] (batch, num_cam, c, h, w)"""
+        # resize raw frames to the input resolution the model was trained with
+        if self.image_sizes is not None:
+            image = resize_images(image, self.image_sizes)
+        return self.normalize(image)
+
+    def preprocess_camera(self, frames, cam_id):
+        """`preprocess` of the frames (batch, c, h, w) of camera `cam_id` alone, at its input
+        resolution (as `ACT.camera_features` crops it from the preprocessed canvas)"""
+        if self.image_sizes is not None:
+            h, w = self.image_sizes[cam_id]
+            canvas = (max(size[0] for size in self.image_sizes), max(size[1] for size in self.image_sizes))
+            # frames already on the canvas are not resized by `resize_images`, only cropped
+            frames = frames[..., :h, :w] if tuple(frames.shape[-2:]) == canvas else resize_frames(frames, (h, w))
+        return self.normalize(frames)
+
+    def normalize(self, image):
+        """ImageNet normalization of images in [0, 1] (channels third to last)"""
+        mean = torch.tensor([0.485, 0.456, 0.406], dtype=image.dtype, device=image.device)
+        std = torch.tensor([0.229, 0.224, 0.225], dtype=image.dtype, device=image.device)
+        image = (image - mean.view(-1, 1, 1)) / std.view(-1, 1, 1)
+        return image
+
+    def add_adapters(self, rank, alpha):
+        """Freeze the model and add LoRA adapters to its Transformer layers, the optimizer
+        then only updates (and keeps state for) the adapters"""
+        adapters = add_adapters(self.model, rank, alpha)
+        self.optimizer = torch.optim.AdamW(adapters, lr=self.args.lr, weight_decay=self.args.weight_decay)
+
     def configure_optimizers(self):
         return self.optimizer
 
@@ -0,0 +1,68 @@
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+class DistillationPolicy(nn.Module):
+    """
+    Train a student `ACTPolicy` against a frozen ACT teacher. The loss combines:
+
+        task: the ACT loss of the student (L1 to the recorded actions + KL), weight `task_weight`
+
+        action: L1 between the action chunks of student and teacher, both decoded with the
+        prior latent as at inference, weight `action_weight`
+
+        feature: MSE between the Transformer decoder outputs of student and teacher (the
+        student's projected to the teacher's hidden size), weight `feature_weight`
+
+    Only the student and the projection are trained, the student stays a plain `ACTPolicy`.
+    """
+    def __init__(self, student: ACTPolicy, teacher: ACTPolicy, task_weight=1.0, action_weight=1.0,
+                 feature_weight=0.1):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.requires_grad_(False)
+        self.task_weight = task_weight
+        self.action_weight = action_weight
+        self.feature_weight = feature_weight
+        # project the student's decoder output to the hidden size of the teacher
+        self.feature_proj = nn.Linear(student.model.transformer.d_model, teacher.model.transformer.d_model)
+
+    def train(self, mode=True):
+        super().train(mode)
+        # the teacher always runs in inference mode (no dropout)
+        self.teacher.eval()
+        return self
+
+    def __call__(self, qpos, image, actions, is_pad, return_metrics=False):
+        student, teacher = self.student.model, self.teacher.model
+        # teacher predictions from the prior latent
+        with torch.no_grad():
+            teacher_src, teacher_pos = teacher.image_features(self.teacher.preprocess(image))
+            teacher_latent, _, _ = teacher.encode(qpos)
+            teacher_hs = teacher.decode_hidden(qpos, teacher_src, teacher_pos, teacher_latent)
+            teacher_a_hat = teacher.action_head(teacher_hs)
+        src, pos = student.image_features(self.student.preprocess(image))
+        # task loss with the latent of the recorded actions
+        latent_input, mu, logvar = student.encode(qpos, actions, is_pad)
+        a_hat = student.decode(qpos, src, pos, latent_input)
+        all_l1 = F.l1_loss(actions, a_hat, reduction='none')
+        l1 = (all_l1 * ~is_pad.unsqueeze(-1)).mean()
+        total_kld, dimension_wise_kld, _ = self.student.kl_divergence(mu, logvar)
+        task_loss = l1 + total_kld[0] * self.student.kl_weight
+        # distillation losses with the prior latent, as used at inference
+        prior_latent, _, _ = student.encode(qpos)
+        hs = student.decode_hidden(qpos, src, pos, prior_latent)
+        action_loss = F.l1_loss(student.action_head(hs), teacher_a_hat)
+        feature_loss = F.mse_loss(self.feature_proj(hs), teacher_hs)
+        loss = self.task_weight * task_loss + self.action_weight * action_loss + \
+            self.feature_weight * feature_loss
+        if return_metrics:
+            metrics = {"l1": l1.detach(), "kl": total_kld[0].detach(),
+                       "kl_per_dim": dimension_wise_kld.detach(),
+                       "distill_action": action_loss.detach(), "distill_feature": feature_loss.detach()}
+            return loss, metrics
+        return loss
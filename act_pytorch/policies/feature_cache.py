@@ -0,0 +1,82 @@
+import time
+import zlib
+import torch
+from typing import Dict, Optional, Sequence
+
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def frame_key(frame: torch.Tensor):
+    """Cheap content key of a camera frame: shape and CRC of its bytes"""
+    data = frame.detach().cpu().contiguous().view(torch.uint8).numpy()
+    return tuple(frame.shape), zlib.crc32(data)
+
+
+class FeatureCachePolicy:
+    """
+    Inference wrapper of an `ACTPolicy` that keeps the backbone features of the last frame
+    of every camera. A camera's backbone only runs again when its frame changed, i.e. when
+    its key (the frame timestamp passed by the caller, else a CRC of the frame) differs from
+    the last one. The token reducer and the Transformer run at every call.
+
+    `stats()` reports hits and misses per camera, the mean backbone time of a miss and the
+    time saved by the hits (hits times that mean).
+    """
+    def __init__(self, policy: ACTPolicy):
+        self.policy = policy
+        num_cam = len(policy.model.camera_names)
+        self.keys = [None] * num_cam
+        self.features = [None] * num_cam
+        self.hits = [0] * num_cam
+        self.misses = [0] * num_cam
+        self.miss_time = [0.0] * num_cam
+
+    @torch.no_grad()
+    def __call__(self, qpos, image, stamps: Optional[Sequence] = None):
+        """Action sequence of an observation, as `ACTPolicy.__call__` at inference. `stamps`
+        (one per camera, e.g. the ROS header stamps) identify the frames if given."""
+        model = self.policy.model
+        keys = list(stamps) if stamps is not None else [frame_key(image[:, i]) for i in range(image.shape[1])]
+        changed = [cam_id for cam_id, key in enumerate(keys) if key != self.keys[cam_id]]
+        for cam_id in changed:
+            start = time.perf_counter()
+            # only the cameras whose frame changed are resized and normalized
+            frames = self.policy.preprocess_camera(image[:, cam_id], cam_id)
+            self.features[cam_id] = model.encode_camera(frames, cam_id)
+            if self.features[cam_id][0].is_cuda:
+                torch.cuda.synchronize()
+            self.miss_time[cam_id] += time.perf_counter() - start
+            self.misses[cam_id] += 1
+            self.keys[cam_id] = keys[cam_id]
+        for cam_id in range(len(keys)):
+            if cam_id not in changed:
+                self.hits[cam_id] += 1
+        src, pos = model.fuse_features([f for f, _ in self.features], [p for _, p in self.features])
+        latent_input, _, _ = model.encode(qpos)
+        return model.decode(qpos, src, pos, latent_input)
+
+    def reset(self):
+        """Forget the cached frames (e.g. at the start of an episode), the stats are kept"""
+        self.keys = [None] * len(self.keys)
+        self.features = [None] * len(self.features)
+
+    def stats(self) -> Dict[str, object]:
+        cameras = {}
+        for cam_id, cam_name in enumerate(self.policy.model.camera_names):
+            calls = self.hits[cam_id] + self.misses[cam_id]
+            backbone_ms = self.miss_time[cam_id] / max(self.misses[cam_id], 1) * 1e3
+            cameras[cam_name] = {
+                "hits": self.hits[cam_id],
+                "misses": self.misses[cam_id],
+                "hit_rate": self.hits[cam_id] / max(calls, 1),
+                "backbone_ms": backbone_ms,
+                "saved_ms": self.hits[cam_id] * backbone_ms,
+            }
+        hits = sum(self.hits)
+        return {
+            "hits": hits,
+            "misses": sum(self.misses),
+            "hit_rate": hits / max(hits + sum(self.misses), 1),
+            "saved_ms": sum(camera["saved_ms"] for camera in cameras.values()),
+            "cameras": cameras,
+        }
@@ -0,0 +1,94 @@
+import os
+import json
+import inspect
+import argparse
+import torch
+import numpy as np
+from torch import nn
+from typing import Dict, Tuple
+from safetensors.torch import save_file, load_file
+
+from act_pytorch.policies.act_policy import ACTPolicy
+from act_pytorch.utils.merge_adapters import merge_checkpoint
+
+WEIGHTS_NAME = "model.safetensors"
+CONFIG_NAME = "config.json"
+
+
+def _jsonable(value) -> bool:
+    try:
+        json.dumps(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _untie(state_dict: Dict[str, torch.Tensor]) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """Keep one copy of tensors shared by several keys (e.g. the backbone shared by all
+    cameras), safetensors does not store shared tensors. Return the tensors and the aliases."""
+    tensors, aliases, seen = {}, {}, {}
+    for key, tensor in state_dict.items():
+        ident = (tensor.data_ptr(), tensor.dtype, tuple(tensor.shape), tuple(tensor.stride()))
+        if ident in seen:
+            aliases[key] = seen[ident]
+        else:
+            seen[ident] = key
+            tensors[key] = tensor.detach().cpu().contiguous()
+    return tensors, aliases
+
+
+def export_artifact(checkpoint: str, output_dir: str):
+    """
+    Convert a training checkpoint into an inference-only artifact:
+
+        model.safetensors: model weights (without the VAE encoder, unused at inference)
+
+        config.json: model arguments, normalization stats and tied weights
+    """
+    ckpt = merge_checkpoint(torch.load(checkpoint, map_location="cpu", weights_only=False))
+    args = ckpt["args"]
+    args.pretrained_backbone = False
+    policy = ACTPolicy(args)
+    policy.model.load_state_dict(ckpt["model"])
+    # the VAE encoder only infers the latent from ground-truth actions during training
+    state_dict = {k: v for k, v in policy.model.state_dict().items() if not k.startswith("encoder.")}
+    tensors, aliases = _untie(state_dict)
+    config = {
+        "args": {k: v for k, v in vars(args).items() if _jsonable(v)},
+        "norm_stats": {k: np.asarray(v).tolist() for k, v in ckpt["norm_stats"].items()},
+        "aliases": aliases,
+    }
+    config["args"]["no_encoder"] = True
+    config["args"]["pretrained_backbone"] = False
+    os.makedirs(output_dir, exist_ok=True)
+    save_file(tensors, os.path.join(output_dir, WEIGHTS_NAME))
+    with open(os.path.join(output_dir, CONFIG_NAME), 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def load_artifact(path: str, device="cpu") -> Tuple[ACTPolicy, Dict[str, np.ndarray]]:
+    """
+    Build an inference `ACTPolicy` from an artifact written by `export_artifact`,
+    return the policy (in eval mode) and the normalization stats. Nothing is unpickled
+    and no pretrained weights are fetched. If supported by PyTorch, the model is built on
+    the meta device and its parameters are assigned the memory-mapped weights directly.
+    """
+    with open(os.path.join(path, CONFIG_NAME), 'r') as f:
+        config = json.load(f)
+    args = argparse.Namespace(**config["args"])
+    device = torch.device(device)
+    state_dict = load_file(os.path.join(path, WEIGHTS_NAME), device=str(device))
+    for alias, key in config["aliases"].items():
+        state_dict[alias] = state_dict[key]
+    if "assign" in inspect.signature(nn.Module.load_state_dict).parameters:
+        # skip weight initialization, the parameters are replaced by the loaded weights
+        with torch.device("meta"):
+            policy = ACTPolicy(args)
+        policy.model.load_state_dict(state_dict, assign=True)
+    else:
+        policy = ACTPolicy(args)
+        policy.model.load_state_dict(state_dict)
+    policy.to(device)
+    policy.eval()
+    norm_stats = {k: np.asarray(v, dtype=np.float32) for k, v in config["norm_stats"].items()}
+    return policy, norm_stats
@@ -0,0 +1,109 @@
+import os
+import json
+import copy
+import queue
+import torch
+import threading
+from typing import Optional
+
+
+def snapshot(obj):
+    """Copy all tensors of a (nested) state to CPU so training can keep updating the originals"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        state = type(obj)((k, snapshot(v)) for k, v in obj.items())
+        if hasattr(obj, "_metadata"):
+            # version information of module state dicts
+            state._metadata = copy.deepcopy(obj._metadata)
+        return state
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+class CheckpointWriter:
+    """
+    Write checkpoints from a background thread.
+
+    `save` snapshots the state to CPU and returns, a writer thread saves it to a
+    temporary file and atomically renames it, so a crash never leaves a partially
+    written checkpoint behind. Only the last `keep_last` checkpoints (all if 0) and
+    the one with the lowest metric are kept. The index of kept checkpoints is stored
+    in `checkpoints.json` so that retention carries over when training is resumed.
+    """
+    def __init__(self, ckpt_dir: str, keep_last: int = 0):
+        self.ckpt_dir = ckpt_dir
+        self.keep_last = keep_last
+        self.index_path = os.path.join(ckpt_dir, "checkpoints.json")
+        self.index = []  # [{"name": str, "metric": float or None}] in saving order
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.index = json.load(f)
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def save(self, state: dict, name: str, metric: Optional[float] = None):
+        """Snapshot `state` and write it to `<ckpt_dir>/<name>` in the background"""
+        self._raise_error()
+        self.queue.put((snapshot(state), name, metric))
+
+    def close(self):
+        """Wait for all pending checkpoints to be written"""
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    @property
+    def best(self) -> Optional[str]:
+        scored = [entry for entry in self.index if entry["metric"] is not None]
+        if len(scored) == 0:
+            return None
+        return min(scored, key=lambda entry: entry["metric"])["name"]
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("Failed to write checkpoint.") from self.error
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self._write(*job)
+            except Exception as error:
+                self.error = error
+
+    def _write(self, state, name, metric):
+        path = os.path.join(self.ckpt_dir, name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self.index = [entry for entry in self.index if entry["name"] != name]
+        self.index.append({"name": name, "metric": metric})
+        self._apply_retention()
+
+    def _apply_retention(self):
+        if self.keep_last > 0:
+            keep = {entry["name"] for entry in self.index[-self.keep_last:]}
+            best = self.best
+            if best is not None:
+                keep.add(best)
+            for entry in self.index:
+                if entry["name"] not in keep:
+                    path = os.path.join(self.ckpt_dir, entry["name"])
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.index = [entry for entry in self.index if entry["name"] in keep]
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
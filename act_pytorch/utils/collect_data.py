@@ -3,57 +3,79 @@ import os
 import sys
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(ROOT_DIR)
-import h5py
 import click
+import threading
 import rospy
-import ros_numpy
 import numpy as np
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Tuple
 from pynput.keyboard import Listener
 from sensor_msgs.msg import JointState, Image
 from message_filters import Subscriber, ApproximateTimeSynchronizer
+from act_pytorch.utils.episode_writer import EpisodeWriter
+from act_pytorch.utils.frame_ring import FrameRing, frame_view, stamp
 
 
 class Collector:
+    """
+    Record episodes from synchronized camera topics (one per camera of `camera_topics`) and
+    joint states. Every synchronized step is copied into a preallocated `FrameRing` (frames
+    at `frame_sizes`), which a writer thread drains into the episode file, with chunks of
+    `window` time steps (the action horizon) of low-dimensional data.
+    """
 
     def __init__(
         self,
         save_dir: Path,
-        topics: Dict[str, str]
+        camera_topics: Dict[str, str],
+        joint_topic: str,
+        frame_sizes: Dict[str, Tuple[int, int]],
+        compression: Optional[str] = None,
+        buffer_size: int = 64,
+        slop: float = 0.5,
+        window: int = 10
     ) -> None:
         self.save_dir = save_dir
-        self.images = list()
-        self.joint_poses = list()
-        self.ee_poses = list()
+        self.compression = compression
+        self.window = window
+        self.writer = None  # streams the episode being collected to disk
+        self.lock = threading.Lock()  # keeps the ring from being filled after a pause
         self.collecting = False
         self.cnt = 0
+        # synchronized steps wait in the ring until the writer thread takes them
+        self.ring = FrameRing({cam_name: frame_sizes[cam_name] for cam_name in camera_topics}, 7, buffer_size)
+        self.drain_thread = threading.Thread(target=self.ring.drain, args=(self.write,), daemon=True)
+        self.drain_thread.start()
+        # messages received per topic, those never synchronized are counted as unsynced
+        self.received = [0] * (len(camera_topics) + 1)
         # ROS initialization
         rospy.init_node("collect_data", anonymous=True)
-        self.image_sub = Subscriber(topics["image_topic"], Image)
-        self.joint_sub = Subscriber(topics["joint_topic"], JointState)
-        sync = ApproximateTimeSynchronizer(
-            [self.image_sub, self.joint_sub], 20, 0.5, True
-        )
+        self.subs = [Subscriber(topic, Image) for topic in camera_topics.values()]
+        self.subs.append(Subscriber(joint_topic, JointState))
+        for index, sub in enumerate(self.subs):
+            sub.registerCallback(self.count_message, index)
+        sync = ApproximateTimeSynchronizer(self.subs, 20, slop, True)
         sync.registerCallback(self.callback)
         # start keyboard listener
         self.listener = Listener(on_press=self.on_press)
         self.listener.start()
 
-    def callback(
-        self,
-        image: Image,
-        joint_state: JointState
-    ) -> None:
+    def count_message(self, msg, index: int) -> None:
         if self.collecting:
-            if image is None or joint_state is None:
-                rospy.logwarn("No data received!")
-            else:
-                image = ros_numpy.numpify(image)
+            self.received[index] += 1
+
+    def callback(self, *msgs) -> None:
+        """A synchronized step: an image of every camera, then the joint state"""
+        with self.lock:
+            if self.collecting:
+                *images, joint_state = msgs
                 joint_pos = np.array(joint_state.position[0: 7])
                 joint_pos[6] = joint_pos[6] > 0.5  # gripper closure
-                self.images.append(image)
-                self.joint_poses.append(joint_pos)
+                self.ring.put([frame_view(image) for image in images], joint_pos, [stamp(msg) for msg in msgs])
+
+    def write(self, step) -> None:
+        # the ring is empty whenever the writer changes
+        self.writer.write(step)
 
     def on_press(self, key) -> None:
         try:
@@ -74,55 +96,86 @@ class Collector:
     def resume(self):
         if not self.collecting:
             rospy.loginfo("Start collecting data")
-            self.images = list()
-            self.joint_poses = list()
-            self.ee_poses = list()
+            # a new episode replaces the unsaved one
+            if self.writer is not None:
+                self.writer.abort()
+            save_path = self.save_dir.joinpath(f"episode_{self.cnt}.hdf5")
+            self.writer = EpisodeWriter(str(save_path), window=self.window, compression=self.compression,
+                                        threaded=False)
+            self.ring.reset_stats()
+            self.received = [0] * len(self.received)
             self.collecting = True
         else:
             rospy.logwarn("Data is being collected!")    
     
     def pause(self):
         if self.collecting:
-            self.collecting = False
-            rospy.loginfo("Pause")
+            # wait for the running callback, no time step is put after this
+            with self.lock:
+                self.collecting = False
+            # and for the writer to take the buffered ones
+            self.ring.join()
+            stats = self.ring.stats()
+            unsynced = [received - stats["steps"] - stats["dropped"] for received in self.received]
+            rospy.loginfo(f"Pause: {stats['steps']} steps, {stats['dropped']} dropped (buffer full), "
+                          f"{stats['resized']} frames resized, unsynced messages per topic {unsynced}, "
+                          f"sync skew mean {stats['mean_skew'] * 1e3:.1f} ms, max {stats['max_skew'] * 1e3:.1f} ms "
+                          f"({stats['skewed']} steps above {self.ring.max_skew * 1e3:.1f} ms)")
         else:
             rospy.logwarn("The process is already paused.")
             
     def save(self):
-        if not self.collecting:
-            save_path = self.save_dir.joinpath(f"episode_{self.cnt}.hdf5")
-            images = np.array(self.images)
-            joint_poses = np.array(self.joint_poses)
-            with h5py.File(str(save_path), "w") as f:
-                f["/obs/head_camera"] = images
-                f["/proprios"] = joint_poses
-                f.close()
-            rospy.loginfo("Data saved")
-        else:
+        if self.collecting:
             rospy.logwarn("Please pause before saving data.")
+        elif self.writer is None:
+            rospy.logwarn("No data to save.")
+        else:
+            # the frames are already on disk, only the file is finalized
+            self.writer.finalize()
+            self.writer = None
+            self.cnt += 1
+            rospy.loginfo("Data saved")
             
     def exit(self):
-        self.collecting = False
-        if self.image_sub:
-            self.image_sub.unregister()
-        if self.joint_sub:
-            self.joint_sub.unregister()
+        with self.lock:
+            self.collecting = False
+        self.ring.join()
+        self.ring.close()
+        if self.writer is not None:
+            self.writer.abort()
+            self.writer = None
+        for sub in self.subs:
+            sub.unregister()
         rospy.loginfo("Successfully exit.")
         
                 
 @click.command("Collect full episodes using Kinova Gen3 Lite.")
 @click.option("-s", "--save_dir", type=str, default="data", help="Directory used for saving collected data.")
+@click.option("-c", "--compression", type=str, default=None, help="HDF5 compression of the episodes (e.g. lzf).")
+@click.option("-k", "--camera", "cameras", type=str, multiple=True, default=["head_camera=/camera/color/image_raw"],
+              help="Camera as <name>=<image topic>[@<H>x<W>], once per camera (synchronized).")
+@click.option("-f", "--frame_size", type=str, default="480x640",
+              help="Resolution (HxW) frames are recorded at, unless given per camera.")
+@click.option("-b", "--buffer_size", type=int, default=64, help="Time steps buffered for the writer.")
+@click.option("-w", "--window", type=int, default=10,
+              help="Time steps per chunk of actions and joint positions (the action horizon of training).")
 
-def main(save_dir):
+def main(save_dir, compression, cameras, frame_size, buffer_size, window):
     save_dir = Path(os.path.expanduser(save_dir)).absolute()
     if not save_dir.is_dir():
         save_dir.mkdir(parents=True)
-    topics = {
-        "image_topic": "/camera/color/image_raw",
-        "joint_topic": "/my_gen3_lite/joint_states"
-    }
-    collector = Collector(save_dir, topics)
+    camera_topics, frame_sizes = {}, {}
+    for camera in cameras:
+        cam_name, topic = camera.split("=", 1)
+        topic, _, size = topic.partition("@")
+        camera_topics[cam_name] = topic
+        frame_sizes[cam_name] = tuple(int(s) for s in (size or frame_size).split("x"))
+    collector = Collector(
+        save_dir, camera_topics, "/my_gen3_lite/joint_states", frame_sizes, compression, buffer_size,
+        window=window
+    )
     rospy.spin()
 
 
-    
+if __name__ == '__main__':
+    main()
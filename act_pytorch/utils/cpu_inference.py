@@ -0,0 +1,80 @@
+import os
+import warnings
+import torch
+from torch import nn
+from typing import Sequence
+
+
+class _CameraEncoder(nn.Module):
+    """Backbone, position embedding and input projection of a camera as one module"""
+    def __init__(self, backbone, input_proj):
+        super().__init__()
+        self.backbone = backbone
+        self.input_proj = input_proj
+
+    def forward(self, image):
+        features, pos = self.backbone(image)
+        return self.input_proj(features[0]), pos[0]
+
+
+class FrozenCameraEncoder:
+    """
+    `ACT.camera_features` of a backbone for CPU inference: weights and inputs in
+    channels_last, traced and frozen with TorchScript (frozen BatchNorm folded into the
+    convolutions, position embeddings folded into constants) and optimized for oneDNN
+    (fused convolution + ReLU). A graph is traced for every input shape seen.
+    """
+    def __init__(self, backbone, input_proj):
+        self.encoder = _CameraEncoder(backbone, input_proj).eval().to(memory_format=torch.channels_last)
+        self.graphs = {}
+
+    @torch.no_grad()
+    def __call__(self, image):
+        image = image.contiguous(memory_format=torch.channels_last)
+        key = (tuple(image.shape), image.dtype)
+        if key not in self.graphs:
+            with warnings.catch_warnings():
+                # the shapes of the position embedding become constants, as intended
+                warnings.simplefilter("ignore", torch.jit.TracerWarning)
+                traced = torch.jit.trace(self.encoder, image, check_trace=False)
+            self.graphs[key] = torch.jit.optimize_for_inference(traced)
+        return self.graphs[key](image)
+
+
+def configure_threads(intra_op_threads: int = 0, inter_op_threads: int = 0, cores: Sequence[int] = ()):
+    """Pin the process to `cores` and set the intra/inter-op thread counts of PyTorch (0 keeps
+    its default, i.e. one intra-op thread per pinned core if `cores` is given). Call before
+    any inference, PyTorch only sets the inter-op threads before its pool has started."""
+    if len(cores) > 0 and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    elif len(cores) > 0:
+        torch.set_num_threads(len(cores))
+    if inter_op_threads > 0 and torch.get_num_interop_threads() != inter_op_threads:
+        torch.set_num_interop_threads(inter_op_threads)
+
+
+def optimize_for_cpu(policy):
+    """Run the camera encoders of an inference `ACTPolicy` as `FrozenCameraEncoder`s, the
+    cameras sharing a backbone share its encoder. The state dict is left unchanged."""
+    model = policy.model
+    encoders = {}
+    for backbone in model.backbones:
+        if id(backbone) not in encoders:
+            encoders[id(backbone)] = FrozenCameraEncoder(backbone, model.input_proj)
+    model.camera_encoders = [encoders[id(backbone)] for backbone in model.backbones]
+    return policy
+
+
+def setup_cpu_inference(policy, args=None):
+    """Apply the [inference] settings of `args` (those the policy was built with if not given)"""
+    args = args if args is not None else policy.args
+    configure_threads(
+        getattr(args, "intra_op_threads", 0),
+        getattr(args, "inter_op_threads", 0),
+        getattr(args, "cpu_cores", [])
+    )
+    if getattr(args, "cpu_optimized", False):
+        optimize_for_cpu(policy)
+    return policy
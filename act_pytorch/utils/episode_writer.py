@@ -0,0 +1,119 @@
+import os
+import queue
+import h5py
+import threading
+import numpy as np
+from typing import Dict, Optional, Sequence
+
+
+def chunk_shape(shape: Sequence[int], window: int = 10):
+    """
+    HDF5 chunk shape matching how training reads an episode: one time step of every
+    camera and a window of `window` time steps (the action horizon) of low-dimensional
+    data (actions, joint positions). The first dimension of `shape` is time.
+    """
+    if len(shape) > 2:
+        return (1,) + tuple(shape[1:])  # one frame per chunk
+    return (max(1, min(window, shape[0])),) + tuple(shape[1:])
+
+
+class EpisodeWriter:
+    """
+    Stream the time steps of an episode into an HDF5 file while they are recorded.
+
+    `append` hands a time step over to a writer thread through a bounded queue (it
+    blocks if the disk falls behind by more than `queue_size` time steps), so memory
+    stays constant however long the episode is. Every dataset is resizable and chunked
+    along time and is created when its first time step arrives. The file is written
+    to `<path>.tmp` and only renamed to `path` by `finalize`, so an episode that is
+    not finalized never looks like a complete one. Chunks follow `chunk_shape` and are
+    optionally compressed (e.g. "lzf", fast enough to keep up with the cameras).
+
+    Without `threaded`, there is no queue: the caller writes the time steps with `write`
+    from a thread of its own (e.g. draining a `FrameRing`).
+    """
+    def __init__(self, path: str, queue_size: int = 64, grow_len: int = 256,
+                 window: int = 10, compression: Optional[str] = None, threaded: bool = True):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.grow_len = grow_len
+        self.window = window
+        self.compression = compression
+        self.file = h5py.File(self.tmp_path, 'w')
+        self.counts: Dict[str, int] = {}
+        self.error = None
+        self.queue = None
+        if threaded:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def append(self, step: Dict[str, np.ndarray]):
+        """Queue one time step, i.e. one array per dataset name (e.g. "/obs/head_camera")"""
+        self._raise_error()
+        self.queue.put(step)
+
+    def write(self, step: Dict[str, np.ndarray]):
+        """Write one time step now (errors are raised by `finalize`)"""
+        if self.error is not None:
+            return
+        try:
+            for name, value in step.items():
+                self._write(name, np.asarray(value))
+        except Exception as error:
+            self.error = error
+
+    def finalize(self) -> str:
+        """Write the pending time steps, trim the datasets and rename the file to `path`"""
+        self._close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        """Drop the episode"""
+        self._close(raise_error=False)
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __len__(self):
+        return min(self.counts.values()) if len(self.counts) > 0 else 0
+
+    def _close(self, raise_error=True):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+        if self.error is None:
+            for name, count in self.counts.items():
+                self.file[name].resize(count, axis=0)
+        self.file.close()
+        if raise_error:
+            self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Failed to write {self.tmp_path}.") from self.error
+
+    def _run(self):
+        while True:
+            step = self.queue.get()
+            if step is None:
+                return
+            self.write(step)
+
+    def _write(self, name, value):
+        if name not in self.file:
+            self.file.create_dataset(
+                name,
+                shape=(self.grow_len,) + value.shape,
+                maxshape=(None,) + value.shape,
+                dtype=value.dtype,
+                chunks=chunk_shape((self.window,) + value.shape, self.window),
+                compression=self.compression
+            )
+            self.counts[name] = 0
+        dataset = self.file[name]
+        count = self.counts[name]
+        if count == dataset.shape[0]:
+            dataset.resize(count + self.grow_len, axis=0)
+        dataset[count] = value
+        self.counts[name] = count + 1
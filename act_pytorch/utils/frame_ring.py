@@ -0,0 +1,139 @@
+import threading
+import numpy as np
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+from act_pytorch.utils.image_cache import resize_uint8
+
+# channels and the RGB slice of the supported `sensor_msgs/Image` encodings
+ENCODINGS = {
+    "rgb8": (3, slice(None)),
+    "rgba8": (4, slice(0, 3)),
+    "bgr8": (3, slice(2, None, -1)),
+    "bgra8": (4, slice(2, None, -1)),
+}
+
+
+def frame_view(msg) -> np.ndarray:
+    """(h, w, 3) RGB view of the data of a `sensor_msgs/Image` (any object with its fields), no copy"""
+    if msg.encoding not in ENCODINGS:
+        raise ValueError(f"Unsupported image encoding {msg.encoding}, expected one of {list(ENCODINGS)}.")
+    channels, rgb = ENCODINGS[msg.encoding]
+    rows = np.frombuffer(msg.data, dtype=np.uint8).reshape(msg.height, msg.step)
+    return rows[:, :msg.width * channels].reshape(msg.height, msg.width, channels)[..., rgb]
+
+
+def stamp(msg) -> float:
+    """Header stamp (s) of a ROS message"""
+    return msg.header.stamp.to_sec()
+
+
+class FrameRing:
+    """
+    Preallocated ring buffer of synchronized time steps: a frame of every camera (at the
+    resolution configured for it, other frames are resized), the joint positions and the
+    stamps of the messages. `put` copies a step into the next free slot, a constant cost
+    without allocation. If the consumer is `capacity` steps behind, the step is dropped
+    and counted. The consumer takes the oldest step with `get` (views of its slot, valid
+    until `release`), or runs `drain`.
+
+    `stats()` reports the steps put, dropped and resized, and the sync skew of the steps
+    (spread of their stamps): mean, max and the number of steps above `max_skew`.
+    """
+    def __init__(self, cameras: Dict[str, Tuple[int, int]], joint_dim: int, capacity: int = 64,
+                 max_skew: float = 1 / 30):
+        self.camera_names = list(cameras)
+        # filled (not only zero-mapped), so that no page is faulted in while capturing
+        self.frames = [np.full((capacity, h, w, 3), 0, dtype=np.uint8) for h, w in cameras.values()]
+        self.joints = np.zeros((capacity, joint_dim), dtype=np.float64)
+        self.stamps = np.zeros((capacity, len(cameras) + 1), dtype=np.float64)
+        self.capacity = capacity
+        self.max_skew = max_skew
+        self.read_index = 0
+        self.count = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.condition:
+            self.steps = self.dropped = self.resized = self.skewed = 0
+            self.skew_sum = self.skew_max = 0.0
+
+    def put(self, frames: Sequence[np.ndarray], joint_pos: Sequence[float], stamps: Sequence[float]) -> bool:
+        """Copy a time step (one frame per camera, the joint positions, the stamps of the camera
+        and joint messages) into the ring, False if it was dropped. A single producer."""
+        with self.condition:
+            if self.count == self.capacity:
+                self.dropped += 1
+                return False
+            slot = (self.read_index + self.count) % self.capacity
+        # the slot is not visible to the consumer until the step is counted
+        for cam_id, frame in enumerate(frames):
+            buffer = self.frames[cam_id][slot]
+            if frame.shape[:2] != buffer.shape[:2]:
+                frame = resize_uint8(frame[None], buffer.shape[:2])[0]
+                self.resized += 1
+            np.copyto(buffer, frame)
+        self.joints[slot] = joint_pos
+        self.stamps[slot] = stamps
+        skew = max(stamps) - min(stamps)
+        with self.condition:
+            self.count += 1
+            self.steps += 1
+            self.skew_sum += skew
+            self.skew_max = max(self.skew_max, skew)
+            self.skewed += skew > self.max_skew
+            self.condition.notify_all()
+        return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, np.ndarray]]:
+        """Oldest time step as views of its slot ("/obs/<camera>", "/proprios", "/stamps"),
+        None once closed and empty (or after `timeout`). Call `release` when done with it."""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count > 0 or self.closed, timeout):
+                return None
+            if self.count == 0:
+                return None
+            slot = self.read_index
+        step = {f"/obs/{cam_name}": self.frames[cam_id][slot] for cam_id, cam_name in enumerate(self.camera_names)}
+        step["/proprios"] = self.joints[slot]
+        step["/stamps"] = self.stamps[slot]
+        return step
+
+    def release(self):
+        """Free the slot of the last `get`"""
+        with self.condition:
+            self.read_index = (self.read_index + 1) % self.capacity
+            self.count -= 1
+            self.condition.notify_all()
+
+    def drain(self, write: Callable[[Dict[str, np.ndarray]], None]):
+        """Pass every time step to `write` until `close` (e.g. in a writer thread)"""
+        while True:
+            step = self.get()
+            if step is None:
+                return
+            write(step)
+            self.release()
+
+    def join(self):
+        """Wait until the consumer has released every step"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.count == 0)
+
+    def close(self):
+        """Stop `drain` once the ring is empty"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self.condition:
+            return {
+                "steps": self.steps,
+                "dropped": self.dropped,
+                "resized": self.resized,
+                "mean_skew": self.skew_sum / max(self.steps, 1),
+                "max_skew": self.skew_max,
+                "skewed": self.skewed,
+            }
@@ -0,0 +1,183 @@
+import os
+import sys
+import math
+import torch
+import argparse
+import numpy as np
+import torch.nn.functional as F
+from glob import glob
+from multiprocessing import Pool
+from typing import List, Optional, Sequence, Tuple
+
+
+def get_image_sizes(args) -> Optional[List[Tuple[int, int]]]:
+    """Return the input resolution (height, width) of every camera in `args.cameras`,
+    or None if the model consumes images at their stored resolution."""
+    image_size = getattr(args, "image_size", None)
+    if not image_size:
+        return None
+    missing = [cam_name for cam_name in args.cameras if cam_name not in image_size]
+    if len(missing) > 0:
+        raise ValueError(f"No input resolution configured for cameras {missing}.")
+    image_sizes = [(int(image_size[cam_name][0]), int(image_size[cam_name][1])) for cam_name in args.cameras]
+    # camera features are concatenated along width, so their feature maps must have the same height
+    if len({num_image_tokens(h, w)[0] for h, w in image_sizes}) > 1:
+        raise ValueError(f"Image heights {[h for h, _ in image_sizes]} give feature maps of different heights.")
+    return image_sizes
+
+
+def num_image_tokens(height: int, width: int, stride: int = 32) -> Tuple[int, int]:
+    """Size of the backbone feature map (i.e. image tokens per camera) for a given input resolution"""
+    return math.ceil(height / stride), math.ceil(width / stride)
+
+
+def resize_frames(frames: torch.Tensor, size: Sequence[int]) -> torch.Tensor:
+    """Bilinearly resize (N, c, h, w) float frames to `size` (antialiased when downsampling)"""
+    if tuple(frames.shape[-2:]) == tuple(size):
+        return frames
+    return F.interpolate(frames, size=tuple(size), mode="bilinear", align_corners=False, antialias=True)
+
+
+def resize_images(image: torch.Tensor, image_sizes: List[Tuple[int, int]]) -> torch.Tensor:
+    """
+    Resize a (batch, num_cam, c, h, w) image to the per-camera input resolution.
+
+    Cameras are stacked into one tensor, so every camera is placed into the top-left
+    corner of a canvas as large as the largest camera; the model crops each camera
+    back to its own size. Images that already have the canvas size are returned as is.
+    """
+    canvas_h = max(h for h, _ in image_sizes)
+    canvas_w = max(w for _, w in image_sizes)
+    if tuple(image.shape[-2:]) == (canvas_h, canvas_w):
+        return image
+    bs, num_cam, c = image.shape[:3]
+    canvas = image.new_zeros(bs, num_cam, c, canvas_h, canvas_w)
+    for cam_id, (h, w) in enumerate(image_sizes):
+        canvas[:, cam_id, :, :h, :w] = resize_frames(image[:, cam_id], (h, w))
+    return canvas
+
+
+def resize_uint8(frames: np.ndarray, size: Sequence[int]) -> np.ndarray:
+    """Resize (N, h, w, c) uint8 frames with the same kernel as `resize_frames`"""
+    if tuple(frames.shape[1:3]) == tuple(size):
+        return frames
+    frames = torch.from_numpy(np.ascontiguousarray(frames)).permute(0, 3, 1, 2).float()
+    frames = resize_frames(frames, size).round().clamp(0, 255).to(torch.uint8)
+    return frames.permute(0, 2, 3, 1).numpy()
+
+
+class ImageCache:
+    """
+    Resized camera frames stored next to the dataset, one file per
+    (resolution, camera, episode). A file is written the first time one of its
+    frames is requested (or ahead of time with `python -m act_pytorch.utils.image_cache`),
+    so the resize is paid once per dataset instead of once per sample. Without dataset
+    directory (e.g. episodes listed by manifests), each episode is cached in the
+    `.image_cache` of its own directory.
+    """
+    def __init__(self, dataset_dir: str, cache_dir: Optional[str] = None, chunk_len: int = 64):
+        self.cache_dir = cache_dir
+        if cache_dir is None and dataset_dir:
+            self.cache_dir = os.path.join(dataset_dir, ".image_cache")
+        self.chunk_len = chunk_len
+
+    def path(self, episode_path: str, cam_name: str, size: Sequence[int]) -> str:
+        episode_name = os.path.splitext(os.path.basename(episode_path))[0]
+        cache_dir = self.cache_dir
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(episode_path), ".image_cache")
+        return os.path.join(cache_dir, f"{size[0]}x{size[1]}", cam_name, f"{episode_name}.h5")
+
+    def is_valid(self, episode_path: str, cam_name: str, size: Sequence[int]) -> bool:
+        path = self.path(episode_path, cam_name, size)
+        return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(episode_path)
+
+    def build(self, episode_path: str, cam_name: str, size: Sequence[int]) -> str:
+        """Resize all frames of one camera of one episode and write them atomically"""
+        import h5py
+        path = self.path(episode_path, cam_name, size)
+        if self.is_valid(episode_path, cam_name, size):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several DataLoader workers may build the same file, each writes its own temp file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with h5py.File(episode_path, 'r') as src, h5py.File(tmp_path, 'w') as dst:
+            frames = src[f'/observations/images/{cam_name}']
+            time_steps, channels = frames.shape[0], frames.shape[-1]
+            images = dst.create_dataset(
+                "images",
+                shape=(time_steps, size[0], size[1], channels),
+                dtype=np.uint8,
+                chunks=(1, size[0], size[1], channels)
+            )
+            for start in range(0, time_steps, self.chunk_len):
+                end = min(start + self.chunk_len, time_steps)
+                images[start: end] = resize_uint8(frames[start: end], size)
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, episode_path: str, cam_name: str, size: Sequence[int], ts: int) -> np.ndarray:
+        """Return the resized frame (h, w, c) of camera `cam_name` at time step `ts`"""
+        import h5py
+        path = self.build(episode_path, cam_name, size)
+        with h5py.File(path, 'r') as f:
+            return f["images"][ts]
+
+
+def _build(job):
+    cache, episode_path, cam_name, size = job
+    return cache.build(episode_path, cam_name, size)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Pre-resize the camera frames of a dataset.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default="",
+        help="Directory of the episodes (*.h5)."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/basic.toml",
+        help="Config providing the cameras and their input resolution."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes resizing episodes."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    from act_pytorch.utils.train_utils import load_config
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # the config has a `num_workers` of its own (the DataLoader's)
+    cache_workers = args.num_workers
+    load_config(args, args.config)
+    image_sizes = get_image_sizes(args)
+    if image_sizes is None:
+        print("No input resolution configured, nothing to cache.")
+        return
+    cache = ImageCache(args.dataset_dir)
+    file_paths = sorted(glob(os.path.join(args.dataset_dir, '*.h5')))
+    jobs = [
+        (cache, path, cam_name, size)
+        for path in file_paths
+        for cam_name, size in zip(args.cameras, image_sizes)
+    ]
+    with Pool(max(1, cache_workers)) as pool:
+        for _ in pool.imap_unordered(_build, jobs):
+            pass
+    print(f"Cached {len(jobs)} camera streams of {len(file_paths)} episodes in {cache.cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,22 +3,29 @@ import h5py
 import torch
 import numpy as np
 from glob import glob
-from torch.utils.data import Dataset, DataLoader
-from act_pytorch.utils.train_utils import get_norm_stats
-
-import IPython
-e = IPython.embed
+import torch.distributed as dist
+from torch.utils.data import Dataset, DataLoader, DistributedSampler, Sampler
+from act_pytorch.utils.train_utils import get_norm_stats, is_main_process
+from act_pytorch.utils.manifest import load_manifests, norm_stats_from_records
+from act_pytorch.utils.shards import ShardDataset, norm_stats_from_shards, read_index
+from act_pytorch.utils.image_cache import ImageCache, get_image_sizes, resize_uint8
 
 class ACTDataset(Dataset):
-    def __init__(self, args, norm_stats):
+    def __init__(self, args, norm_stats, file_paths=None):
         super().__init__()
         self.num_queries = args.action_horizon
         self.dataset_dir = args.dataset_dir
         self.camera_names = args.cameras
         self.norm_stats = norm_stats
         self.full_episode = args.full_episode
-        file_paths = os.path.join(self.dataset_dir, '*.h5')
-        self.file_paths = glob(file_paths)
+        # per-camera input resolution, resized frames are cached on disk if enabled
+        self.image_sizes = get_image_sizes(args)
+        self.image_cache = None
+        if self.image_sizes is not None and getattr(args, "image_cache", False):
+            self.image_cache = ImageCache(self.dataset_dir)
+        if file_paths is None:
+            file_paths = glob(os.path.join(self.dataset_dir, '*.h5'))
+        self.file_paths = file_paths
 
     def __len__(self):
         return len(self.file_paths)
@@ -26,50 +33,269 @@ class ACTDataset(Dataset):
     def __getitem__(self, idx):
         path = self.file_paths[idx]
         with h5py.File(path, 'r') as f:
-            action = f['/action'][:]  # (time_steps, action_dim)
-            time_steps = action.shape[0]
+            time_steps = f['/action'].shape[0]
             if self.full_episode:
                 start_ts = 0
             else:
                 start_ts = np.random.choice(time_steps)
-            qpos = f['/observations/qpos'][:][start_ts]  # (pos_dim,)
-            images = []
-            for cam_name in self.camera_names:
-                images.append(f[f'/observations/images/{cam_name}'][:][start_ts])        
-            # concatenate images
-            image = np.stack(images, axis=0)  # (num_camera, h, w, c)
-            # normalize actions and joint positions
-            action = ((action - self.norm_stats["action_mean"]) / self.norm_stats["action_std"]).squeeze()
-            qpos = ((qpos - self.norm_stats["qpos_mean"]) / self.norm_stats["qpos_std"]).squeeze()
-            # action sequence zero padding
-            zero_pad = np.zeros((self.num_queries - 1, action.shape[1]), dtype=np.float32)
-            action = np.concatenate([action, zero_pad], axis=0)
-            is_pad = np.zeros(action.shape[0])
-            is_pad[time_steps: ] = 1  # define where sequences of zero padding are
-            # get action chunkings
-            action_seq = action[start_ts: (start_ts + self.num_queries)]
-            is_pad = is_pad[start_ts: (start_ts + self.num_queries)]
-            # transform nd.array to torch.tensor
-            image = torch.from_numpy(image).permute(0, 3, 1, 2)  # (num_camera, c, h, w)
-            qpos = torch.from_numpy(qpos).float()  # (pos_dim,)
-            action_seq = torch.from_numpy(action_seq).float()  # (num_queries, action_dim)
-            is_pad = torch.from_numpy(is_pad).bool()  # (num_queries,)
-            # normalize images pixel intensity to [0, 1] (if necessary)
-            image = image / 255.0
-            return image, qpos, action_seq, is_pad
-                        
-
-def load_data(args):
-    # obtain normalization stats for qpos and action
-    norm_stats = get_norm_stats(args)
-    # Construct dataset and dataloader
-    dataset = ACTDataset(args, norm_stats)
+            # only read the time step and the action chunk of the sample
+            action = f['/action'][start_ts: (start_ts + self.num_queries)]  # (<= num_queries, action_dim)
+            qpos = f['/observations/qpos'][start_ts]  # (pos_dim,)
+            image = self.load_frames(f, path, start_ts, start_ts + 1)[0]  # (num_camera, h, w, c)
+        return self.make_sample(image, qpos, action)
+
+    def make_sample(self, image, qpos, action):
+        """Training sample from the frames (num_camera, h, w, c), the joint positions and the
+        (at most `num_queries`) following actions of a time step"""
+        # normalize actions and joint positions
+        action = (action - self.norm_stats["action_mean"]) / self.norm_stats["action_std"]
+        qpos = ((qpos - self.norm_stats["qpos_mean"]) / self.norm_stats["qpos_std"]).squeeze()
+        # action sequence zero padding beyond the end of the episode
+        action_seq = np.zeros((self.num_queries, action.shape[1]), dtype=np.float32)
+        action_seq[:action.shape[0]] = action
+        is_pad = np.zeros(self.num_queries)
+        is_pad[action.shape[0]: ] = 1  # define where sequences of zero padding are
+        # transform nd.array to torch.tensor
+        image = torch.from_numpy(image).permute(0, 3, 1, 2)  # (num_camera, c, h, w)
+        qpos = torch.from_numpy(qpos).float()  # (pos_dim,)
+        action_seq = torch.from_numpy(action_seq).float()  # (num_queries, action_dim)
+        is_pad = torch.from_numpy(is_pad).bool()  # (num_queries,)
+        # normalize images pixel intensity to [0, 1] (if necessary)
+        image = image / 255.0
+        return image, qpos, action_seq, is_pad
+
+    def load_frames(self, f, path, start_ts, end_ts):
+        """Frames of all cameras in time steps [start_ts, end_ts) of the opened episode `f`,
+        stacked as (time_steps, num_camera, h, w, c)"""
+        images = []
+        for cam_id, cam_name in enumerate(self.camera_names):
+            if self.image_cache is not None:
+                frames = self.image_cache.get(path, cam_name, self.image_sizes[cam_id], slice(start_ts, end_ts))
+            else:
+                frames = f[f'/observations/images/{cam_name}'][start_ts: end_ts]
+                if self.image_sizes is not None:
+                    frames = resize_uint8(frames, self.image_sizes[cam_id])
+            images.append(frames)
+        # concatenate images
+        return self.stack_images(images)
+
+    def stack_images(self, images):
+        """Stack camera frames (time_steps, h, w, c), placing them on a common canvas if their resolutions differ"""
+        if self.image_sizes is None:
+            return np.stack(images, axis=1)
+        canvas_h = max(h for h, _ in self.image_sizes)
+        canvas_w = max(w for _, w in self.image_sizes)
+        time_steps, channels = images[0].shape[0], images[0].shape[-1]
+        image = np.zeros((time_steps, len(images), canvas_h, canvas_w, channels), dtype=images[0].dtype)
+        for cam_id, frames in enumerate(images):
+            image[:, cam_id, :frames.shape[1], :frames.shape[2]] = frames
+        return image
+
+
+class SharedEpisodes:
+    """
+    Frames (at the input resolution), joint positions and actions of every episode of
+    `file_paths`, read once into shared memory. Processes receiving it (e.g. through a
+    `torch.multiprocessing` pool) read the same memory instead of the files.
+    """
+    def __init__(self, args, file_paths):
+        reader = ACTDataset(args, None, file_paths)
+        self.paths = list(file_paths)
+        lengths = []
+        for path in self.paths:
+            with h5py.File(path, 'r') as f:
+                lengths.append(f['/action'].shape[0])
+        self.starts = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        self.index = {path: i for i, path in enumerate(self.paths)}
+        self.images = self.qpos = self.action = None
+        for i, path in enumerate(self.paths):
+            with h5py.File(path, 'r') as f:
+                image = reader.load_frames(f, path, 0, lengths[i])  # (time_steps, num_camera, h, w, c)
+                qpos = f['/observations/qpos'][:]
+                action = f['/action'][:]
+            if self.images is None:
+                # allocate once the shapes are known
+                self.images = torch.empty((self.starts[-1],) + image.shape[1:], dtype=torch.uint8).share_memory_()
+                self.qpos = torch.empty((self.starts[-1],) + qpos.shape[1:], dtype=torch.float32).share_memory_()
+                self.action = torch.empty((self.starts[-1],) + action.shape[1:], dtype=torch.float32).share_memory_()
+            self.images[self.starts[i]: self.starts[i + 1]] = torch.from_numpy(image)
+            self.qpos[self.starts[i]: self.starts[i + 1]] = torch.from_numpy(qpos)
+            self.action[self.starts[i]: self.starts[i + 1]] = torch.from_numpy(action)
+
+    def episode(self, path):
+        """Frames, joint positions and actions of an episode (numpy views of the shared memory)"""
+        i = self.index[path]
+        start, end = self.starts[i], self.starts[i + 1]
+        return self.images[start: end].numpy(), self.qpos[start: end].numpy(), self.action[start: end].numpy()
+
+
+class SharedEpisodeDataset(ACTDataset):
+    """`ACTDataset` sampling the episodes of a `SharedEpisodes` instead of reading files"""
+    def __init__(self, args, norm_stats, episodes: SharedEpisodes, file_paths=None):
+        super().__init__(args, norm_stats, file_paths if file_paths is not None else episodes.paths)
+        self.episodes = episodes
+
+    def __getitem__(self, idx):
+        image, qpos, action = self.episodes.episode(self.file_paths[idx])
+        time_steps = action.shape[0]
+        start_ts = 0 if self.full_episode else np.random.choice(time_steps)
+        return self.make_sample(image[start_ts], qpos[start_ts], action[start_ts: start_ts + self.num_queries])
+
+
+class WeightedEpisodeSampler(Sampler):
+    """
+    Draw `num_samples` episodes (with replacement) with probabilities proportional to
+    `weights`, split between the ranks of a distributed run. The draws depend on the seed
+    and the epoch (`set_epoch`) only, so every rank takes its part of the same draws.
+    """
+    def __init__(self, weights, num_samples, seed=0):
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.num_replicas = dist.get_world_size() if dist.is_initialized() else 1
+        self.rank = dist.get_rank() if dist.is_initialized() else 0
+        self.num_samples = -(-num_samples // self.num_replicas)
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        indices = torch.multinomial(self.weights, self.num_samples * self.num_replicas, True, generator=generator)
+        return iter(indices[self.rank::self.num_replicas].tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+def episode_records(args):
+    """Records of the episodes of `args.manifests` by path (None without manifests)"""
+    manifests = getattr(args, "manifests", None)
+    if not manifests:
+        return None
+    return load_manifests(manifests, getattr(args, "manifest_weights", None))
+
+
+def split_episodes(args, episodes=None, records=None):
+    """Split the episodes (of the manifest `records` if given) into training and held-out
+    validation episodes (`args.val_ratio`)"""
+    if episodes is not None:
+        file_paths = sorted(episodes.paths)
+    elif records is not None:
+        file_paths = sorted(records)
+    else:
+        file_paths = sorted(glob(os.path.join(args.dataset_dir, '*.h5')))
+    val_ratio = getattr(args, "val_ratio", 0.0)
+    num_val = int(round(len(file_paths) * val_ratio))
+    if val_ratio > 0:
+        num_val = min(max(num_val, 1), len(file_paths) - 1)
+    # the split only depends on the seed, so it is the same for every run and rank
+    order = np.random.RandomState(args.seed).permutation(len(file_paths))
+    val_paths = [file_paths[i] for i in sorted(order[:num_val])]
+    train_paths = [file_paths[i] for i in sorted(order[num_val:])]
+    return train_paths, val_paths
+
+
+def load_shard_data(args, norm_stats=None):
+    """Loader streaming the tar shards of `args.shard_dir`"""
+    if norm_stats is None:
+        norm_stats = norm_stats_from_shards(args.shard_dir)
+    num_workers = getattr(args, "num_workers", 8)
+    dataset = ShardDataset(args, norm_stats, args.shard_dir, num_workers=num_workers,
+                           shuffle_buffer=getattr(args, "shuffle_buffer", 1000))
     dataloader = DataLoader(
         dataset,
         batch_size=args.batch,
-        shuffle=True,
-        pin_memory=True,
-        num_workers=8,
-        prefetch_factor=1
+        pin_memory=torch.cuda.is_available(),
+        num_workers=num_workers,
+        prefetch_factor=getattr(args, "prefetch_factor", 1) if num_workers > 0 else None,
+        # the workers keep their place in the shard stream from epoch to epoch
+        persistent_workers=num_workers > 0
     )
     return dataloader, norm_stats
+
+
+def tune_loader(args, dataset, step_fn=None):
+    """Set `args.num_workers`, `args.prefetch_factor` and (unless distributed, where every rank
+    must run the same number of steps) `args.batch` / `args.grad_accum_steps` by `autotune_loader`"""
+    from act_pytorch.utils.loader_autotune import autotune_loader
+    if getattr(args, "manifests", None):
+        dataset_id = ",".join(os.path.abspath(path) for path in args.manifests)
+    else:
+        dataset_id = os.path.abspath(args.dataset_dir)
+    memory_limit = int(args.loader_memory_gb * 2**30) if getattr(args, "loader_memory_gb", 0) > 0 else None
+    choice = autotune_loader(args, dataset, dataset_id, step_fn, memory_limit, tune_batch=not dist.is_initialized())
+    args.num_workers = choice["num_workers"]
+    args.prefetch_factor = choice["prefetch_factor"]
+    args.batch = choice["batch"]
+    args.grad_accum_steps = choice["grad_accum_steps"]
+    if is_main_process():
+        step = f", training step {choice['step_samples_per_sec']:.1f} samples/s" \
+            if choice["step_samples_per_sec"] is not None else ""
+        print(f"Loader autotune{' (cached)' if choice['cached'] else ''}: {choice['samples_per_sec']:.1f} samples/s"
+              f"{step}{'' if choice['fed'] else ', the training step waits for data'}")
+
+
+def load_data(args, norm_stats=None, episodes=None, step_fn=None, memory_monitor=None):
+    """Training loader and normalization stats. With `args.autotune_loader`, the loader settings
+    are tuned first, `step_fn` (a training step on a batch) tells how fast data is consumed.
+    The memory of the stages is recorded by `memory_monitor` if given."""
+    from act_pytorch.utils.memory import MemoryMonitor
+    memory_monitor = memory_monitor if memory_monitor is not None else MemoryMonitor()
+    if getattr(args, "shard_dir", None) and episodes is None:
+        return load_shard_data(args, norm_stats)
+    # episodes listed by manifests are not looked up on the file system
+    records = episode_records(args) if episodes is None else None
+    train_paths, _ = split_episodes(args, episodes, records)
+    # obtain normalization stats for qpos and action (unless given, e.g. those of a teacher),
+    # from the moments in the manifests if there are any
+    with memory_monitor.stage("norm_stats", always=True):
+        if norm_stats is None and records is not None:
+            norm_stats = norm_stats_from_records([records[path] for path in train_paths])
+        elif norm_stats is None:
+            norm_stats = get_norm_stats(args, train_paths, episodes)
+    # Construct dataset and dataloader (from memory if the episodes are preloaded)
+    if episodes is not None:
+        dataset = SharedEpisodeDataset(args, norm_stats, episodes, train_paths)
+    else:
+        dataset = ACTDataset(args, norm_stats, train_paths)
+    num_workers = getattr(args, "num_workers", 8)
+    if episodes is not None:
+        # preloaded episodes need no loading workers
+        num_workers = 0
+    elif getattr(args, "autotune_loader", False):
+        with memory_monitor.stage("autotune_loader", always=True):
+            tune_loader(args, dataset, step_fn)
+        num_workers = args.num_workers
+    # every rank of a distributed run samples its own shard of the episodes
+    sampler = None
+    if records is not None and getattr(args, "manifest_weights", None):
+        # each source is sampled in proportion to its weight, whatever its number of episodes
+        source_sizes = np.bincount([records[path]["source"] for path in train_paths])
+        weights = [records[path]["weight"] / source_sizes[records[path]["source"]] for path in train_paths]
+        sampler = WeightedEpisodeSampler(weights, len(dataset), seed=args.seed)
+    elif dist.is_initialized():
+        sampler = DistributedSampler(dataset, shuffle=True, seed=args.seed)
+    dataloader = DataLoader(
+        dataset,
+        batch_size=args.batch,
+        shuffle=sampler is None,
+        sampler=sampler,
+        pin_memory=torch.cuda.is_available(),
+        num_workers=num_workers,
+        prefetch_factor=getattr(args, "prefetch_factor", 1) if num_workers > 0 else None
+    )
+    return dataloader, norm_stats
+
+
+def load_val_data(args, norm_stats, episodes=None):
+    """Held-out validation episodes (normalized with the training stats)"""
+    if getattr(args, "shard_dir", None) and episodes is None:
+        # left out when packing
+        return ACTDataset(args, norm_stats, read_index(args.shard_dir)["val_episodes"])
+    records = episode_records(args) if episodes is None else None
+    _, val_paths = split_episodes(args, episodes, records)
+    if episodes is not None:
+        return SharedEpisodeDataset(args, norm_stats, episodes, val_paths)
+    return ACTDataset(args, norm_stats, val_paths)
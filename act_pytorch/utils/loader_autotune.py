@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import socket
+import torch.distributed as dist
+from typing import Callable, Dict, List, Optional
+from torch.utils.data import DataLoader, RandomSampler
+from act_pytorch.utils.memory import available_memory, process_memory
+
+CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "act_pytorch",
+    "loader_autotune.json"
+)
+
+
+def loader_memory(iterator, batch_bytes: int, num_workers: int, prefetch_factor: int) -> int:
+    """Memory of the loading workers (their PSS on Linux, else the batches in flight)"""
+    workers = getattr(iterator, "_workers", [])
+    sizes = [process_memory(worker.pid)["pss"] for worker in workers]
+    in_flight = batch_bytes * max(num_workers, 1) * (prefetch_factor or 1)
+    if len(sizes) == 0 or any(size is None for size in sizes):
+        return in_flight
+    return sum(sizes) + in_flight
+
+
+def batch_nbytes(batch) -> int:
+    return sum(tensor.numel() * tensor.element_size() for tensor in batch)
+
+
+def probe(dataset, batch: int, num_workers: int, prefetch_factor: int, num_batches: int = 8) -> Dict[str, object]:
+    """Samples/s of a DataLoader setting once its workers are running, and its memory"""
+    # sample with replacement, the probe does not depend on the size of the dataset
+    sampler = RandomSampler(dataset, replacement=True, num_samples=batch * (num_workers + 1 + num_batches) * 2)
+    loader = DataLoader(
+        dataset,
+        batch_size=batch,
+        sampler=sampler,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor if num_workers > 0 else None
+    )
+    iterator = iter(loader)
+    # the first batch of every worker includes its start-up
+    for _ in range(max(num_workers, 1)):
+        first = next(iterator)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        next(iterator)
+    elapsed = time.perf_counter() - start
+    memory = loader_memory(iterator, batch_nbytes(first), num_workers, prefetch_factor)
+    del iterator
+    return {"samples_per_sec": batch * num_batches / elapsed, "memory": memory, "first_batch": first}
+
+
+def step_rate(step_fn: Callable, batch_data, repeats: int = 3) -> float:
+    """Samples/s of the training step `step_fn` on a batch"""
+    step_fn(batch_data)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step_fn(batch_data)
+    return batch_data[0].shape[0] * repeats / (time.perf_counter() - start)
+
+
+def cache_key(args, dataset_id: str) -> str:
+    world_size = dist.get_world_size() if dist.is_initialized() else 1
+    return json.dumps([socket.gethostname(), os.cpu_count(), world_size, dataset_id, args.batch,
+                       args.grad_accum_steps, list(args.cameras), args.image_size])
+
+
+def candidate_workers(max_workers: int) -> List[int]:
+    workers, n = [], 1
+    while n < max_workers:
+        workers.append(n)
+        n *= 2
+    return workers + [max_workers]
+
+
+def autotune_loader(args, dataset, dataset_id: str, step_fn: Optional[Callable] = None,
+                    memory_limit: Optional[int] = None, tune_batch: bool = True) -> Dict[str, object]:
+    """
+    Pick DataLoader settings for `dataset` by probing its throughput: the number of workers
+    (from 1, doubling them while the model is not fed and each doubling still gains 10%),
+    then the prefetch depth. Loading in the main process (0 workers) is kept only if it
+    trains faster, its loading and the training step taking turns. A setting feeds the model
+    if it delivers at least the samples/s of `step_fn` (a training step on a batch). Settings
+    whose workers use more than `memory_limit` bytes (half of the available memory if not
+    given) are skipped. If even the batch does not fit and `tune_batch`, a smaller micro-batch
+    with more gradient accumulation is used (the effective batch is unchanged). The choice is
+    cached per host, dataset and batch in `CACHE_PATH`.
+
+    Return {"num_workers", "prefetch_factor", "batch", "grad_accum_steps", "samples_per_sec",
+    "step_samples_per_sec", "fed", "cached"}.
+    """
+    key = cache_key(args, dataset_id)
+    cache = {}
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+    if key in cache:
+        return dict(cache[key], cached=True)
+    if memory_limit is None:
+        available = available_memory()
+        memory_limit = available // 2 if available is not None else float("inf")
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", 1))
+    max_workers = max(1, os.cpu_count() // local_world_size - 1)
+    results = {}
+
+    def run(num_workers, prefetch_factor, batch):
+        setting = (num_workers, prefetch_factor, batch)
+        if setting not in results:
+            results[setting] = probe(dataset, batch, num_workers, prefetch_factor)
+        result = results[setting]
+        return result["samples_per_sec"] if result["memory"] <= memory_limit else 0.0
+
+    best_prefetch, best_batch = 2, args.batch
+    serial_rate = run(0, best_prefetch, best_batch)
+    step_samples_per_sec = None
+    if step_fn is not None:
+        step_samples_per_sec = step_rate(step_fn, results[(0, best_prefetch, best_batch)]["first_batch"])
+
+    def fed(num_workers, rate):
+        # without workers, loading and the training step take turns
+        return num_workers > 0 and (step_samples_per_sec is None or rate >= step_samples_per_sec)
+
+    def training_rate(num_workers, rate):
+        """Samples/s of training with a loader of `rate` samples/s"""
+        if step_samples_per_sec is None or rate == 0:
+            return rate
+        if num_workers == 0:
+            # serial: the load time and the step time of every sample add up
+            return 1 / (1 / rate + 1 / step_samples_per_sec)
+        return min(rate, step_samples_per_sec)
+
+    # workers, each count compared to the previous one, until the model is fed or doubling
+    # them gains less than 10%
+    best_workers, best_rate = None, 0.0
+    for num_workers in candidate_workers(max_workers):
+        rate = run(num_workers, best_prefetch, args.batch)
+        if rate == 0 or (best_workers is not None and rate < best_rate * 1.1):
+            break
+        best_workers, best_rate = num_workers, rate
+        if step_samples_per_sec is not None and fed(best_workers, best_rate):
+            break
+    # in-process loading only if no worker count trains faster
+    if best_workers is None or training_rate(0, serial_rate) > training_rate(best_workers, best_rate):
+        best_workers, best_rate = 0, serial_rate
+    # prefetch depth
+    if best_workers > 0:
+        best_prefetch = max((1, 2, 4), key=lambda prefetch: run(best_workers, prefetch, args.batch))
+        best_rate = run(best_workers, best_prefetch, args.batch)
+    # a smaller micro-batch only if the batch does not fit in memory, it does not load samples
+    # any faster (the effective batch args.batch * args.grad_accum_steps stays the same)
+    if tune_batch and best_rate == 0:
+        for batch in (args.batch // 2, args.batch // 4):
+            if batch > 0 and args.batch % batch == 0 and run(best_workers, best_prefetch, batch) > 0:
+                best_batch = batch
+                break
+    best = results[(best_workers, best_prefetch, best_batch)]
+    choice = {
+        "num_workers": best_workers,
+        "prefetch_factor": best_prefetch,
+        "batch": best_batch,
+        "grad_accum_steps": args.grad_accum_steps * args.batch // best_batch,
+        "samples_per_sec": best["samples_per_sec"],
+        "step_samples_per_sec": step_samples_per_sec,
+        "fed": fed(best_workers, best["samples_per_sec"]),
+        "probes": [
+            {"num_workers": w, "prefetch_factor": p, "batch": b, "samples_per_sec": r["samples_per_sec"],
+             "memory": r["memory"]}
+            for (w, p, b), r in results.items()
+        ],
+    }
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    # other runs may have tuned in the meantime
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH, 'r') as f:
+            cache = json.load(f)
+    cache[key] = choice
+    tmp_path = f"{CACHE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, CACHE_PATH)
+    return dict(choice, cached=False)
@@ -0,0 +1,208 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from glob import glob
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Sequence
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def find_episodes(dataset_dir: str) -> List[str]:
+    return sorted(glob(os.path.join(dataset_dir, '*.h5')) + glob(os.path.join(dataset_dir, '*.hdf5')))
+
+
+def moments(data: np.ndarray) -> dict:
+    """Sums and sums of squares over the time steps of (time_steps, dim) data"""
+    data = data.astype(np.float64)
+    return {"sum": data.sum(axis=0).tolist(), "sumsq": (data ** 2).sum(axis=0).tolist()}
+
+
+def episode_record(path: str) -> dict:
+    """
+    Summary of an episode: length, cameras (with their frame shapes), size and moments
+    (sums and sums of squares over the time steps) of joint positions and actions, from
+    which normalization stats of any set of episodes follow without reading them again.
+    """
+    import h5py
+    stat = os.stat(path)
+    record = {"path": os.path.abspath(path), "bytes": stat.st_size, "mtime": stat.st_mtime}
+    with h5py.File(path, 'r') as f:
+        record["length"] = int(f['/action'].shape[0])
+        images = f['/observations/images']
+        record["cameras"] = {cam_name: list(images[cam_name].shape[1:]) for cam_name in sorted(images)}
+        record["qpos"] = moments(f['/observations/qpos'][:])
+        record["action"] = moments(f['/action'][:])
+    return record
+
+
+def read_manifest(manifest_dir: str) -> dict:
+    """Index of a manifest (without its episodes)"""
+    with open(os.path.join(manifest_dir, MANIFEST_NAME), 'r') as f:
+        return json.load(f)
+
+
+def load_manifest(manifest_dir: str) -> List[dict]:
+    """Episode records of all shards of a manifest, with absolute paths"""
+    index = read_manifest(manifest_dir)
+    records = []
+    for shard in index["shards"]:
+        with open(os.path.join(manifest_dir, shard["file"]), 'r') as f:
+            for line in f:
+                record = json.loads(line)
+                record["path"] = os.path.normpath(os.path.join(manifest_dir, record["path"]))
+                records.append(record)
+    return records
+
+
+def load_manifests(manifest_dirs: Sequence[str], weights: Optional[Sequence[float]] = None) -> Dict[str, dict]:
+    """
+    Episode records of several manifests (sources) by path. Every record gets the index
+    of its source and the sampling weight of the source (1 for all if `weights` is not given).
+    """
+    if weights is not None and len(weights) > 0 and len(weights) != len(manifest_dirs):
+        raise ValueError(f"Got {len(weights)} sampling weights for {len(manifest_dirs)} manifests.")
+    records = {}
+    for source, manifest_dir in enumerate(manifest_dirs):
+        for record in load_manifest(manifest_dir):
+            record["source"] = source
+            record["weight"] = float(weights[source]) if weights else 1.0
+            # an episode listed by several manifests belongs to the first one
+            records.setdefault(record["path"], record)
+    return records
+
+
+def norm_stats_from_records(records: Sequence[dict]) -> Dict[str, np.ndarray]:
+    """Mean and (unbiased) std of joint positions and actions over all time steps of the
+    episodes, as `get_norm_stats` computes them from the files"""
+    count = sum(record["length"] for record in records)
+    stats = {}
+    for key in ("action", "qpos"):
+        total = np.sum([record[key]["sum"] for record in records], axis=0)
+        total_sq = np.sum([record[key]["sumsq"] for record in records], axis=0)
+        mean = total / count
+        var = np.maximum(total_sq - count * mean ** 2, 0.0) / max(count - 1, 1)
+        std = np.clip(np.sqrt(var), 1e-2, np.inf)  # clipping
+        stats[f"{key}_mean"] = mean[None].astype(np.float32)
+        stats[f"{key}_std"] = std[None].astype(np.float32)
+    return stats
+
+
+def write_manifest(manifest_dir: str, records: Sequence[dict], sources: Sequence[str], shard_size: int = 1000):
+    """Write the records as JSON lines shards (paths relative to `manifest_dir`) and the
+    index. Shards are written to temporary files and renamed, the index last."""
+    os.makedirs(manifest_dir, exist_ok=True)
+    records = sorted(records, key=lambda record: record["path"])
+    shards = []
+    for shard_id, start in enumerate(range(0, len(records), shard_size)):
+        shard_records = records[start: start + shard_size]
+        name = f"shard_{shard_id:05d}.jsonl"
+        tmp_path = os.path.join(manifest_dir, f"{name}.tmp")
+        with open(tmp_path, 'w') as f:
+            for record in shard_records:
+                record = dict(record, path=os.path.relpath(record["path"], manifest_dir))
+                f.write(json.dumps(record) + '\n')
+        os.replace(tmp_path, os.path.join(manifest_dir, name))
+        shards.append({
+            "file": name,
+            "num_episodes": len(shard_records),
+            "num_steps": sum(record["length"] for record in shard_records),
+            "num_bytes": sum(record["bytes"] for record in shard_records)
+        })
+    index = {
+        "version": MANIFEST_VERSION,
+        "sources": [os.path.relpath(source, manifest_dir) for source in sources],
+        "num_episodes": len(records),
+        "num_steps": sum(shard["num_steps"] for shard in shards),
+        "num_bytes": sum(shard["num_bytes"] for shard in shards),
+        "shards": shards
+    }
+    tmp_path = os.path.join(manifest_dir, f"{MANIFEST_NAME}.tmp")
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, os.path.join(manifest_dir, MANIFEST_NAME))
+    # shards left over from a larger manifest
+    names = {shard["file"] for shard in shards}
+    for path in glob(os.path.join(manifest_dir, "shard_*.jsonl")):
+        if os.path.basename(path) not in names:
+            os.remove(path)
+    return index
+
+
+def build_manifest(manifest_dir: str, dataset_dirs: Sequence[str] = (), shard_size: int = 1000,
+                   num_workers: int = 1):
+    """
+    Create or update the manifest of the episodes in `dataset_dirs` and in the directories
+    the manifest already lists. Only new episodes and episodes whose size or modification
+    time changed are read, episodes that no longer exist are dropped.
+    Return the index and the number of episodes read.
+    """
+    sources = [os.path.abspath(d) for d in dataset_dirs]
+    old_records = {}
+    if os.path.exists(os.path.join(manifest_dir, MANIFEST_NAME)):
+        index = read_manifest(manifest_dir)
+        sources = [os.path.normpath(os.path.join(manifest_dir, s)) for s in index["sources"]] + sources
+        old_records = {record["path"]: record for record in load_manifest(manifest_dir)}
+    sources = list(dict.fromkeys(sources))
+    records, jobs = [], []
+    for source in sources:
+        for path in find_episodes(source):
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            old = old_records.get(path)
+            if old is not None and old["bytes"] == stat.st_size and old["mtime"] == stat.st_mtime:
+                records.append(old)
+            else:
+                jobs.append(path)
+    with Pool(max(1, num_workers)) as pool:
+        records.extend(pool.imap_unordered(episode_record, jobs))
+    return write_manifest(manifest_dir, records, sources, shard_size), len(jobs)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Create or update the sharded manifest of one or more episode directories.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        required=True,
+        help="Directory of the manifest (updated if it exists)."
+    )
+    parser.add_argument(
+        "--dataset_dirs",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Directories of the episodes (*.h5, *.hdf5) to add, "
+             "the directories already listed are rescanned."
+    )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=1000,
+        help="Episodes per shard."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes reading episodes."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    index, num_read = build_manifest(args.manifest, args.dataset_dirs, args.shard_size, args.num_workers)
+    print(f"{index['num_episodes']} episodes ({index['num_steps']} time steps, {index['num_bytes'] / 2**30:.2f} GB) "
+          f"in {len(index['shards'])} shards, {num_read} read")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+import os
+import sys
+import argparse
+import contextlib
+import resource
+import h5py
+import torch
+import numpy as np
+from glob import glob
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from act_pytorch.utils.image_cache import get_image_sizes
+from act_pytorch.utils.manifest import load_manifests
+from act_pytorch.utils.train_utils import load_config
+
+MB = 2**20
+
+
+def _read_kb(path: str, fields: Sequence[str]) -> Dict[str, int]:
+    """Fields (in kB, returned in bytes) of a /proc file such as status or meminfo"""
+    values = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    values[name] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return values
+
+
+def process_memory(pid="self") -> Dict[str, Optional[int]]:
+    """
+    RSS, peak RSS, PSS (shared pages split between their users) and private memory of a
+    process, None where unavailable (outside Linux). Private memory includes the pages a
+    DataLoader worker duplicated by writing to memory inherited copy-on-write.
+    """
+    status = _read_kb(f"/proc/{pid}/status", ("VmRSS", "VmHWM"))
+    smaps = _read_kb(f"/proc/{pid}/smaps_rollup", ("Pss", "Private_Clean", "Private_Dirty"))
+    memory = {
+        "rss": status.get("VmRSS"),
+        "peak": status.get("VmHWM"),
+        "pss": smaps.get("Pss"),
+        "private": smaps["Private_Clean"] + smaps["Private_Dirty"] if "Private_Dirty" in smaps else None,
+    }
+    if memory["peak"] is None and pid == "self":
+        memory["peak"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return memory
+
+
+def available_memory() -> Optional[int]:
+    return _read_kb("/proc/meminfo", ("MemAvailable",)).get("MemAvailable")
+
+
+def reset_peak(device: torch.device) -> bool:
+    """Restart the peak of `peak_memory`, False if it cannot be (then the peak is the lifetime one)"""
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+        return True
+    try:
+        # resets the peak RSS (VmHWM) of the process
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_memory(device: torch.device) -> int:
+    """Allocated memory of a GPU, else the RSS of the process"""
+    if device.type == 'cuda':
+        return torch.cuda.memory_allocated(device)
+    return process_memory()["rss"] or 0
+
+
+def peak_memory(device: torch.device) -> int:
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return process_memory()["peak"] or 0
+
+
+def tensor_bytes(tensors: Iterable[torch.Tensor]) -> int:
+    """Bytes of the storages of `tensors`, each storage counted once"""
+    storages = {}
+    for tensor in tensors:
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
+
+
+def model_memory(model: torch.nn.Module, optimizer: Optional[torch.optim.Optimizer] = None) -> Dict[str, int]:
+    """Bytes of the parameters (and buffers), of their gradients while they exist, and of the optimizer state"""
+    parameters = list(model.parameters())
+    state = [] if optimizer is None else [
+        value for param_state in optimizer.state.values() for value in param_state.values() if torch.is_tensor(value)
+    ]
+    return {
+        "parameters": tensor_bytes(parameters + list(model.buffers())),
+        "gradients": tensor_bytes(param.grad for param in parameters if param.grad is not None),
+        "optimizer": tensor_bytes(state),
+    }
+
+
+class SavedTensors:
+    """
+    Context counting the bytes of the tensors autograd saves for the backward pass, i.e. the
+    activations kept until backward (parameters excluded). Inside activation checkpointing,
+    only the inputs of the checkpointed segments are seen, as they are all that is kept.
+    """
+    def __init__(self, model: torch.nn.Module):
+        self.excluded = {param.untyped_storage().data_ptr() for param in model.parameters()}
+        self.storages = {}
+        self.hooks = torch.autograd.graph.saved_tensors_hooks(self.pack, lambda tensor: tensor)
+
+    def pack(self, tensor):
+        storage = tensor.untyped_storage()
+        if storage.data_ptr() not in self.excluded:
+            self.storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self.storages.values())
+
+    def __enter__(self):
+        self.hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.hooks.__exit__(*exc)
+
+
+class MemoryMonitor:
+    """
+    Memory breakdown of training, logged every `every` steps (never if 0) to `logger` and,
+    as a "memory" record, to `metric_logger`:
+    - RSS, peak RSS, PSS and private memory of the main process and of every DataLoader worker;
+    - the peak above its start of every stage (allocated memory on a GPU, RSS on CPU) run
+      during the logged step, and of the startup stages (`always`) since the last log;
+    - the activations saved for backward and the memory of parameters, gradients and
+      optimizer state.
+    Stages cost nothing on the other steps.
+    """
+    def __init__(self, device: Optional[torch.device] = None, every: int = 0, logger=None,
+                 metric_logger=None, start_step: int = 0):
+        self.device = device if device is not None else torch.device('cpu')
+        self.every = every
+        self.logger = logger
+        self.metric_logger = metric_logger
+        self.global_step = start_step
+        self.stages = {}
+        self.activation_bytes = None
+
+    def active(self) -> bool:
+        """Whether the current step is logged"""
+        return self.every > 0 and (self.global_step + 1) % self.every == 0
+
+    @contextlib.contextmanager
+    def stage(self, name: str, always: bool = False):
+        if self.every <= 0 or not (always or self.active()):
+            yield
+            return
+        reset = reset_peak(self.device)
+        start = current_memory(self.device)
+        try:
+            yield
+        finally:
+            end = current_memory(self.device)
+            peak = peak_memory(self.device) if reset else max(start, end)
+            self.stages[name] = {"start": start, "peak": peak, "end": end}
+
+    @contextlib.contextmanager
+    def activations(self, model: torch.nn.Module):
+        """Count the activations saved for backward by the forward pass run inside"""
+        if not self.active():
+            yield
+            return
+        with SavedTensors(model) as saved:
+            yield
+        self.activation_bytes = saved.nbytes
+
+    def step(self, model: torch.nn.Module, optimizer: torch.optim.Optimizer, workers: Sequence = ()):
+        """End of a training step (`workers`: the DataLoader worker processes), logs if it was a logged step"""
+        active = self.active()
+        self.global_step += 1
+        if active:
+            self.log(self.report(model, optimizer, workers))
+
+    def report(self, model: Optional[torch.nn.Module] = None, optimizer: Optional[torch.optim.Optimizer] = None,
+               workers: Sequence = ()) -> Dict[str, object]:
+        """Memory breakdown now, with the stages recorded since the last report (in bytes)"""
+        report = {
+            "step": self.global_step,
+            "device": str(self.device),
+            "main": process_memory(),
+            "workers": [{"pid": worker.pid, **process_memory(worker.pid)} for worker in workers],
+            "stages": self.stages,
+        }
+        if model is not None:
+            report["model"] = model_memory(model, optimizer)
+            if self.activation_bytes is not None:
+                report["model"]["activations"] = self.activation_bytes
+        if self.device.type == 'cuda':
+            report["device_peak"] = torch.cuda.max_memory_allocated(self.device)
+        self.stages = {}
+        self.activation_bytes = None
+        return report
+
+    def log(self, report: Dict[str, object]):
+        if self.logger is not None:
+            self.logger.dump(format_report(report))
+        if self.metric_logger is not None:
+            self.metric_logger.log({"step": report["step"], "memory": report})
+
+
+def _megabytes(values: Dict[str, Optional[int]]) -> str:
+    return ", ".join(f"{name} {value / MB:.0f}" for name, value in values.items() if value is not None)
+
+
+def format_report(report: Dict[str, object]) -> str:
+    lines = [f"Memory at step {report['step']} (MB):", f"    main process: {_megabytes(report['main'])}"]
+    for worker in report["workers"]:
+        memory = {name: value for name, value in worker.items() if name != "pid"}
+        lines.append(f"    worker {worker['pid']}: {_megabytes(memory)}")
+    if len(report["workers"]) > 0:
+        total = {
+            name: sum(worker[name] for worker in report["workers"])
+            for name in ("rss", "pss", "private") if all(worker[name] is not None for worker in report["workers"])
+        }
+        lines.append(f"    all workers: {_megabytes(total)}")
+    if "model" in report:
+        lines.append(f"    model ({report['device']}): {_megabytes(report['model'])}")
+    if len(report["stages"]) > 0:
+        peaks = {name: stage["peak"] - stage["start"] for name, stage in report["stages"].items()}
+        lines.append(f"    stage peaks above their start ({report['device']}): {_megabytes(peaks)}")
+    return "\n".join(lines)
+
+
+def episode_shapes(args) -> List[Dict[str, object]]:
+    """Length, frame shapes per camera and bytes of joint positions and actions of the training
+    episodes (from the manifests if given), read from the metadata only"""
+    if getattr(args, "manifests", None):
+        # the norm stats come from the moments in the manifests, the arrays are never read
+        return [
+            {"length": record["length"], "cameras": record["cameras"], "lowdim_bytes": 0}
+            for record in load_manifests(args.manifests).values()
+        ]
+    shapes = []
+    for path in sorted(glob(os.path.join(args.dataset_dir, '*.h5'))):
+        with h5py.File(path, 'r') as f:
+            images = f['/observations/images']
+            qpos, action = f['/observations/qpos'], f['/action']
+            shapes.append({
+                "length": int(action.shape[0]),
+                "cameras": {cam_name: list(images[cam_name].shape[1:]) for cam_name in images},
+                "lowdim_bytes": qpos.size * qpos.dtype.itemsize + action.size * action.dtype.itemsize,
+            })
+    return shapes
+
+
+def activation_memory(policy: torch.nn.Module, batch: int, num_cam: int, frame_size: Sequence[int], state_dim: int,
+                      action_horizon: int, action_dim: int) -> int:
+    """Bytes saved for backward by a training forward pass on a micro-batch of random data"""
+    image = torch.rand(batch, num_cam, 3, *frame_size)
+    qpos = torch.rand(batch, state_dim)
+    action = torch.rand(batch, action_horizon, action_dim)
+    is_pad = torch.zeros(batch, action_horizon, dtype=torch.bool)
+    with SavedTensors(policy) as saved:
+        loss = policy(qpos, image, action, is_pad)
+    loss.backward()
+    return saved.nbytes
+
+
+def estimate_memory(args, frame_size: Sequence[int] = (480, 640)) -> Dict[str, object]:
+    """
+    Memory estimate (bytes) of a training run of `args` before launching it. Model memory is
+    measured on a policy built from `args` (optimizer state after one step), activations on
+    micro-batches of 1 and 2 and extrapolated to `args.batch` (they grow linearly with it).
+    Data memory follows from the sample size: a DataLoader worker holds the samples of the
+    batch it builds and the collated batch, `num_workers * prefetch_factor` batches are in
+    flight, and `get_norm_stats` keeps the joint positions and actions of every episode
+    (loaded, concatenated and centred, about 3x their size). The host total adds these up
+    with the current RSS (interpreter and libraries), norm stats included although they are
+    freed before training starts.
+    """
+    baseline = process_memory()["rss"] or 0
+    args.pretrained_backbone = False
+    shapes = episode_shapes(args) if args.dataset_dir or getattr(args, "manifests", None) else []
+    # input resolution: that of the config, else the one of the episodes
+    image_sizes = get_image_sizes(args)
+    raw_frame_bytes = 0
+    if len(shapes) > 0:
+        cameras = shapes[0]["cameras"]
+        raw_frame_bytes = sum(int(np.prod(cameras[cam_name])) for cam_name in args.cameras)
+        if image_sizes is None:
+            frame_size = (max(cameras[cam_name][0] for cam_name in args.cameras),
+                          max(cameras[cam_name][1] for cam_name in args.cameras))
+    if image_sizes is not None:
+        frame_size = (max(h for h, _ in image_sizes), max(w for _, w in image_sizes))
+    num_cam = len(args.cameras)
+    # model (the policy is only imported here, data loading imports this module)
+    from act_pytorch.policies.act_policy import ACTPolicy
+    policy = ACTPolicy(args)
+    policy.train()
+    optimizer = policy.configure_optimizers()
+    activations = [activation_memory(policy, batch, num_cam, frame_size, args.state_dim, args.action_horizon,
+                                     args.action_dim) for batch in (1, 2)]
+    optimizer.step()
+    model = model_memory(policy, optimizer)
+    model["activations"] = activations[0] + (activations[1] - activations[0]) * (args.batch - 1)
+    # data
+    sample_bytes = 4 * (num_cam * 3 * frame_size[0] * frame_size[1] + args.state_dim
+                        + args.action_horizon * (args.action_dim + 1))
+    batch_bytes = sample_bytes * args.batch
+    num_workers = getattr(args, "num_workers", 8)
+    prefetch_factor = getattr(args, "prefetch_factor", 1) if num_workers > 0 else 1
+    # frames as read (resized ones if cached) and as resized uint8, next to the float sample
+    read_bytes = (num_cam * 3 * frame_size[0] * frame_size[1] if getattr(args, "image_cache", False)
+                  and image_sizes is not None else raw_frame_bytes)
+    worker = args.batch * (sample_bytes + read_bytes) + batch_bytes
+    data = {
+        "norm_stats": 3 * sum(shape["lowdim_bytes"] for shape in shapes),
+        "batches_in_flight": batch_bytes * max(num_workers, 1) * prefetch_factor,
+        "pinned_batch": batch_bytes if torch.cuda.is_available() else 0,
+        "per_worker": worker,
+        "workers": worker * num_workers,
+    }
+    device = sum(model.values())
+    host = baseline + data["batches_in_flight"] + data["pinned_batch"] + data["workers"] + data["norm_stats"]
+    if not torch.cuda.is_available():
+        host += device
+    return {
+        "batch": args.batch,
+        "frame_size": list(frame_size),
+        "num_episodes": len(shapes),
+        "model": model,
+        "data": data,
+        "baseline": baseline,
+        "device_total": device,
+        "host_total": host,
+        "available": available_memory(),
+    }
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Estimate the memory of a training run before launching it.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/basic.toml",
+        help="Config of the run."
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default="",
+        help="Training episodes (for their resolution and the memory of the norm stats)."
+    )
+    parser.add_argument(
+        "--manifests",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Manifests of the training episodes (instead of --dataset_dir)."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Camera resolution (HxW) if neither the config nor the episodes give it."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    load_config(args, args.config)
+    estimate = estimate_memory(args, [int(s) for s in args.frame_size.split("x")])
+    device = "GPU" if torch.cuda.is_available() else "CPU"
+    print(f"Batch {estimate['batch']} at {estimate['frame_size'][0]}x{estimate['frame_size'][1]}, "
+          f"{args.num_workers} workers x prefetch {args.prefetch_factor}, {estimate['num_episodes']} episodes (MB):")
+    for name, value in estimate["model"].items():
+        print(f"    {name:<20} {value / MB:>10.0f}  ({device})")
+    for name, value in estimate["data"].items():
+        print(f"    {name:<20} {value / MB:>10.0f}  (host)")
+    print(f"    {'baseline':<20} {estimate['baseline'] / MB:>10.0f}  (host, interpreter and libraries)")
+    if device == "GPU":
+        print(f"    {'GPU total':<20} {estimate['device_total'] / MB:>10.0f}")
+    print(f"    {'host total':<20} {estimate['host_total'] / MB:>10.0f}")
+    if estimate["available"] is not None:
+        print(f"    {'host available':<20} {estimate['available'] / MB:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
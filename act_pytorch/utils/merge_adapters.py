@@ -0,0 +1,74 @@
+import sys
+import copy
+import argparse
+import torch
+from typing import Optional
+
+from act_pytorch.models.lora import load_adapters, merge_adapters
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def merge_checkpoint(ckpt: dict, base: Optional[str] = None, map_location="cpu") -> dict:
+    """
+    Plain checkpoint of a LoRA fine-tuning checkpoint: the adapters are folded into the
+    weights of the base checkpoint it was fine-tuned from (`base`, the one recorded in its
+    args if not given), and the merged weights are stored as `model` like those of any
+    checkpoint. Other checkpoints are returned as they are.
+    """
+    if "adapters" not in ckpt:
+        return ckpt
+    args = copy.copy(ckpt["args"])
+    base_ckpt = torch.load(base or args.lora_base, map_location=map_location, weights_only=False)
+    # the backbone weights come from the checkpoint, do not fetch pretrained ones
+    args.pretrained_backbone = False
+    policy = ACTPolicy(args).to(map_location)
+    policy.model.load_state_dict(base_ckpt["model"])
+    policy.add_adapters(args.lora_rank, args.lora_alpha)
+    load_adapters(policy.model, ckpt["adapters"])
+    merge_adapters(policy.model)
+    # the merged model is plain, with the BatchNorm layers frozen by the fine-tuning
+    args.lora_rank = 0
+    args.frozen_bn = 1
+    merged = {k: v for k, v in ckpt.items() if k not in ("adapters", "optimizer")}
+    merged["args"] = args
+    merged["model"] = policy.model.state_dict()
+    return merged
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Fold the LoRA adapters of a fine-tuning checkpoint into the weights of its base checkpoint.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        required=True,
+        help="Checkpoint of a LoRA fine-tuning run (epoch_<N>.pth)."
+    )
+    parser.add_argument(
+        "--base",
+        type=str,
+        default=None,
+        help="Checkpoint that was fine-tuned (the one recorded in the checkpoint if not given)."
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        required=True,
+        help="Merged checkpoint, usable wherever a trained checkpoint is."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    ckpt = torch.load(args.checkpoint, map_location="cpu", weights_only=False)
+    if "adapters" not in ckpt:
+        raise ValueError(f"{args.checkpoint} has no adapters, it is not a LoRA fine-tuning checkpoint.")
+    torch.save(merge_checkpoint(ckpt, args.base), args.output)
+
+
+if __name__ == '__main__':
+    main()
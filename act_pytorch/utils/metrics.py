@@ -0,0 +1,100 @@
+import json
+import time
+import torch
+import torch.distributed as dist
+from typing import Dict, Optional
+
+
+class MetricAggregator:
+    """
+    Running sums of (scalar or vector) metric tensors, kept on their device. `update`
+    never waits for the device, `compute` reads all means with a single transfer (and a
+    single all-reduce over the ranks of a distributed run).
+    """
+    def __init__(self):
+        self.sums: Dict[str, torch.Tensor] = {}
+        self.count = 0
+
+    def update(self, metrics: Dict[str, torch.Tensor]):
+        for name, value in metrics.items():
+            value = value.detach().float()
+            self.sums[name] = self.sums[name] + value if name in self.sums else value.clone()
+        self.count += 1
+
+    def compute(self) -> Dict[str, object]:
+        """Means of the metrics (floats, lists for vector metrics) over the updates of all ranks"""
+        if self.count == 0:
+            return {}
+        names = list(self.sums)
+        shapes = [self.sums[name].shape for name in names]
+        flat = torch.cat([self.sums[name].reshape(-1) for name in names])
+        flat = torch.cat([flat, flat.new_tensor([self.count])])
+        if dist.is_initialized():
+            dist.all_reduce(flat)
+        flat = flat.cpu()
+        count = flat[-1]
+        means = {}
+        offset = 0
+        for name, shape in zip(names, shapes):
+            size = shape.numel()
+            mean = flat[offset: offset + size] / count
+            means[name] = mean.item() if len(shape) == 0 else mean.tolist()
+            offset += size
+        return means
+
+    def reset(self):
+        self.sums = {}
+        self.count = 0
+
+
+class MetricLogger:
+    """
+    Training metrics of every step, aggregated on the device and read every `sync_every`
+    steps only. Each read appends a JSON line (step, epoch, metric means, samples/s,
+    step time) to `path`, a logger without path (e.g. on ranks other than 0) only
+    aggregates. Every rank must call `step` the same number of times.
+    """
+    def __init__(self, path: Optional[str], sync_every: int = 50, start_step: int = 0):
+        self.file = open(path, 'a') if path is not None else None
+        self.sync_every = max(1, sync_every)
+        self.global_step = start_step
+        self.window = MetricAggregator()
+        self.num_samples = 0
+        self.window_start = time.perf_counter()
+
+    def step(self, metrics: Dict[str, torch.Tensor], num_samples: int, epoch: int):
+        self.window.update(metrics)
+        self.num_samples += num_samples
+        self.global_step += 1
+        if self.global_step % self.sync_every == 0:
+            self.flush(epoch)
+
+    def flush(self, epoch: int):
+        """Read and log the metrics of the steps since the last read"""
+        if self.window.count == 0:
+            return
+        steps = self.window.count
+        means = self.window.compute()
+        elapsed = time.perf_counter() - self.window_start
+        samples = self.num_samples * (dist.get_world_size() if dist.is_initialized() else 1)
+        self.log({
+            "step": self.global_step,
+            "epoch": epoch,
+            **means,
+            "samples_per_sec": samples / elapsed,
+            "step_time": elapsed / steps,
+        })
+        self.window.reset()
+        self.num_samples = 0
+        self.window_start = time.perf_counter()
+
+    def log(self, record: Dict[str, object]):
+        """Append a JSON line (e.g. validation results)"""
+        if self.file is None:
+            return
+        self.file.write(json.dumps({"time": time.time(), **record}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
@@ -0,0 +1,101 @@
+import os
+import sys
+import h5py
+import argparse
+from glob import glob
+from multiprocessing import Pool
+from act_pytorch.utils.episode_writer import chunk_shape
+
+
+def rechunk_episode(src_path: str, dst_path: str, window: int = 10, compression=None, copy_len: int = 64):
+    """Copy every dataset of an episode with the chunk layout of `chunk_shape`. The copy
+    is written to a temporary file first, so `dst_path` may be `src_path`."""
+    tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+    with h5py.File(src_path, 'r') as src, h5py.File(tmp_path, 'w') as dst:
+        datasets = []
+        src.visititems(lambda name, obj: datasets.append(name) if isinstance(obj, h5py.Dataset) else None)
+        for name in datasets:
+            data = src[name]
+            if data.ndim == 0:
+                dst.create_dataset(name, data=data[()])
+                continue
+            out = dst.create_dataset(
+                name,
+                shape=data.shape,
+                dtype=data.dtype,
+                chunks=chunk_shape(data.shape, window) if data.shape[0] > 0 else None,
+                compression=compression if data.shape[0] > 0 else None
+            )
+            # copy a few time steps at a time to bound memory
+            for start in range(0, data.shape[0], copy_len):
+                out[start: start + copy_len] = data[start: start + copy_len]
+            for key, value in data.attrs.items():
+                out.attrs[key] = value
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def _rechunk(job):
+    return rechunk_episode(*job)
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Rewrite episodes with a chunk layout matching the training read pattern.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--src_dirs",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Directories of the episodes (*.h5, *.hdf5)."
+    )
+    parser.add_argument(
+        "--dst_dir",
+        type=str,
+        default=None,
+        help="Directory of the rewritten episodes (rewrite in place if not given), "
+             "one subdirectory per source directory if there are several."
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=10,
+        help="Time steps per chunk of actions and joint positions (the action horizon)."
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default=None,
+        help="HDF5 compression (e.g. lzf)."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes rewriting episodes."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    jobs = []
+    for src_dir in args.src_dirs:
+        dst_dir = args.dst_dir if args.dst_dir is not None else src_dir
+        if args.dst_dir is not None and len(args.src_dirs) > 1:
+            # keep episodes of different directories apart
+            dst_dir = os.path.join(args.dst_dir, os.path.basename(os.path.normpath(src_dir)))
+        os.makedirs(dst_dir, exist_ok=True)
+        for path in sorted(glob(os.path.join(src_dir, '*.h5')) + glob(os.path.join(src_dir, '*.hdf5'))):
+            dst_path = os.path.join(dst_dir, os.path.basename(path))
+            jobs.append((path, dst_path, args.window, args.compression))
+    with Pool(max(1, args.num_workers)) as pool:
+        for dst_path in pool.imap_unordered(_rechunk, jobs):
+            print(dst_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+import io
+import os
+import sys
+import json
+import random
+import tarfile
+import argparse
+import numpy as np
+import torch
+import torch.distributed as dist
+from multiprocessing import Pool
+from torch.utils.data import IterableDataset, get_worker_info
+from act_pytorch.utils.manifest import find_episodes, moments, norm_stats_from_records
+
+INDEX_NAME = "index.json"
+
+
+# file extension of the frames of each encoding
+FRAME_EXTENSIONS = {"jpeg": "jpg", "png": "png", "raw": "npy"}
+
+
+def _array_bytes(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def encode_frame(frame: np.ndarray, image_format: str = "jpeg", quality: int = 95) -> bytes:
+    """Encode a (h, w, c) uint8 frame (raw frames are stored uncompressed)"""
+    from torchvision.io import encode_jpeg, encode_png
+    if image_format == "raw":
+        return _array_bytes(frame)
+    frame = torch.from_numpy(np.ascontiguousarray(frame)).permute(2, 0, 1)
+    if image_format == "jpeg":
+        return encode_jpeg(frame, quality=quality).numpy().tobytes()
+    if image_format == "png":
+        return encode_png(frame).numpy().tobytes()
+    raise ValueError(f"Unknown image format {image_format}.")
+
+
+def decode_frame(data: bytes, extension: str) -> np.ndarray:
+    """Decode a frame stored with file extension `extension` to (h, w, c) uint8"""
+    from torchvision.io import decode_image
+    if extension == "npy":
+        return np.load(io.BytesIO(data))
+    frame = decode_image(torch.frombuffer(bytearray(data), dtype=torch.uint8))
+    return frame.permute(1, 2, 0).numpy()
+
+
+def pack_shard(args, episode_paths, shard_path, stride=1, image_format="jpeg", quality=95, seed=0):
+    """
+    Write the time steps (every `stride`-th) of `episode_paths` to a tar file as records of
+    encoded frames (at the input resolution), joint positions and the window of
+    `action_horizon` following actions, in random order. Return the shard's entry of the
+    index and the episodes' entries (length and moments, for the normalization stats).
+    """
+    import h5py
+    from act_pytorch.utils.load_data import ACTDataset
+    reader = ACTDataset(args, None, episode_paths)
+    samples, episodes = [], []
+    for episode_id, path in enumerate(episode_paths):
+        with h5py.File(path, 'r') as f:
+            qpos = f['/observations/qpos'][:]
+            action = f['/action'][:]
+            image = reader.load_frames(f, path, 0, action.shape[0])  # (time_steps, num_camera, h, w, c)
+        episodes.append({"path": os.path.abspath(path), "length": int(action.shape[0]),
+                         "qpos": moments(qpos), "action": moments(action)})
+        for ts in range(0, action.shape[0], stride):
+            frames = [image[ts, cam_id] for cam_id in range(len(args.cameras))]
+            if reader.image_sizes is not None:
+                # crop the common canvas back to the resolution of each camera
+                frames = [frame[:h, :w] for frame, (h, w) in zip(frames, reader.image_sizes)]
+            samples.append((f"{episode_id:04d}_{ts:06d}", frames, qpos[ts], action[ts: ts + args.action_horizon]))
+    # shuffled once when packing, the shuffle buffer only has to mix shards
+    random.Random(seed).shuffle(samples)
+    tmp_path = f"{shard_path}.tmp"
+    with tarfile.open(tmp_path, 'w') as tar:
+        for key, frames, qpos, action in samples:
+            members = [(f"{key}.qpos.npy", _array_bytes(qpos)), (f"{key}.action.npy", _array_bytes(action))]
+            for cam_id, frame in enumerate(frames):
+                members.append((f"{key}.cam{cam_id}.{FRAME_EXTENSIONS[image_format]}",
+                                encode_frame(frame, image_format, quality)))
+            for name, data in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    os.replace(tmp_path, shard_path)
+    shard = {"file": os.path.basename(shard_path), "num_samples": len(samples),
+             "num_bytes": os.path.getsize(shard_path)}
+    return shard, episodes
+
+
+def _pack_shard(job):
+    return pack_shard(*job)
+
+
+def pack_shards(args, episode_paths, shard_dir, episodes_per_shard=8, stride=1, image_format="jpeg",
+                quality=95, num_workers=1, val_paths=()):
+    """Pack episodes into tar shards of `episodes_per_shard` episodes and write the index,
+    which also lists the (unpacked) validation episodes `val_paths`"""
+    os.makedirs(shard_dir, exist_ok=True)
+    jobs = []
+    for shard_id, start in enumerate(range(0, len(episode_paths), episodes_per_shard)):
+        shard_path = os.path.join(shard_dir, f"shard_{shard_id:05d}.tar")
+        jobs.append((args, episode_paths[start: start + episodes_per_shard], shard_path, stride,
+                     image_format, quality, args.seed + shard_id))
+    shards, episodes = [], []
+    with Pool(max(1, num_workers)) as pool:
+        for shard, shard_episodes in pool.imap(_pack_shard, jobs):
+            shards.append(shard)
+            episodes.extend(shard_episodes)
+    index = {
+        "cameras": list(args.cameras),
+        "image_size": dict(args.image_size),
+        "action_horizon": args.action_horizon,
+        "stride": stride,
+        "num_samples": sum(shard["num_samples"] for shard in shards),
+        "num_bytes": sum(shard["num_bytes"] for shard in shards),
+        "shards": shards,
+        "episodes": episodes,
+        "val_episodes": [os.path.abspath(path) for path in val_paths]
+    }
+    with open(os.path.join(shard_dir, INDEX_NAME), 'w') as f:
+        json.dump(index, f, indent=2)
+    return index
+
+
+def read_index(shard_dir: str) -> dict:
+    with open(os.path.join(shard_dir, INDEX_NAME), 'r') as f:
+        return json.load(f)
+
+
+def norm_stats_from_shards(shard_dir: str):
+    """Normalization stats of the packed episodes, from the moments of the index"""
+    return norm_stats_from_records(read_index(shard_dir)["episodes"])
+
+
+class ShardDataset(IterableDataset):
+    """
+    Training samples streamed sequentially from the tar shards of `pack_shards`, for
+    storage where random access is slow. Shards are split between the ranks and the
+    DataLoader workers, and samples pass through a shuffle buffer of `shuffle_buffer`
+    samples. As with `ACTDataset` (one random time step per episode), an epoch has one
+    sample per packed episode, split in whole batches between the workers so that all
+    ranks run the same number of steps. The stream of a worker carries over from one
+    epoch to the next (with persistent workers), so that epochs take the next samples
+    rather than the first ones of the shards again. Each pass over its shards goes in a
+    new order.
+    """
+    def __init__(self, args, norm_stats, shard_dir, num_workers=8, shuffle_buffer=1000):
+        super().__init__()
+        from act_pytorch.utils.load_data import ACTDataset
+        self.shard_dir = shard_dir
+        self.index = read_index(shard_dir)
+        if self.index["cameras"] != list(args.cameras) or self.index["image_size"] != dict(args.image_size):
+            raise ValueError(f"The shards of {shard_dir} were packed with other cameras or input resolutions.")
+        if self.index["action_horizon"] < args.action_horizon:
+            raise ValueError(f"The shards of {shard_dir} hold windows of {self.index['action_horizon']} actions, "
+                             f"fewer than the action horizon {args.action_horizon}.")
+        # normalizes and pads samples as the map-style dataset
+        self.reader = ACTDataset(args, norm_stats, [])
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.seed = args.seed
+        self.batch = args.batch
+        self.num_workers = max(1, num_workers)
+        world_size = dist.get_world_size() if dist.is_initialized() else 1
+        self.rank = dist.get_rank() if dist.is_initialized() else 0
+        self.num_shares = world_size * self.num_workers
+        # batches of this rank per epoch
+        self.num_batches = -(-len(self.index["episodes"]) // (world_size * args.batch))
+        # stream of the worker, started by its first epoch
+        self.samples = None
+
+    def __len__(self):
+        # samples of this rank
+        return self.num_batches * self.batch
+
+    def worker_samples(self, worker_id):
+        """Samples a worker yields per epoch, the batches of the rank dealt between its workers"""
+        batches = self.num_batches // self.num_workers + (worker_id < self.num_batches % self.num_workers)
+        return batches * self.batch
+
+    def shards(self, share):
+        """Shards of a (rank, worker) share, the same ones every epoch"""
+        shards = [shard["file"] for shard in self.index["shards"]]
+        random.Random(self.seed).shuffle(shards)
+        own = shards[share::self.num_shares]
+        # more shares than shards, some shares read the shards of others
+        return own if len(own) > 0 else [shards[share % len(shards)]]
+
+    def stream(self, share, rng):
+        """Endless encoded samples of a share, its shards in a new order on every pass"""
+        shards = self.shards(share)
+        while True:
+            rng.shuffle(shards)
+            for name in shards:
+                yield from self.read_shard(name)
+
+    def read_shard(self, name):
+        """Samples of a shard, as their encoded fields"""
+        with tarfile.open(os.path.join(self.shard_dir, name), 'r|') as tar:
+            key, fields = None, {}
+            for member in tar:
+                member_key, field = member.name.split('.', 1)
+                if member_key != key and len(fields) > 0:
+                    yield fields
+                    fields = {}
+                key = member_key
+                fields[field] = tar.extractfile(member).read()
+            if len(fields) > 0:
+                yield fields
+
+    def decode(self, fields):
+        """Frames (num_camera, h, w, c), joint positions and action window of a sample"""
+        # camera fields are "cam<id>.<extension>"
+        cam_fields = sorted((name for name in fields if name.startswith("cam")),
+                            key=lambda name: int(name[3:].split('.')[0]))
+        frames = [decode_frame(fields[name], name.rsplit('.', 1)[1]) for name in cam_fields]
+        qpos = np.load(io.BytesIO(fields["qpos.npy"]))
+        action = np.load(io.BytesIO(fields["action.npy"]))[:self.reader.num_queries]
+        image = self.reader.stack_images([frame[None] for frame in frames])[0]  # (num_camera, h, w, c)
+        return image, qpos, action
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        if self.samples is None:
+            share = self.rank * self.num_workers + worker_id
+            self.rng = random.Random(self.seed + share)
+            self.samples = self.stream(share, self.rng)
+            # the buffer holds encoded samples, they are decoded when drawn
+            self.buffer = []
+        for _ in range(self.worker_samples(worker_id)):
+            while len(self.buffer) < self.shuffle_buffer:
+                self.buffer.append(next(self.samples))
+            # draw a random sample of the buffer, its slot is refilled before the next draw
+            i = self.rng.randrange(len(self.buffer))
+            self.buffer[i], self.buffer[-1] = self.buffer[-1], self.buffer[i]
+            yield self.reader.make_sample(*self.decode(self.buffer.pop()))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Pack the training episodes into sequential tar shards.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dataset_dirs",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Directories of the episodes (*.h5, *.hdf5)."
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        required=True,
+        help="Directory of the shards."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/basic.toml",
+        help="Config providing the cameras, their input resolution, the action horizon and, "
+             "to leave out the validation episodes, val_ratio and seed."
+    )
+    parser.add_argument(
+        "--episodes_per_shard",
+        type=int,
+        default=8,
+        help="Episodes per shard."
+    )
+    parser.add_argument(
+        "--stride",
+        type=int,
+        default=1,
+        help="Pack every stride-th time step."
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="jpeg",
+        choices=list(FRAME_EXTENSIONS),
+        help="Encoding of the frames (raw frames are larger but need no decoding)."
+    )
+    parser.add_argument(
+        "--quality",
+        type=int,
+        default=95,
+        help="JPEG quality."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of processes packing shards."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    from act_pytorch.utils.train_utils import load_config
+    from act_pytorch.utils.load_data import split_episodes
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # the config has a `num_workers` of its own (the DataLoader's)
+    pack_workers = args.num_workers
+    load_config(args, args.config)
+    # resized frames are cached next to each episode (if enabled)
+    args.dataset_dir = ""
+    # the validation episodes (`val_ratio`) are not packed, they are validated from their files
+    records = {os.path.abspath(path): None for dataset_dir in args.dataset_dirs for path in find_episodes(dataset_dir)}
+    train_paths, val_paths = split_episodes(args, records=records)
+    index = pack_shards(args, train_paths, args.shard_dir, args.episodes_per_shard, args.stride,
+                        args.format, args.quality, pack_workers, val_paths)
+    print(f"Packed {index['num_samples']} samples of {len(train_paths)} episodes "
+          f"({index['num_bytes'] / 2**20:.0f} MB) in {len(index['shards'])} shards, "
+          f"{len(val_paths)} validation episodes left out")
+
+
+if __name__ == '__main__':
+    main()
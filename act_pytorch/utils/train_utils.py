@@ -1,39 +1,126 @@
 import os
 import h5py
 import torch
+import torch.distributed as dist
+import tomli
 import numpy as np
 from glob import glob
-
-import IPython
-e = IPython.embed
+from typing import Optional
 
 def set_seed(seed):
     torch.manual_seed(seed)
     np.random.seed(seed)
 
 
+def init_distributed(backend: str = "gloo"):
+    """Join the process group set up by torchrun, return (rank, local rank, world size)"""
+    dist.init_process_group(backend=backend)
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    return dist.get_rank(), local_rank, dist.get_world_size()
+
+
+def is_main_process():
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+
 class Logger:
-    """Information logger"""
-    def __init__(self, path: str):
-        self.root = open(path, 'a')
+    """Information logger (a logger without path drops all information)"""
+    def __init__(self, path: Optional[str]):
+        self.root = open(path, 'a') if path is not None else None
 
     def dump(self, info: str):
+        if self.root is None:
+            return
         print(info)
         self.root.write(info + '\n')
         self.root.flush()
 
     def close(self):
-        self.root.close()
+        if self.root is not None:
+            self.root.close()
+
+
+def load_config(args, config_path: str = 'configs/basic.toml'):
+    """Populate `args` with the settings of a TOML config"""
+    with open(config_path, 'rb') as f:
+        _config = tomli.load(f)
+        # dataset
+        args.cameras = list(_config['dataset']['cameras'])
+        args.full_episode = bool(_config['dataset']['full_episode'])
+        args.norm_mode = str(_config['dataset']['norm_mode'])
+        args.image_size = {
+            str(cam_name): [int(size) for size in image_size]
+            for cam_name, image_size in _config['dataset']['image_size'].items()
+        }
+        args.image_cache = bool(_config['dataset']['image_cache'])
+        args.val_ratio = float(_config['dataset']['val_ratio'])
+        args.shuffle_buffer = int(_config['dataset']['shuffle_buffer'])
+        args.num_workers = int(_config['dataset']['num_workers'])
+        args.prefetch_factor = int(_config['dataset']['prefetch_factor'])
+        args.autotune_loader = bool(_config['dataset']['autotune_loader'])
+        args.loader_memory_gb = float(_config['dataset']['loader_memory_gb'])
+        # model
+        args.backbone = str(_config['model']['backbone'])
+        args.frozen_bn = bool(_config['model']['frozen_bn'])
+        args.backbone_weights = str(_config['model']['backbone_weights'])
+        args.lr_backbone = float(_config['model']['lr_backbone'])
+        args.no_encoder = bool(_config['model']['no_encoder'])
+        args.state_dim = int(_config['model']['state_dim'])
+        args.action_dim = int(_config['model']['action_dim'])
+        args.action_horizon = int(_config['model']['action_horizon'])
+        args.latent_dim = int(_config['model']['latent_dim'])
+        args.hidden_dim = int(_config['model']['hidden_dim'])
+        args.nheads = int(_config['model']['nheads'])
+        args.dim_feedforward = int(_config['model']['dim_feedforward'])
+        args.enc_layers = int(_config['model']['enc_layers'])
+        args.dec_layers = int(_config['model']['dec_layers'])
+        args.dropout = float(_config['model']['dropout'])
+        args.pre_norm = bool(_config['model']['pre_norm'])
+        args.token_reducer = str(_config['model']['token_reducer'])
+        args.reduced_tokens = int(_config['model']['reduced_tokens'])
+        args.pool_stride = int(_config['model']['pool_stride'])
+        # train
+        args.kl_weight = float(_config['train']['kl_weight'])
+        args.lr = float(_config['train']['lr'])
+        args.weight_decay = float(_config['train']['weight_decay'])
+        args.batch = int(_config['train']['batch'])
+        args.epoch = int(_config['train']['epoch'])
+        args.seed = int(_config['train']['seed'])
+        args.save_epochs = int(_config['train']['save_epochs'])
+        args.keep_checkpoints = int(_config['train']['keep_checkpoints'])
+        args.val_epochs = int(_config['train']['val_epochs'])
+        args.val_batch = int(_config['train']['val_batch'])
+        args.val_time_budget = float(_config['train']['val_time_budget'])
+        args.grad_accum_steps = int(_config['train']['grad_accum_steps'])
+        args.metrics_every = int(_config['train']['metrics_every'])
+        args.memory_every = int(_config['train']['memory_every'])
+        args.activation_checkpointing = bool(_config['train']['activation_checkpointing'])
+        args.distill_task_weight = float(_config['train']['distill_task_weight'])
+        args.distill_action_weight = float(_config['train']['distill_action_weight'])
+        args.distill_feature_weight = float(_config['train']['distill_feature_weight'])
+        args.lora_rank = int(_config['train']['lora_rank'])
+        args.lora_alpha = float(_config['train']['lora_alpha'])
+        # inference
+        args.cpu_optimized = bool(_config['inference']['cpu_optimized'])
+        args.intra_op_threads = int(_config['inference']['intra_op_threads'])
+        args.inter_op_threads = int(_config['inference']['inter_op_threads'])
+        args.cpu_cores = [int(core) for core in _config['inference']['cpu_cores']]
+    return args
 
 
-def get_norm_stats(args):
+def get_norm_stats(args, file_paths=None, episodes=None):
+    """Mean and std of joint positions and actions, read from `episodes` (a `SharedEpisodes`) if given"""
     all_qpos_data = []
     all_action_data = []
-    file_paths = glob(os.path.join(args.dataset_dir, '*.h5'))
+    if file_paths is None:
+        file_paths = glob(os.path.join(args.dataset_dir, '*.h5'))
     for path in file_paths:
-        with h5py.File(path, 'r') as f:
-            qpos = f['/observations/qpos'][:]
-            action = f['/action'][:]
+        if episodes is not None:
+            _, qpos, action = episodes.episode(path)
+        else:
+            with h5py.File(path, 'r') as f:
+                qpos = f['/observations/qpos'][:]
+                action = f['/action'][:]
         all_qpos_data.append(torch.from_numpy(qpos))
         all_action_data.append(torch.from_numpy(action))
     all_qpos_data = torch.cat(all_qpos_data)  # (num_episode * episode_len, pos_dim)
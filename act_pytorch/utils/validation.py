@@ -0,0 +1,80 @@
+import time
+import h5py
+import torch
+import numpy as np
+from typing import Callable, Dict, Optional
+
+
+@torch.no_grad()
+def episode_l1(policy, load_frames: Callable, qpos: np.ndarray, action: np.ndarray, norm_stats, num_queries: int,
+               device, batch_size=64) -> float:
+    """
+    Mean L1 between the predicted and the recorded action chunks of every time step of
+    an episode (padded actions are masked). `load_frames(start, end)` returns the uint8
+    frames (n, num_camera, h, w, c) of time steps [start, end). The backbone runs once per
+    frame and all per-timestep queries of the Transformer run in batches of `batch_size`.
+    """
+    time_steps = action.shape[0]
+    # image features of every frame (they do not depend on the time step queried)
+    all_src, all_pos = [], []
+    for start in range(0, time_steps, batch_size):
+        end = min(start + batch_size, time_steps)
+        image = torch.from_numpy(np.ascontiguousarray(load_frames(start, end)))
+        image = image.to(device).permute(0, 1, 4, 2, 3) / 255.0
+        src, pos = policy.model.image_features(policy.preprocess(image))
+        all_src.append(src)
+        all_pos.append(pos)
+    src = torch.cat(all_src)
+    # position embeddings are per frame if tokens are selected per frame
+    pos = torch.cat(all_pos) if all_pos[0].shape[0] > 1 else all_pos[0]
+    # normalize actions and joint positions
+    action = (action - norm_stats["action_mean"]) / norm_stats["action_std"]
+    qpos = (qpos - norm_stats["qpos_mean"]) / norm_stats["qpos_std"]
+    action = torch.from_numpy(action).float().to(device)
+    qpos = torch.from_numpy(qpos).float().to(device)
+    # action chunks of every time step (zero padded at the end of the episode)
+    action = torch.cat([action, action.new_zeros(num_queries - 1, action.shape[1])])
+    is_pad = torch.arange(time_steps + num_queries - 1, device=device) >= time_steps
+    action_seq = action.unfold(0, num_queries, 1).permute(0, 2, 1)  # (time_steps, num_queries, action_dim)
+    is_pad = is_pad.unfold(0, num_queries, 1)  # (time_steps, num_queries)
+    l1_sum = 0.0
+    num_valid = 0
+    for start in range(0, time_steps, batch_size):
+        end = min(start + batch_size, time_steps)
+        latent_input, _, _ = policy.model.encode(qpos[start: end])
+        batch_pos = pos[start: end] if pos.shape[0] > 1 else pos
+        a_hat = policy.model.decode(qpos[start: end], src[start: end], batch_pos, latent_input)
+        valid = ~is_pad[start: end].unsqueeze(-1)
+        l1_sum += ((a_hat - action_seq[start: end]).abs() * valid).sum()
+        num_valid += valid.sum() * a_hat.shape[-1]
+    return (l1_sum / num_valid).item()
+
+
+def validate_episode(policy, dataset, path, device, batch_size=64):
+    """`episode_l1` of an episode of `dataset`, read from memory if its episodes are preloaded"""
+    if getattr(dataset, "episodes", None) is not None:
+        image, qpos, action = dataset.episodes.episode(path)
+        return episode_l1(policy, lambda start, end: image[start: end], qpos, action, dataset.norm_stats,
+                          dataset.num_queries, device, batch_size)
+    with h5py.File(path, 'r') as f:
+        action = f['/action'][:]  # (time_steps, action_dim)
+        qpos = f['/observations/qpos'][:]  # (time_steps, pos_dim)
+        return episode_l1(policy, lambda start, end: dataset.load_frames(f, path, start, end), qpos, action,
+                          dataset.norm_stats, dataset.num_queries, device, batch_size)
+
+
+def validate(policy, dataset, device, batch_size=64, time_budget: Optional[float] = None) -> Dict[str, float]:
+    """
+    Score the episodes of `dataset` in a fixed order, stopping once `time_budget`
+    seconds (if given) are spent. Return the L1 of every scored episode.
+    """
+    was_training = policy.training
+    policy.eval()
+    start_time = time.perf_counter()
+    results = {}
+    for path in dataset.file_paths:
+        results[path] = validate_episode(policy, dataset, path, device, batch_size)
+        if time_budget and time.perf_counter() - start_time > time_budget:
+            break
+    policy.train(was_training)
+    return results
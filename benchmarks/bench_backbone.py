@@ -0,0 +1,126 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import copy
+import time
+import argparse
+import torch
+import numpy as np
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.load_data import ACTDataset
+from act_pytorch.utils.validation import validate
+from act_pytorch.models.backbone import BACKBONES
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Inference latency of the registered backbones and, for trained "
+                    "checkpoints, their validation L1.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config of the randomly initialized policies."
+    )
+    parser.add_argument(
+        "--backbones",
+        type=str,
+        nargs="+",
+        default=list(BACKBONES),
+        help="Backbones of the randomly initialized policies (ignored with --checkpoints)."
+    )
+    parser.add_argument(
+        "--checkpoints",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Trained checkpoints (*.pth) to time and validate instead."
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default=None,
+        help="Episodes the checkpoints are validated on."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the camera frames."
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=20,
+        help="Timed forward passes per backbone."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of intra-op threads of PyTorch (its default if not given)."
+    )
+    return parser
+
+
+@torch.no_grad()
+def benchmark(policy, frame_size, iters):
+    policy.eval()
+    image = torch.rand(1, len(policy.model.camera_names), 3, *frame_size)
+    qpos = torch.rand(1, policy.model.state_dim)
+    backbone = policy.model.backbones[0]
+    for _ in range(3):
+        policy(qpos, image)
+    latencies, backbone_latencies = [], []
+    for _ in range(iters):
+        start = time.perf_counter()
+        policy(qpos, image)
+        latencies.append(time.perf_counter() - start)
+        cam_image = policy.preprocess(image)[:, 0]
+        start = time.perf_counter()
+        backbone(cam_image)
+        backbone_latencies.append(time.perf_counter() - start)
+    return np.median(backbone_latencies) * 1e3, np.median(latencies) * 1e3
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    frame_size = [int(s) for s in args.frame_size.split("x")]
+    policies = []
+    if len(args.checkpoints) > 0:
+        for checkpoint in args.checkpoints:
+            ckpt = torch.load(checkpoint, map_location="cpu", weights_only=False)
+            train_args = ckpt["args"]
+            train_args.pretrained_backbone = False
+            policy = ACTPolicy(train_args)
+            policy.model.load_state_dict(ckpt["model"])
+            policies.append((os.path.basename(checkpoint), train_args, policy, ckpt["norm_stats"]))
+    else:
+        load_config(args, args.config)
+        args.pretrained_backbone = False
+        for name in args.backbones:
+            policy_args = copy.copy(args)
+            policy_args.backbone = name
+            policies.append((name, policy_args, ACTPolicy(policy_args), None))
+    print(f"{'policy':>20} {'backbone':>20} {'params (M)':>11} {'backbone (ms)':>14} {'policy (ms)':>12} {'val L1':>8}")
+    for name, policy_args, policy, norm_stats in policies:
+        backbone = policy.model.backbones[0]
+        params = sum(p.numel() for p in backbone.parameters()) / 1e6
+        backbone_ms, policy_ms = benchmark(policy, frame_size, args.iters)
+        l1 = float("nan")
+        if norm_stats is not None and args.dataset_dir is not None:
+            policy_args.dataset_dir = args.dataset_dir
+            dataset = ACTDataset(policy_args, norm_stats)
+            l1 = np.mean(list(validate(policy, dataset, torch.device("cpu")).values()))
+        print(f"{name:>20} {policy_args.backbone:>20} {params:>11.2f} {backbone_ms:>14.1f} {policy_ms:>12.1f} {l1:>8.4f}")
+
+
+if __name__ == '__main__':
+    main()
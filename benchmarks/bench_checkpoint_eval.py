@@ -0,0 +1,105 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import argparse
+import tempfile
+import torch
+from act_pytorch.utils.train_utils import load_config, get_norm_stats
+from act_pytorch.utils.load_data import ACTDataset
+from act_pytorch.utils.manifest import find_episodes
+from act_pytorch.utils.validation import validate
+from act_pytorch.policies.act_policy import ACTPolicy
+from bench_chunking import make_episodes
+import eval_checkpoints
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Score several checkpoints one after the other (each reading the validation "
+                    "episodes again, as scripted eval calls do) and with eval_checkpoints.py.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config of the (randomly initialized) checkpoints."
+    )
+    parser.add_argument(
+        "--checkpoints",
+        type=int,
+        default=4,
+        help="Number of checkpoints."
+    )
+    parser.add_argument(
+        "--episodes",
+        type=int,
+        default=2,
+        help="Number of synthetic validation episodes."
+    )
+    parser.add_argument(
+        "--time_steps",
+        type=int,
+        default=100,
+        help="Time steps per episode."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Camera resolution (HxW) of the episodes."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Workers of eval_checkpoints.py."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # the config has a num_workers of its own (the data loader's)
+    eval_workers = args.num_workers
+    load_config(args, args.config)
+    args.pretrained_backbone = False
+    args.image_cache = False
+    with tempfile.TemporaryDirectory() as work_dir:
+        args.dataset_dir = os.path.join(work_dir, "episodes")
+        os.makedirs(args.dataset_dir)
+        make_episodes(args.dataset_dir, args.cameras, args.episodes, args.time_steps,
+                      tuple(int(s) for s in args.frame_size.split("x")))
+        paths = find_episodes(args.dataset_dir)
+        norm_stats = get_norm_stats(args, paths)
+        ckpt_dir = os.path.join(work_dir, "checkpoints")
+        os.makedirs(ckpt_dir)
+        for epoch in range(args.checkpoints):
+            torch.manual_seed(epoch)
+            policy = ACTPolicy(args)
+            torch.save({"args": args, "epoch": epoch, "norm_stats": norm_stats, "model": policy.model.state_dict()},
+                       os.path.join(ckpt_dir, f"epoch_{epoch + 1}.pth"))
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        # one checkpoint after the other, every one reading and decoding the episodes
+        start = time.perf_counter()
+        sequential = {}
+        for path in eval_checkpoints.find_checkpoints([ckpt_dir]):
+            ckpt = torch.load(path, map_location=device, weights_only=False)
+            policy = ACTPolicy(ckpt["args"]).to(device)
+            policy.model.load_state_dict(ckpt["model"])
+            results = validate(policy, ACTDataset(ckpt["args"], ckpt["norm_stats"], paths), device)
+            sequential[path] = sum(results.values()) / len(results)
+        sequential_time = time.perf_counter() - start
+        print(f"sequential: {sequential_time:.1f}s")
+        start = time.perf_counter()
+        output = os.path.join(work_dir, "ranked.jsonl")
+        eval_checkpoints.main(["--checkpoints", ckpt_dir, "--episodes", *paths, "--num_workers", str(eval_workers),
+                               "--output", output])
+        print(f"sequential: {sequential_time:.1f}s, eval_checkpoints.py: {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
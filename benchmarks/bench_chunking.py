@@ -0,0 +1,125 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import h5py
+import argparse
+import tempfile
+import numpy as np
+from glob import glob
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.load_data import ACTDataset
+from act_pytorch.utils.rechunk import rechunk_episode
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Bytes read and time per training sample for several HDF5 layouts.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default=None,
+        help="Directory of the episodes (synthetic episodes are generated if not given)."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Config providing the cameras and the action horizon."
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=50,
+        help="Number of samples read per setting."
+    )
+    return parser
+
+
+def read_bytes():
+    """Bytes requested through read syscalls by this process (served from disk or page cache)"""
+    with open("/proc/self/io", 'r') as f:
+        for line in f:
+            if line.startswith("rchar:"):
+                return int(line.split()[1])
+    return 0
+
+
+def make_episodes(dataset_dir, cameras, num_episodes=4, time_steps=200, frame_size=(480, 640)):
+    """Episodes with contiguous datasets (the layout of `f[name] = array`), images are
+    smooth gradients plus noise so that they compress like camera frames"""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:frame_size[0], 0:frame_size[1]]
+    for i in range(num_episodes):
+        with h5py.File(os.path.join(dataset_dir, f"episode_{i}.h5"), 'w') as f:
+            f['/action'] = rng.normal(size=(time_steps, 7)).astype(np.float32)
+            f['/observations/qpos'] = rng.normal(size=(time_steps, 7)).astype(np.float32)
+            for cam_name in cameras:
+                images = f.create_dataset(f'/observations/images/{cam_name}', (time_steps, *frame_size, 3), np.uint8)
+                for t in range(time_steps):
+                    base = ((xx + yy + 2 * t) % 256).astype(np.uint8)
+                    noise = rng.integers(0, 8, size=frame_size, dtype=np.uint8)
+                    images[t] = np.repeat((base + noise)[..., None], 3, axis=2)
+
+
+def legacy_sample(path, cameras, rng):
+    """Read pattern of the data loader before reading windows: whole datasets are read
+    and indexed in memory"""
+    with h5py.File(path, 'r') as f:
+        action = f['/action'][:]
+        start_ts = rng.choice(action.shape[0])
+        f['/observations/qpos'][:][start_ts]
+        for cam_name in cameras:
+            f[f'/observations/images/{cam_name}'][:][start_ts]
+
+
+def measure(read_sample, num_samples):
+    start_bytes, start_time = read_bytes(), time.perf_counter()
+    for i in range(num_samples):
+        read_sample(i)
+    return (read_bytes() - start_bytes) / num_samples, (time.perf_counter() - start_time) / num_samples
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    load_config(args, args.config)
+    args.image_size = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.dataset_dir is None:
+            args.dataset_dir = os.path.join(work_dir, "contiguous")
+            os.makedirs(args.dataset_dir)
+            make_episodes(args.dataset_dir, args.cameras)
+        layouts = {"source": args.dataset_dir}
+        for name, compression in [("chunked", None), ("chunked+lzf", "lzf")]:
+            layouts[name] = os.path.join(work_dir, name)
+            os.makedirs(layouts[name])
+            for path in glob(os.path.join(args.dataset_dir, '*.h5')):
+                rechunk_episode(path, os.path.join(layouts[name], os.path.basename(path)),
+                                args.action_horizon, compression)
+        norm_stats = {
+            "action_mean": np.zeros((1, args.action_dim), dtype=np.float32),
+            "action_std": np.ones((1, args.action_dim), dtype=np.float32),
+            "qpos_mean": np.zeros((1, args.state_dim), dtype=np.float32),
+            "qpos_std": np.ones((1, args.state_dim), dtype=np.float32),
+        }
+        print(f"{'layout':>12} {'read pattern':>14} {'MB/sample':>10} {'ms/sample':>10} {'size (MB)':>10}")
+        for name, dataset_dir in layouts.items():
+            size = sum(os.path.getsize(path) for path in glob(os.path.join(dataset_dir, '*.h5'))) / 2**20
+            args.dataset_dir = dataset_dir
+            dataset = ACTDataset(args, norm_stats)
+            rng = np.random.RandomState(0)
+            patterns = {
+                "whole dataset": lambda i: legacy_sample(dataset.file_paths[i % len(dataset)], args.cameras, rng),
+                "window": lambda i: dataset[i % len(dataset)],
+            }
+            for pattern, read_sample in patterns.items():
+                per_sample, seconds = measure(read_sample, args.samples)
+                print(f"{name:>12} {pattern:>14} {per_sample / 2**20:>10.3f} {seconds * 1e3:>10.2f} {size:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import h5py
+import argparse
+import contextlib
+import tempfile
+import threading
+import numpy as np
+from types import SimpleNamespace
+from act_pytorch.utils.episode_writer import EpisodeWriter
+from act_pytorch.utils.frame_ring import FrameRing, frame_view, stamp
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Stream fake (ROS-free) camera and joint state messages through the "
+                    "ring buffer and episode writer of the data collector.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=3000,
+        help="Number of time steps of the episode."
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=30.0,
+        help="Rate (Hz) of the fake source, 0 for as fast as possible."
+    )
+    parser.add_argument(
+        "--cameras",
+        type=int,
+        default=3,
+        help="Number of synchronized cameras."
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=5.0,
+        help="Standard deviation (ms) of the stamps of the messages of a time step."
+    )
+    parser.add_argument(
+        "--buffer_size",
+        type=int,
+        default=64,
+        help="Time steps of the ring buffer."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Camera resolution (HxW)."
+    )
+    parser.add_argument(
+        "--save_dir",
+        type=str,
+        default=None,
+        help="Directory of the episode (a temporary directory by default)."
+    )
+    return parser
+
+
+def rss_mb():
+    with open("/proc/self/status", 'r') as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 2**10
+    return float("nan")
+
+
+class FakeSource:
+    """Synchronized camera images and joint states as the ROS synchronizer passes them to the
+    collector callback (objects with the fields of `sensor_msgs` messages)"""
+    def __init__(self, num_cam, frame_size, rate, jitter):
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        self.jitter = jitter
+        self.rng = np.random.default_rng(0)
+        h, w = frame_size
+        # a few frames per camera, cycled, so that making them costs nothing
+        self.images = [
+            [SimpleNamespace(height=h, width=w, step=w * 3, encoding="rgb8",
+                             data=self.rng.integers(0, 255, size=(h, w, 3), dtype=np.uint8).tobytes())
+             for _ in range(4)]
+            for _ in range(num_cam)
+        ]
+
+    @staticmethod
+    def header(sec):
+        return SimpleNamespace(stamp=SimpleNamespace(to_sec=lambda: sec))
+
+    def __iter__(self):
+        next_time = time.perf_counter()
+        step = 0
+        while True:
+            if self.period > 0:
+                next_time += self.period
+                time.sleep(max(0.0, next_time - time.perf_counter()))
+            now = time.time()
+            msgs = []
+            for frames in self.images:
+                image = frames[step % len(frames)]
+                image.header = self.header(now + self.rng.normal() * self.jitter)
+                msgs.append(image)
+            msgs.append(SimpleNamespace(header=self.header(now + self.rng.normal() * self.jitter),
+                                        position=self.rng.normal(size=7)))
+            step += 1
+            yield msgs
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    frame_size = tuple(int(s) for s in args.frame_size.split("x"))
+    # the episode is deleted unless --save_dir is given
+    work_dir = tempfile.TemporaryDirectory() if args.save_dir is None else contextlib.nullcontext(args.save_dir)
+    with work_dir as save_dir:
+        path = os.path.join(save_dir, "episode_0.hdf5")
+        cam_names = [f"camera_{cam_id}" for cam_id in range(args.cameras)]
+        # as in the collector: the callback fills the ring, a thread drains it into the writer
+        ring = FrameRing({cam_name: frame_size for cam_name in cam_names}, 7, args.buffer_size)
+        writer = EpisodeWriter(path, threaded=False)
+        drain_thread = threading.Thread(target=ring.drain, args=(writer.write,), daemon=True)
+        drain_thread.start()
+        latencies, rss = [], []
+        source = FakeSource(args.cameras, frame_size, args.rate, args.jitter / 1e3)
+        for step, msgs in enumerate(source):
+            if step == args.frames:
+                break
+            start = time.perf_counter()
+            *images, joint_state = msgs
+            ring.put([frame_view(image) for image in images], joint_state.position, [stamp(msg) for msg in msgs])
+            latencies.append(time.perf_counter() - start)
+            if step % 100 == 0:
+                rss.append(rss_mb())
+        ring.join()
+        ring.close()
+        start = time.perf_counter()
+        writer.finalize()
+        finalize_time = time.perf_counter() - start
+        stats = ring.stats()
+        written = stats["steps"]
+        with h5py.File(path, 'r') as f:
+            for cam_name in cam_names:
+                assert f[f"/obs/{cam_name}"].shape == (written, *frame_size, 3)
+            assert f["/proprios"].shape == (written, 7)
+        latencies = np.array(latencies) * 1e3
+        print(f"episode: {path} ({os.path.getsize(path) / 2**20:.0f} MB, {written} steps of {args.cameras} cameras)")
+        print(f"capture latency per step (ms): p50 {np.median(latencies):.3f}, p99 {np.percentile(latencies, 99):.3f}, "
+              f"max {latencies.max():.3f}; per frame p50 {np.median(latencies) / args.cameras:.3f}")
+        print(f"first/last 10% of steps p50 (ms): {np.median(latencies[:len(latencies) // 10]):.3f} / "
+              f"{np.median(latencies[-len(latencies) // 10:]):.3f}")
+        print(f"dropped steps: {stats['dropped']}, sync skew (ms): mean {stats['mean_skew'] * 1e3:.1f}, "
+              f"max {stats['max_skew'] * 1e3:.1f}, steps above {ring.max_skew * 1e3:.1f} ms: {stats['skewed']}")
+        print(f"RSS (MB): first {rss[0]:.0f}, min {min(rss):.0f}, max {max(rss):.0f}, last {rss[-1]:.0f}")
+        print(f"finalize (s): {finalize_time:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import copy
+import time
+import argparse
+import torch
+import numpy as np
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.cpu_inference import configure_threads, optimize_for_cpu
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Batch 1 latency of the default inference path (as in eval.py) and of the "
+                    "CPU-optimized one.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default=None,
+        help="Trained checkpoint (*.pth), a randomly initialized policy built from --config if not given."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config of the randomly initialized policy."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 4],
+        help="Intra-op thread counts to compare."
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        nargs="*",
+        default=[],
+        help="Cores the process is pinned to (all if not given)."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the camera frames."
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=50,
+        help="Timed queries per setting."
+    )
+    return parser
+
+
+@torch.no_grad()
+def latencies(policy, qpos, image, iters):
+    for _ in range(3):
+        policy(qpos, image)
+    times = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        policy(qpos, image)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1e3
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    configure_threads(cores=args.cores)
+    if args.checkpoint is not None:
+        ckpt = torch.load(args.checkpoint, map_location="cpu", weights_only=False)
+        train_args = ckpt["args"]
+        train_args.pretrained_backbone = False
+        policy = ACTPolicy(train_args)
+        policy.model.load_state_dict(ckpt["model"])
+    else:
+        load_config(args, args.config)
+        args.pretrained_backbone = False
+        train_args = args
+        policy = ACTPolicy(args)
+    policy.eval()
+    optimized = optimize_for_cpu(copy.deepcopy(policy))
+    frame_size = [int(s) for s in args.frame_size.split("x")]
+    image = torch.rand(1, len(train_args.cameras), 3, *frame_size)
+    qpos = torch.rand(1, train_args.state_dim)
+    with torch.no_grad():
+        error = (optimized(qpos, image) - policy(qpos, image)).abs().max().item()
+    print(f"max abs difference of the actions: {error:.2e}")
+    print(f"{'threads':>8} {'path':>10} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for name, query_policy in (("default", policy), ("optimized", optimized)):
+            times = latencies(query_policy, qpos, image, args.iters)
+            print(f"{threads:>8} {name:>10} {np.median(times):>9.1f} {np.percentile(times, 99):>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
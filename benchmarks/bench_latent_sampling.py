@@ -0,0 +1,84 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import argparse
+import torch
+import numpy as np
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Latency of decoding K prior latents with shared image features against K policy calls.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config of the randomly initialized policy."
+    )
+    parser.add_argument(
+        "--num_samples",
+        type=int,
+        nargs="+",
+        default=[1, 4, 16, 64],
+        help="Numbers of latents K."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the camera frames."
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=10,
+        help="Timed calls per setting."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of intra-op threads of PyTorch (its default if not given)."
+    )
+    return parser
+
+
+def median_ms(fn, iters):
+    fn()
+    latencies = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return np.median(latencies) * 1e3
+
+
+@torch.no_grad()
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    load_config(args, args.config)
+    args.pretrained_backbone = False
+    policy = ACTPolicy(args).eval()
+    frame_size = [int(s) for s in args.frame_size.split("x")]
+    image = torch.rand(1, len(args.cameras), 3, *frame_size)
+    qpos = torch.rand(1, args.state_dim)
+    forward_ms = median_ms(lambda: policy(qpos, image), args.iters)
+    print(f"single forward: {forward_ms:.1f} ms")
+    print(f"{'K':>4} {'K calls (ms)':>13} {'sample (ms)':>12} {'sample / forward':>17}")
+    for num_samples in args.num_samples:
+        repeated_ms = median_ms(lambda: [policy(qpos, image) for _ in range(num_samples)], args.iters)
+        sample_ms = median_ms(lambda: policy.sample(qpos, image, num_samples), args.iters)
+        print(f"{num_samples:>4} {repeated_ms:>13.1f} {sample_ms:>12.1f} {sample_ms / forward_ms:>17.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import resource
+import argparse
+import torch
+import multiprocessing as mp
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.image_cache import get_image_sizes
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Peak training memory against throughput for activation checkpointing "
+                    "and gradient accumulation.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config."
+    )
+    parser.add_argument(
+        "--effective_batch",
+        type=int,
+        default=32,
+        help="Samples per optimizer step."
+    )
+    parser.add_argument(
+        "--micro_batches",
+        type=int,
+        nargs="+",
+        default=[32, 8, 2],
+        help="Micro-batch sizes to benchmark (must divide the effective batch)."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Camera resolution (HxW) if the config sets no input resolution."
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=3,
+        help="Timed optimizer steps per setting."
+    )
+    return parser
+
+
+def peak_memory_mb(device):
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+
+def run(args, micro_batch, activation_checkpointing, frame_size, steps):
+    """Train a few steps on random data in a fresh process, return (peak MB, base MB, samples/s)"""
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    args.activation_checkpointing = activation_checkpointing
+    policy = ACTPolicy(args).to(device)
+    policy.train()
+    optimizer = policy.configure_optimizers()
+    image_sizes = get_image_sizes(args)
+    if image_sizes is not None:
+        frame_size = (max(h for h, _ in image_sizes), max(w for _, w in image_sizes))
+    num_cam = len(args.cameras)
+    image = torch.rand(micro_batch, num_cam, 3, *frame_size, device=device)
+    qpos = torch.rand(micro_batch, args.state_dim, device=device)
+    action = torch.rand(micro_batch, args.action_horizon, args.action_dim, device=device)
+    is_pad = torch.zeros(micro_batch, args.action_horizon, dtype=torch.bool, device=device)
+    grad_accum_steps = args.effective_batch // micro_batch
+    base = peak_memory_mb(device)
+
+    def step():
+        optimizer.zero_grad()
+        for _ in range(grad_accum_steps):
+            loss = policy(qpos, image, action, is_pad)
+            (loss / grad_accum_steps).backward()
+        optimizer.step()
+
+    step()  # warm up (also allocates the optimizer state)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    throughput = steps * args.effective_batch / (time.perf_counter() - start)
+    return peak_memory_mb(device), base, throughput
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    load_config(args, args.config)
+    frame_size = tuple(int(s) for s in args.frame_size.split("x"))
+    # every setting runs in its own process so that peak memory is not carried over
+    ctx = mp.get_context("spawn")
+    print(f"{'micro-batch':>12} {'accum':>6} {'ckpt':>5} {'peak (MB)':>10} {'model (MB)':>11} {'samples/s':>10}")
+    for micro_batch in args.micro_batches:
+        for activation_checkpointing in (False, True):
+            with ctx.Pool(1) as pool:
+                peak, base, throughput = pool.apply(
+                    run, (args, micro_batch, activation_checkpointing, frame_size, args.steps)
+                )
+            print(f"{micro_batch:>12} {args.effective_batch // micro_batch:>6} {int(activation_checkpointing):>5} "
+                  f"{peak:>10.0f} {base:>11.0f} {throughput:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import math
+import time
+import h5py
+import torch
+import argparse
+import contextlib
+import tempfile
+import numpy as np
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+from act_pytorch.policies.act_policy import ACTPolicy
+from act_pytorch.policies.feature_cache import FeatureCachePolicy
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.artifact import load_artifact
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded episodes through the inference path at fixed control "
+                    "rates (ROS-free) and account for missed deadlines.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="Training checkpoint (*.pth) or artifact directory exported by export.py "
+             "(a randomly initialized policy built from --config if not given)."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Config of the randomly initialized policy."
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default=None,
+        help="Directory of the episodes (synthetic episodes are generated if not given)."
+    )
+    parser.add_argument(
+        "--rates",
+        type=float,
+        nargs="+",
+        default=[30.0, 50.0, 100.0],
+        help="Control rates (Hz)."
+    )
+    parser.add_argument(
+        "--exec_steps",
+        type=int,
+        default=1,
+        help="Actions executed from every predicted chunk before the policy is queried again "
+             "(1 queries every control step, as with temporal aggregation)."
+    )
+    parser.add_argument(
+        "--overlap",
+        action="store_true",
+        help="Run inference while the current chunk is executed, i.e. a query only has to "
+             "finish before the chunk runs out instead of within one control period."
+    )
+    parser.add_argument(
+        "--camera_rate",
+        type=float,
+        default=None,
+        help="Frame rate (Hz) of the cameras, a frame is observed again until the next one "
+             "arrives (a new frame every tick if not given)."
+    )
+    parser.add_argument(
+        "--feature_cache",
+        action="store_true",
+        help="Run the backbone of a camera only when its frame changed (FeatureCachePolicy)."
+    )
+    parser.add_argument(
+        "--max_steps",
+        type=int,
+        default=300,
+        help="Control steps replayed per rate."
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=5,
+        help="Untimed queries before every rate."
+    )
+    parser.add_argument(
+        "--max_miss_ratio",
+        type=float,
+        default=0.0,
+        help="Largest fraction of missed control steps for a rate to be held."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of intra-op threads of PyTorch (its default if not given)."
+    )
+    parser.add_argument(
+        "--fail_on_miss",
+        action="store_true",
+        help="Exit with status 1 if a rate is not held (e.g. in CI)."
+    )
+    return parser
+
+
+def load_policy(args):
+    """Inference policy (eval mode) and normalization stats on CPU"""
+    if os.path.isdir(args.checkpoint):
+        return load_artifact(args.checkpoint, "cpu")
+    if args.checkpoint:
+        ckpt = torch.load(args.checkpoint, map_location="cpu", weights_only=False)
+        train_args = ckpt["args"]
+        train_args.pretrained_backbone = False
+        policy = ACTPolicy(train_args)
+        policy.model.load_state_dict(ckpt["model"])
+        norm_stats = ckpt["norm_stats"]
+    else:
+        load_config(args, args.config)
+        args.pretrained_backbone = False
+        policy = ACTPolicy(args)
+        norm_stats = {
+            "action_mean": np.zeros(args.action_dim, dtype=np.float32),
+            "action_std": np.ones(args.action_dim, dtype=np.float32),
+            "qpos_mean": np.zeros(args.state_dim, dtype=np.float32),
+            "qpos_std": np.ones(args.state_dim, dtype=np.float32),
+        }
+    policy.eval()
+    return policy, norm_stats
+
+
+def make_episodes(dataset_dir, cameras, state_dim, action_dim, num_episodes=2, time_steps=150,
+                  frame_size=(480, 640)):
+    rng = np.random.default_rng(0)
+    for i in range(num_episodes):
+        with h5py.File(os.path.join(dataset_dir, f"episode_{i}.h5"), 'w') as f:
+            f['/action'] = rng.normal(size=(time_steps, action_dim)).astype(np.float32)
+            f['/observations/qpos'] = rng.normal(size=(time_steps, state_dim)).astype(np.float32)
+            for cam_name in cameras:
+                f[f'/observations/images/{cam_name}'] = rng.integers(
+                    0, 255, size=(time_steps, *frame_size, 3), dtype=np.uint8)
+
+
+def load_episode(path, cameras, max_steps):
+    """Raw camera frames (time_steps, num_camera, h, w, c) and joint positions, read ahead
+    of the replay so that disk reads do not count as inference time"""
+    with h5py.File(path, 'r') as f:
+        qpos = f['/observations/qpos'][:max_steps]
+        images = [f[f'/observations/images/{cam_name}'][:max_steps] for cam_name in cameras]
+    return np.stack(images, axis=1), qpos
+
+
+def frames(episodes, max_steps):
+    """Cycle over the episodes until `max_steps` observations are produced"""
+    step = 0
+    while step < max_steps:
+        for images, qpos in episodes:
+            for t in range(len(qpos)):
+                if step == max_steps:
+                    return
+                yield images[t], qpos[t]
+                step += 1
+
+
+@torch.no_grad()
+def infer(policy, norm_stats, image, qpos):
+    """Observation to unnormalized action chunk, as done on the robot"""
+    image = torch.from_numpy(image).permute(0, 3, 1, 2).unsqueeze(0).float() / 255.0
+    qpos = (qpos - norm_stats["qpos_mean"]) / norm_stats["qpos_std"]
+    qpos = torch.from_numpy(np.asarray(qpos, dtype=np.float32)).reshape(1, -1)
+    a_hat = policy(qpos, image)[0].numpy()
+    return a_hat * norm_stats["action_std"] + norm_stats["action_mean"]
+
+
+def timed_infer(policy, norm_stats, image, qpos):
+    start = time.perf_counter()
+    infer(policy, norm_stats, image, qpos)
+    return time.perf_counter() - start
+
+
+def replay(policy, norm_stats, observations, rate, exec_steps, overlap, max_steps):
+    """
+    Run a control loop at `rate` Hz on a fixed grid of ticks, tick k being due
+    `(k + 1) / rate` seconds after the first chunk is ready. The observation of tick k is
+    `observations[k]`, and every tick executes one action of the current chunk.
+
+    Without `overlap`, the policy is queried when the chunk runs out and has to return
+    before that tick is due. With `overlap`, the next chunk is requested (on a worker
+    thread) when the current one starts, so inference runs while `exec_steps` actions
+    are executed. A chunk that is not ready when due misses every tick until it
+    returns (the robot holds its last action), and the loop then resumes on the grid.
+    Jitter is how late the loop wakes up for the ticks it did not miss.
+    """
+    period = 1.0 / rate
+    latencies, jitters = [], []
+    missed = 0
+    executor = ThreadPoolExecutor(max_workers=1)
+    # the robot starts moving once the first chunk is ready
+    latencies.append(timed_infer(policy, norm_stats, *observations[0]))
+    start = time.perf_counter()
+    future = executor.submit(timed_infer, policy, norm_stats, *observations[0]) if overlap else None
+    tick = 0
+    chunk_left = exec_steps
+    while tick < max_steps:
+        if chunk_left == 0:
+            if future is None:
+                future = executor.submit(timed_infer, policy, norm_stats, *observations[tick])
+            latencies.append(future.result())
+            future = None
+            done = time.perf_counter()
+            if done > start + (tick + 1) * period:
+                # ticks that were due before the chunk was ready
+                late = math.ceil((done - start) / period) - 1 - tick
+                missed += min(late, max_steps - tick)
+                tick += late
+                if tick >= max_steps:
+                    break
+            chunk_left = exec_steps
+            if overlap:
+                future = executor.submit(timed_infer, policy, norm_stats, *observations[tick])
+        # wait for the tick and execute one action of the chunk
+        deadline = start + (tick + 1) * period
+        now = time.perf_counter()
+        if now < deadline:
+            time.sleep(deadline - now)
+        jitters.append(time.perf_counter() - deadline)
+        chunk_left -= 1
+        tick += 1
+    executor.shutdown(wait=True)
+    return {
+        "latency": np.array(latencies) * 1e3,
+        "jitter": np.array(jitters) * 1e3,
+        "missed": missed,
+        "ticks": max_steps,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    policy, norm_stats = load_policy(args)
+    cameras = policy.model.camera_names
+    # synthetic episodes are deleted once read
+    work_dir = tempfile.TemporaryDirectory() if args.dataset_dir is None else contextlib.nullcontext(args.dataset_dir)
+    with work_dir as dataset_dir:
+        if args.dataset_dir is None:
+            make_episodes(dataset_dir, cameras, policy.model.state_dim, policy.model.action_head.out_features)
+        paths = sorted(glob(os.path.join(dataset_dir, '*.h5')) + glob(os.path.join(dataset_dir, '*.hdf5')))
+        episodes = []
+        num_steps = 0
+        for path in paths:
+            if num_steps >= args.max_steps:
+                break
+            episodes.append(load_episode(path, cameras, args.max_steps - num_steps))
+            num_steps += len(episodes[-1][1])
+    if num_steps == 0:
+        raise ValueError(f"No episode with observations (*.h5, *.hdf5) in {args.dataset_dir}.")
+    print(f"{torch.get_num_threads()} threads, {len(episodes)} episodes, exec_steps {args.exec_steps}"
+          f"{', overlapped inference' if args.overlap else ''}")
+    header = f"{'rate (Hz)':>10} {'budget (ms)':>12} {'p50 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} " \
+             f"{'jitter p99 (ms)':>16} {'missed':>10} {'held':>5}"
+    if args.feature_cache:
+        header += f" {'hit rate':>9} {'saved (ms/query)':>17}"
+    print(header)
+    recorded = list(frames(episodes, args.max_steps))
+    all_held = True
+    for rate in args.rates:
+        observations = recorded
+        if args.camera_rate is not None:
+            # the frame of tick k is the last one the cameras published
+            observations = [(recorded[int(tick * args.camera_rate / rate)][0], qpos)
+                            for tick, (_, qpos) in enumerate(recorded)]
+        for image, qpos in observations[:args.warmup]:
+            infer(policy, norm_stats, image, qpos)
+        # the cache of every rate starts empty
+        query_policy = FeatureCachePolicy(policy) if args.feature_cache else policy
+        result = replay(query_policy, norm_stats, observations, rate, args.exec_steps, args.overlap, args.max_steps)
+        budget = 1e3 / rate * (args.exec_steps if args.overlap else 1)
+        held = result["missed"] <= args.max_miss_ratio * result["ticks"]
+        all_held = all_held and held
+        latency, jitter = result["latency"], result["jitter"]
+        # no jitter when every tick was missed
+        jitter_p99 = np.percentile(jitter, 99) if len(jitter) else float("nan")
+        print(f"{rate:>10.0f} {budget:>12.1f} {np.median(latency):>9.2f} {np.percentile(latency, 99):>9.2f} "
+              f"{latency.max():>9.2f} {jitter_p99:>16.3f} "
+              f"{result['missed']:>4}/{result['ticks']:<5} {'yes' if held else 'no':>5}", end="")
+        if args.feature_cache:
+            stats = query_policy.stats()
+            print(f" {stats['hit_rate']:>9.2f} {stats['saved_ms'] / (stats['hits'] + stats['misses']):>17.1f}", end="")
+        print()
+    if args.fail_on_miss and not all_held:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import argparse
+import torch
+import numpy as np
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.image_cache import num_image_tokens
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Image tokens and inference latency for several input resolutions.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config."
+    )
+    parser.add_argument(
+        "--resolutions",
+        type=str,
+        nargs="+",
+        default=["480x640", "360x480", "240x320", "224x224", "120x160"],
+        help="Input resolutions (HxW) applied to every camera."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the raw camera frames fed to the policy."
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=20,
+        help="Timed forward passes per resolution."
+    )
+    return parser
+
+
+@torch.no_grad()
+def benchmark(args, frame_size, iters):
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    policy = ACTPolicy(args).to(device)
+    policy.eval()
+    image = torch.rand(1, len(args.cameras), 3, *frame_size, device=device)
+    qpos = torch.rand(1, args.state_dim, device=device)
+    for _ in range(3):
+        policy(qpos, image)
+    latencies = []
+    for _ in range(iters):
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        policy(qpos, image)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        latencies.append(time.perf_counter() - start)
+    return np.median(latencies) * 1e3, np.percentile(latencies, 99) * 1e3
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    load_config(args, args.config)
+    frame_size = [int(s) for s in args.frame_size.split("x")]
+    print(f"{'resolution':>12} {'tokens/cam':>12} {'encoder tokens':>15} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+    for resolution in args.resolutions:
+        h, w = [int(s) for s in resolution.split("x")]
+        args.image_size = {cam_name: [h, w] for cam_name in args.cameras}
+        feat_h, feat_w = num_image_tokens(h, w)
+        tokens = feat_h * feat_w
+        p50, p99 = benchmark(args, frame_size, args.iters)
+        print(f"{resolution:>12} {tokens:>12} {2 + tokens * len(args.cameras):>15} {p50:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import argparse
+import tempfile
+from glob import glob
+from torch.utils.data import DataLoader
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.load_data import ACTDataset
+from act_pytorch.utils.manifest import find_episodes
+from act_pytorch.utils.shards import FRAME_EXTENSIONS, ShardDataset, pack_shards, norm_stats_from_shards
+from bench_chunking import make_episodes
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Throughput of the tar shard stream against random access into HDF5 episodes "
+                    "and against reading the shard files sequentially.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default=None,
+        help="Directory of the episodes (synthetic episodes are generated if not given)."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Config providing the cameras, the input resolution and the action horizon."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        nargs="+",
+        default=[0, 4],
+        help="DataLoader workers of each run."
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="jpeg",
+        choices=list(FRAME_EXTENSIONS),
+        help="Encoding of the packed frames."
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=400,
+        help="Samples read per run."
+    )
+    return parser
+
+
+def sequential_read(paths, block_size=2**22):
+    """MB/s of reading the files front to back (the bound of the shard stream)"""
+    start, size = time.perf_counter(), 0
+    for path in paths:
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                size += len(block)
+    return size / 2**20 / (time.perf_counter() - start)
+
+
+def measure(dataset, num_workers, batch, num_samples):
+    """Samples/s of a DataLoader over `dataset` (first batch excluded)"""
+    loader = DataLoader(dataset, batch_size=batch, num_workers=num_workers, shuffle=isinstance(dataset, ACTDataset),
+                        persistent_workers=num_workers > 0)
+    samples, start = 0, None
+    while samples < num_samples:
+        for image, _, _, _ in loader:
+            if start is None:
+                start = time.perf_counter()
+                continue
+            samples += image.shape[0]
+            if samples >= num_samples:
+                break
+    return samples / (time.perf_counter() - start)
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # the config has a `num_workers` of its own (the DataLoader's)
+    loader_workers = args.num_workers
+    load_config(args, args.config)
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.dataset_dir is None:
+            args.dataset_dir = os.path.join(work_dir, "episodes")
+            os.makedirs(args.dataset_dir)
+            make_episodes(args.dataset_dir, args.cameras, num_episodes=8)
+        args.image_cache = False
+        args.batch = 8
+        shard_dir = os.path.join(work_dir, "shards")
+        index = pack_shards(args, find_episodes(args.dataset_dir), shard_dir, episodes_per_shard=1,
+                            image_format=args.format, num_workers=os.cpu_count())
+        norm_stats = norm_stats_from_shards(shard_dir)
+        shard_paths = sorted(glob(os.path.join(shard_dir, "*.tar")))
+        episodes_mb = sum(os.path.getsize(path) for path in find_episodes(args.dataset_dir)) / 2**20
+        shard_mb = index["num_bytes"] / 2**20
+        print(f"{index['num_samples']} samples, episodes: {episodes_mb:.0f} MB, shards: {shard_mb:.0f} MB "
+              f"({shard_mb / index['num_samples']:.3f} MB/sample), "
+              f"sequential read: {sequential_read(shard_paths):.0f} MB/s")
+        print(f"{'dataset':>12} {'workers':>8} {'samples/s':>10} {'MB/s':>8}")
+        for num_workers in loader_workers:
+            hdf5 = ACTDataset(args, norm_stats, find_episodes(args.dataset_dir))
+            rate = measure(hdf5, num_workers, args.batch, args.samples)
+            print(f"{'hdf5':>12} {num_workers:>8} {rate:>10.1f} {'-':>8}")
+            shards = ShardDataset(args, norm_stats, shard_dir, num_workers=max(1, num_workers), shuffle_buffer=100)
+            rate = measure(shards, num_workers, args.batch, args.samples)
+            print(f"{'shards':>12} {num_workers:>8} {rate:>10.1f} {rate * shard_mb / index['num_samples']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
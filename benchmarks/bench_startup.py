@@ -0,0 +1,106 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import json
+import time
+import argparse
+import subprocess
+
+START = time.perf_counter()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Import time, policy construction time and time to first action "
+                    "of a fresh process.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="Training checkpoint (*.pth) or artifact directory exported by export.py."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the camera frames."
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of fresh processes per setting."
+    )
+    parser.add_argument(
+        "--child",
+        type=str,
+        default=None,
+        choices=["checkpoint", "checkpoint_pretrained", "artifact"],
+        help=argparse.SUPPRESS
+    )
+    return parser
+
+
+def child(args):
+    """Load the policy in this (fresh) process and print the elapsed time of every stage"""
+    timings = {}
+    import torch
+    timings["import torch"] = time.perf_counter() - START
+    from act_pytorch.policies.act_policy import ACTPolicy
+    from act_pytorch.utils.artifact import load_artifact
+    timings["import act_pytorch"] = time.perf_counter() - START
+    if args.child == "artifact":
+        policy, norm_stats = load_artifact(args.checkpoint)
+    else:
+        ckpt = torch.load(args.checkpoint, map_location="cpu", weights_only=False)
+        train_args = ckpt["args"]
+        train_args.pretrained_backbone = args.child == "checkpoint_pretrained"
+        policy = ACTPolicy(train_args)
+        policy.model.load_state_dict(ckpt["model"])
+        policy.eval()
+        norm_stats = ckpt["norm_stats"]
+    timings["policy ready"] = time.perf_counter() - START
+    num_cam = len(policy.model.camera_names)
+    image = torch.rand(1, num_cam, 3, *[int(s) for s in args.frame_size.split("x")])
+    qpos = torch.rand(1, policy.model.state_dim)
+    with torch.no_grad():
+        policy(qpos, image)
+    timings["first action"] = time.perf_counter() - START
+    print(json.dumps(timings))
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.child is not None:
+        child(args)
+        return
+    if os.path.isdir(args.checkpoint):
+        modes = ["artifact"]
+    else:
+        modes = ["checkpoint_pretrained", "checkpoint"]
+    stages = ["import torch", "import act_pytorch", "policy ready", "first action"]
+    print(f"{'mode':>22} " + " ".join(f"{stage + ' (s)':>22}" for stage in stages))
+    for mode in modes:
+        runs = []
+        for _ in range(args.repeats):
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", mode,
+                 "--checkpoint", args.checkpoint, "--frame_size", args.frame_size],
+                capture_output=True, text=True
+            )
+            if output.returncode != 0:
+                # e.g. pretrained weights can not be fetched offline
+                print(f"{mode:>22} failed: {output.stderr.strip().splitlines()[-1]}")
+                break
+            runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+        if len(runs) == args.repeats:
+            means = [sum(run[stage] for run in runs) / len(runs) for stage in stages]
+            print(f"{mode:>22} " + " ".join(f"{mean:>22.3f}" for mean in means))
+
+
+if __name__ == '__main__':
+    main()
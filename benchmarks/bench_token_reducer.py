@@ -0,0 +1,98 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+import time
+import argparse
+import torch
+import numpy as np
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.image_cache import num_image_tokens
+from act_pytorch.models.token_reducer import num_reduced_tokens
+from act_pytorch.policies.act_policy import ACTPolicy
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Transformer input tokens and inference latency of the token reducers "
+                    "for several numbers of cameras.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=os.path.join(ROOT_DIR, "act_pytorch", "configs", "basic.toml"),
+        help="Model config."
+    )
+    parser.add_argument(
+        "--reducers",
+        type=str,
+        nargs="+",
+        default=["none", "pool", "attention", "topk"],
+        help="Token reducers."
+    )
+    parser.add_argument(
+        "--cameras",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of cameras."
+    )
+    parser.add_argument(
+        "--frame_size",
+        type=str,
+        default="480x640",
+        help="Resolution (HxW) of the camera frames."
+    )
+    parser.add_argument(
+        "--iters",
+        type=int,
+        default=10,
+        help="Timed forward passes per setting."
+    )
+    return parser
+
+
+@torch.no_grad()
+def benchmark(args, frame_size, iters):
+    policy = ACTPolicy(args)
+    policy.eval()
+    image = torch.rand(1, len(args.cameras), 3, *frame_size)
+    qpos = torch.rand(1, args.state_dim)
+    for _ in range(3):
+        policy(qpos, image)
+    # time the Transformer apart from the backbone, which the reducers do not change
+    src, pos = policy.model.image_features(policy.preprocess(image))
+    latent_input, _, _ = policy.model.encode(qpos)
+    latencies, transformer_latencies = [], []
+    for _ in range(iters):
+        start = time.perf_counter()
+        policy(qpos, image)
+        latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        policy.model.decode(qpos, src, pos, latent_input)
+        transformer_latencies.append(time.perf_counter() - start)
+    return np.median(latencies) * 1e3, np.median(transformer_latencies) * 1e3
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    num_cameras = args.cameras
+    load_config(args, args.config)
+    args.pretrained_backbone = False
+    args.image_size = {}
+    frame_size = [int(s) for s in args.frame_size.split("x")]
+    tokens_per_cam = num_image_tokens(*frame_size)
+    print(f"{'reducer':>10} {'cameras':>8} {'encoder tokens':>15} {'transformer (ms)':>17} {'total (ms)':>11}")
+    for reducer in args.reducers:
+        args.token_reducer = reducer
+        for num_cam in num_cameras:
+            args.cameras = [f"camera_{i}" for i in range(num_cam)]
+            tokens = 2 + num_reduced_tokens(args, tokens_per_cam, num_cam)
+            total, transformer = benchmark(args, frame_size, args.iters)
+            print(f"{reducer:>10} {num_cam:>8} {tokens:>15} {transformer:>17.1f} {total:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
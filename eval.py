@@ -5,10 +5,10 @@ sys.path.append(ROOT_DIR)
 import argparse
 import torch
 from act_pytorch.policies.act_policy import ACTPolicy
-from act_pytorch.utils.train_utils import set_seed
-
-import IPython
-e = IPython.embed
+from act_pytorch.utils.train_utils import set_seed, load_config
+from act_pytorch.utils.artifact import load_artifact
+from act_pytorch.utils.merge_adapters import merge_checkpoint
+from act_pytorch.utils.cpu_inference import setup_cpu_inference
 
 def make_parser():
     parser = argparse.ArgumentParser(
@@ -19,32 +19,62 @@ def make_parser():
         "--checkpoint",
         type=str,
         default="",
-        help="Checkpoint path."
+        help="Checkpoint path (or directory of an artifact exported by export.py)."
+    )
+    parser.add_argument(
+        "--num_samples",
+        type=int,
+        default=1,
+        help="Latents drawn from the prior (1: the zero latent, as in training validation)."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="Config whose [inference] settings (CPU threads, cores, optimized mode) replace "
+             "those of the checkpoint."
     )
     return parser
 
 
 @torch.no_grad()
-def test(checkpoint: str, image: torch.Tensor, qpos: torch.Tensor) -> torch.Tensor:
+def test(checkpoint: str, image: torch.Tensor, qpos: torch.Tensor, num_samples: int = 1,
+         inference_args=None) -> torch.Tensor:
+    """Predicted action sequence (1, horizon, action_dim), or one per sampled latent
+    (num_samples, horizon, action_dim) if `num_samples` > 1. On CPU, the [inference]
+    settings of `inference_args` (of the checkpoint if not given) are applied."""
     torch.cuda.empty_cache()
     # get device
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    # load checkpoint
-    ckpt = torch.load(checkpoint, map_location=device)
-    train_args = ckpt["args"]
-    # set seed
-    set_seed(train_args.seed)
-    # instantiate policy
-    policy = ACTPolicy(train_args).to(device)
-    policy.model.load_state_dict(ckpt["model"])
-    # get norm status
-    norm_stats = ckpt["norm_stats"]
+    if os.path.isdir(checkpoint):
+        # inference artifact written by export.py
+        policy, norm_stats = load_artifact(checkpoint, device)
+    else:
+        # load checkpoint
+        ckpt = torch.load(checkpoint, map_location=device, weights_only=False)
+        # a LoRA fine-tuning checkpoint is merged into its base checkpoint
+        ckpt = merge_checkpoint(ckpt, map_location=device)
+        train_args = ckpt["args"]
+        # the backbone weights come from the checkpoint, do not fetch pretrained ones
+        train_args.pretrained_backbone = False
+        # set seed
+        set_seed(train_args.seed)
+        # instantiate policy
+        policy = ACTPolicy(train_args).to(device)
+        policy.model.load_state_dict(ckpt["model"])
+        # get norm status
+        norm_stats = ckpt["norm_stats"]
     # normalize qpos
     qpos = (qpos - norm_stats["qpos_mean"]) / norm_stats["qpos_std"]
     # inference
     policy.eval()
+    if device.type == 'cpu':
+        setup_cpu_inference(policy, inference_args)
     image, qpos = image.to(device), qpos.to(device)
-    action_pred = policy(qpos, image)
+    if num_samples > 1:
+        action_pred = policy.sample(qpos, image, num_samples)
+    else:
+        action_pred = policy(qpos, image)
     action_pred = action_pred.cpu()
     # unnormalize actions
     action_pred = action_pred * norm_stats["action_std"] + norm_stats["action_mean"]
@@ -55,9 +85,14 @@ def main(argv=sys.argv[1:]):
     parser = make_parser()
     args = parser.parse_args(argv)
     checkpoint = args.checkpoint
+    # raw camera frame, the policy resizes it to the configured input resolution
     image = torch.rand(1, 1, 3, 480, 640)
     qpos = torch.rand(1, 7)
-    action_pred = test(checkpoint, image, qpos)
+    inference_args = load_config(argparse.Namespace(), args.config) if args.config is not None else None
+    action_pred = test(checkpoint, image, qpos, args.num_samples, inference_args)
+    if args.num_samples > 1:
+        # spread of the sampled action sequences, per action dimension
+        print(f"Mean std over {args.num_samples} samples: {action_pred.std(dim=0).mean(dim=0)}")
     
     
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT_DIR)
+import re
+import json
+import time
+import argparse
+import torch
+import torch.multiprocessing as mp
+from glob import glob
+from act_pytorch.policies.act_policy import ACTPolicy
+from act_pytorch.utils.load_data import SharedEpisodes, SharedEpisodeDataset, split_episodes
+from act_pytorch.utils.validation import validate
+from act_pytorch.utils.merge_adapters import merge_checkpoint
+
+_episodes = None
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Rank checkpoints by the masked action L1 on a validation set read once.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoints",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Checkpoints (*.pth), or directories whose *.pth are all evaluated (e.g. the "
+             "checkpoints directory of a run)."
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default="",
+        help="Episodes the validation set is taken from: the held-out ones (val_ratio of the "
+             "checkpoints) if the run held some out, else all of them."
+    )
+    parser.add_argument(
+        "--episodes",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Validation episodes (instead of those of --dataset_dir)."
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        default=64,
+        help="Frames per backbone batch and time steps per Transformer batch."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of checkpoints scored concurrently."
+    )
+    parser.add_argument(
+        "--cores_per_worker",
+        type=int,
+        default=None,
+        help="CPU cores each worker is pinned to (the available cores split evenly if not given)."
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="JSON lines file the results (with per-episode L1) are appended to."
+    )
+    return parser
+
+
+def find_checkpoints(paths):
+    """Checkpoint files of `paths` (directories expanded), by epoch"""
+    checkpoints = []
+    for path in paths:
+        if os.path.isdir(path):
+            checkpoints.extend(glob(os.path.join(path, "*.pth")))
+        else:
+            checkpoints.append(path)
+
+    def epoch(path):
+        match = re.search(r"epoch_(\d+)", os.path.basename(path))
+        return (int(match.group(1)) if match else -1, path)
+    return sorted(set(checkpoints), key=epoch)
+
+
+def input_key(args):
+    """Settings that determine the preloaded frames, checkpoints sharing them share the frames"""
+    return json.dumps([list(args.cameras), getattr(args, "image_size", {})])
+
+
+def init_worker(episodes, core_groups):
+    """Pin the worker to its own group of cores and keep the shared episodes"""
+    global _episodes
+    _episodes = episodes
+    cores = core_groups.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+def score_checkpoint(job):
+    """L1 of every validation episode, with the norm stats of the checkpoint"""
+    path, batch_size = job
+    start_time = time.perf_counter()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    ckpt = torch.load(path, map_location=device, weights_only=False)
+    # LoRA fine-tuning checkpoints are scored merged into their base checkpoint
+    ckpt = merge_checkpoint(ckpt, map_location=device)
+    train_args = ckpt["args"]
+    # the backbone weights come from the checkpoint, do not fetch pretrained ones
+    train_args.pretrained_backbone = False
+    policy = ACTPolicy(train_args).to(device)
+    policy.model.load_state_dict(ckpt["model"])
+    episodes = _episodes[input_key(train_args)]
+    dataset = SharedEpisodeDataset(train_args, ckpt["norm_stats"], episodes)
+    results = validate(policy, dataset, device, batch_size)
+    return path, {
+        # as in the name of the checkpoint, epoch_<N>.pth
+        "epoch": ckpt["epoch"] + 1 if "epoch" in ckpt else None,
+        "l1": sum(results.values()) / len(results),
+        "episodes": results,
+        "time": time.perf_counter() - start_time,
+    }
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    start_time = time.perf_counter()
+    checkpoints = find_checkpoints(args.checkpoints)
+    if len(checkpoints) == 0:
+        raise ValueError(f"No checkpoint found in {args.checkpoints}.")
+    # the arguments of every checkpoint, the weights are loaded by the workers
+    train_args = {
+        path: torch.load(path, map_location="cpu", weights_only=False, mmap=True)["args"] for path in checkpoints
+    }
+    first_args = train_args[checkpoints[0]]
+    first_args.dataset_dir = args.dataset_dir
+    if args.episodes is not None:
+        paths = sorted(args.episodes)
+    else:
+        _, paths = split_episodes(first_args)
+        if len(paths) == 0:
+            paths = sorted(glob(os.path.join(args.dataset_dir, '*.h5')))
+    if len(paths) == 0:
+        raise ValueError("No validation episode, pass --dataset_dir or --episodes.")
+    # read (and resize) every episode once per input resolution, all checkpoints score the same shared memory
+    episodes = {}
+    for path, ckpt_args in train_args.items():
+        key = input_key(ckpt_args)
+        if key not in episodes:
+            ckpt_args.dataset_dir = args.dataset_dir
+            episodes[key] = SharedEpisodes(ckpt_args, paths)
+    load_time = time.perf_counter() - start_time
+    num_frames = int(next(iter(episodes.values())).starts[-1])
+    print(f"Loaded {len(paths)} validation episodes ({num_frames} time steps) in {load_time:.1f}s, "
+          f"scoring {len(checkpoints)} checkpoints")
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    num_workers = max(1, min(args.num_workers, len(checkpoints)))
+    cores_per_worker = args.cores_per_worker or max(1, len(cores) // num_workers)
+    ctx = mp.get_context("spawn")
+    core_groups = ctx.Queue()
+    for worker in range(num_workers):
+        group = cores[worker * cores_per_worker: (worker + 1) * cores_per_worker]
+        core_groups.put(group if len(group) > 0 else cores)
+    results = {}
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=(episodes, core_groups)) as pool:
+        jobs = [(path, args.batch) for path in checkpoints]
+        for path, result in pool.imap_unordered(score_checkpoint, jobs):
+            results[path] = result
+            print(f"{os.path.basename(path)}: {result['l1']:.4f} ({result['time']:.1f}s)")
+    total_time = time.perf_counter() - start_time
+    # ranked table, best first
+    ranked = sorted(checkpoints, key=lambda path: results[path]["l1"])
+    header = ["rank", "checkpoint", "epoch", "val_l1", "time (s)"]
+    rows = [
+        [str(rank + 1), path, str(results[path]["epoch"]), f"{results[path]['l1']:.4f}",
+         f"{results[path]['time']:.1f}"]
+        for rank, path in enumerate(ranked)
+    ]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    print(f"Total {total_time:.1f}s: loading {load_time:.1f}s, "
+          f"scoring {sum(result['time'] for result in results.values()):.1f}s over {num_workers} workers")
+    if args.output is not None:
+        with open(args.output, 'a') as f:
+            for rank, path in enumerate(ranked):
+                f.write(json.dumps({"rank": rank + 1, "checkpoint": path, **results[path]}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT_DIR)
+import argparse
+from act_pytorch.utils.artifact import export_artifact
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Export a checkpoint to an inference-only artifact.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=str,
+        default="",
+        help="Checkpoint path."
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        default="./deploy",
+        help="Directory used for saving the artifact."
+    )
+    return parser
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    export_artifact(args.checkpoint, args.output_dir)
+
+
+if __name__ == '__main__':
+    main()
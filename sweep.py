@@ -0,0 +1,180 @@
+import os
+import sys
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT_DIR)
+import copy
+import json
+import argparse
+import itertools
+import tomli
+import torch
+import torch.multiprocessing as mp
+from act_pytorch.utils.train_utils import load_config
+from act_pytorch.utils.load_data import SharedEpisodes, split_episodes
+from train import train, run_name
+
+# settings that change the preloaded frames, they cannot differ between trials
+PRELOADED_KEYS = ("cameras", "image_size", "image_cache", "dataset_dir")
+
+_episodes = None
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        description="Train several configurations concurrently on one preloaded dataset.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--dataset_dir",
+        type=str,
+        default="",
+        help="Directory used for loading training data."
+    )
+    parser.add_argument(
+        "--save_dir",
+        type=str,
+        default="./experiments",
+        help="Directory used for saving models."
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/basic.toml",
+        help="Base config the overrides of every trial are applied to."
+    )
+    parser.add_argument(
+        "--grid",
+        type=str,
+        nargs="+",
+        default=[],
+        help='Values of the settings to sweep as TOML arrays, e.g. "kl_weight=[1, 10]" '
+             '"lr=[1e-5, 5e-5]" (every combination is a trial).'
+    )
+    parser.add_argument(
+        "--trials",
+        type=str,
+        default=None,
+        help="TOML file listing the overrides of every trial as [[trial]] tables (instead of --grid)."
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Number of trials trained concurrently."
+    )
+    parser.add_argument(
+        "--cores_per_trial",
+        type=int,
+        default=None,
+        help="CPU cores each trial is pinned to (the available cores split evenly if not given)."
+    )
+    return parser
+
+
+def parse_grid(grid):
+    """Overrides of every combination of the --grid values"""
+    values = {}
+    for item in grid:
+        key, _ = item.split("=", 1)
+        value = tomli.loads(item)[key.strip()]
+        values[key.strip()] = value if isinstance(value, list) else [value]
+    keys = list(values)
+    return [dict(zip(keys, combination)) for combination in itertools.product(*values.values())]
+
+
+def make_trials(base_args, overrides):
+    """Arguments of every trial, i.e. the base arguments with the trial's overrides"""
+    trials = []
+    for trial_overrides in overrides:
+        trial_args = copy.deepcopy(base_args)
+        for key, value in trial_overrides.items():
+            if key in PRELOADED_KEYS:
+                raise ValueError(f"{key} cannot be swept, the frames are preloaded once for all trials.")
+            if not hasattr(trial_args, key):
+                raise ValueError(f"Unknown setting {key}.")
+            current = getattr(trial_args, key)
+            if isinstance(current, (bool, int, float)) and not isinstance(value, (list, dict)):
+                # as typed by load_config, e.g. kl_weight = 10 is 10.0
+                value = type(current)(value)
+            setattr(trial_args, key, value)
+        trials.append(trial_args)
+    return trials
+
+
+def init_worker(episodes, core_groups):
+    """Pin the worker to its own group of cores and keep the shared episodes"""
+    global _episodes
+    _episodes = episodes
+    cores = core_groups.get()
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+def run_trial(job):
+    trial_id, trial_args = job
+    return trial_id, train(trial_args, _episodes)
+
+
+def main(argv=sys.argv[1:]):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    # the config has a `num_workers` of its own (DataLoader workers, unused with preloaded episodes)
+    trial_workers = args.num_workers
+    load_config(args, args.config)
+    args.checkpoint = None
+    args.teacher = None
+    args.distributed = False
+    args.dist_backend = "gloo"
+    if args.trials is not None:
+        with open(args.trials, 'rb') as f:
+            overrides = tomli.load(f)["trial"]
+    else:
+        overrides = parse_grid(args.grid)
+    trials = make_trials(args, overrides)
+    # trials sharing a run directory get a directory of their own
+    names = [run_name(trial_args) for trial_args in trials]
+    for trial_id, trial_args in enumerate(trials):
+        if names.count(names[trial_id]) > 1:
+            trial_args.save_dir = os.path.join(args.save_dir, f"trial_{trial_id}")
+        os.makedirs(trial_args.save_dir, exist_ok=True)
+    # read every episode once, all trials train from the same shared memory
+    train_paths, val_paths = split_episodes(args)
+    episodes = SharedEpisodes(args, sorted(train_paths + val_paths))
+    print(f"Preloaded {len(episodes.paths)} episodes ({episodes.images.numel() / 2**20:.0f} MB of frames), "
+          f"{len(trials)} trials")
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count()))
+    num_workers = max(1, min(trial_workers, len(trials)))
+    cores_per_trial = args.cores_per_trial or max(1, len(cores) // num_workers)
+    ctx = mp.get_context("spawn")
+    core_groups = ctx.Queue()
+    for worker in range(num_workers):
+        group = cores[worker * cores_per_trial: (worker + 1) * cores_per_trial]
+        core_groups.put(group if len(group) > 0 else cores)
+    results = {}
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=(episodes, core_groups)) as pool:
+        for trial_id, summary in pool.imap_unordered(run_trial, list(enumerate(trials))):
+            results[trial_id] = summary
+            print(f"Trial {trial_id} done: {summary}")
+    # summary of all trials
+    keys = sorted({key for trial_overrides in overrides for key in trial_overrides})
+    header = ["trial"] + keys + ["loss", "val_l1", "best", "save_dir"]
+    rows = []
+    for trial_id, trial_overrides in enumerate(overrides):
+        summary = results[trial_id]
+        rows.append([str(trial_id)] + [str(trial_overrides.get(key, "")) for key in keys] + [
+            f"{summary['loss']:.4f}",
+            f"{summary['val_l1']:.4f}" if summary["val_l1"] is not None else "-",
+            str(summary.get("best")),
+            summary["save_dir"]
+        ])
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    with open(os.path.join(args.save_dir, "sweep.jsonl"), 'a') as f:
+        for trial_id, trial_overrides in enumerate(overrides):
+            f.write(json.dumps({"trial": trial_id, "overrides": trial_overrides, **results[trial_id]}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
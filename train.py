@@ -3,15 +3,20 @@ import sys
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(ROOT_DIR)
 import argparse
-import tomli
+import contextlib
 import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
 from tqdm import tqdm
-from act_pytorch.utils.train_utils import Logger, set_seed
-from act_pytorch.utils.load_data import load_data
+from act_pytorch.utils.train_utils import Logger, set_seed, load_config, init_distributed, is_main_process
+from act_pytorch.utils.load_data import load_data, load_val_data
+from act_pytorch.utils.validation import validate
+from act_pytorch.utils.checkpoint import CheckpointWriter
+from act_pytorch.utils.metrics import MetricAggregator, MetricLogger
+from act_pytorch.utils.memory import MemoryMonitor
 from act_pytorch.policies.act_policy import ACTPolicy
-
-import IPython
-e = IPython.embed
+from act_pytorch.policies.distillation import DistillationPolicy
+from act_pytorch.models.lora import adapter_state_dict, load_adapters
 
 
 def make_parser():
@@ -25,6 +30,28 @@ def make_parser():
         default="",
         help="Directory used for loading training data."
     )
+    parser.add_argument(
+        "--manifests",
+        type=str,
+        nargs="+",
+        default=[],
+        help="Manifests of the training episodes (instead of --dataset_dir), "
+             "built with `python -m act_pytorch.utils.manifest`."
+    )
+    parser.add_argument(
+        "--manifest_weights",
+        type=float,
+        nargs="+",
+        default=[],
+        help="Sampling weight of every manifest (sampled in proportion to their episodes if not given)."
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        default=None,
+        help="Tar shards of the training episodes to stream (instead of --dataset_dir), "
+             "packed with `python -m act_pytorch.utils.shards`."
+    )
     parser.add_argument(
         "--checkpoint",
         type=str,
@@ -37,118 +64,319 @@ def make_parser():
         default="./experiments",
         help="Directory used for saving models."
     )
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="configs/basic.toml",
+        help="Config of the model and the training (of the student when distilling)."
+    )
+    parser.add_argument(
+        "--teacher",
+        type=str,
+        default=None,
+        help="Checkpoint of a trained ACT policy to distill into the configured (student) policy."
+    )
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="Train with DistributedDataParallel (launch with torchrun)."
+    )
+    parser.add_argument(
+        "--dist_backend",
+        type=str,
+        default="gloo",
+        help="Backend of the distributed process group."
+    )
     return parser
 
 
-def train_one_epoch(dataloader, policy, optimizer, device):
-    total_loss = 0.0
-    for _, (image, qpos, action, is_pad) in enumerate(dataloader):
-        optimizer.zero_grad()
-        image, qpos, action, is_pad = image.to(device), \
-            qpos.to(device), action.to(device), is_pad.to(device)
-        loss = policy(qpos, image, action, is_pad)
-        loss.backward()
-        optimizer.step()
-        total_loss += loss.item()
-    loss = total_loss / len(dataloader)
-    return loss
+def run_name(args):
+    """Name of the run directory `train` creates in `args.save_dir`"""
+    name = f'seed_{args.seed}_horizon_{args.action_horizon}_lr_{args.lr}_kl_{args.kl_weight}'
+    if getattr(args, "lora_rank", 0) > 0:
+        name += f'_lora_{args.lora_rank}'
+    return name
+
 
+def train_one_epoch(dataloader, policy, optimizer, device, grad_accum_steps=1, metric_logger=None, epoch=0,
+                    memory_monitor=None):
+    """Train for an epoch, return the means of the loss terms over the batches of all ranks"""
+    epoch_metrics = MetricAggregator()
+    num_batches = len(dataloader)
+    # stages are only measured on the steps the monitor logs
+    memory_monitor = memory_monitor if memory_monitor is not None else MemoryMonitor(device)
+    optimizer.zero_grad()
+    iterator = iter(dataloader)
+    for step, (image, qpos, action, is_pad) in enumerate(iterator):
+        with memory_monitor.stage("batch"):
+            image, qpos, action, is_pad = image.to(device), \
+                qpos.to(device), action.to(device), is_pad.to(device)
+        # every batch is a micro-batch, gradients are accumulated over `grad_accum_steps`
+        # micro-batches (fewer at the end of the epoch) before each optimizer step
+        group_start = step - step % grad_accum_steps
+        group_size = min(grad_accum_steps, num_batches - group_start)
+        is_step = step + 1 == group_start + group_size
+        # DDP only needs to all-reduce the gradients of the last micro-batch
+        if is_step or not isinstance(policy, DistributedDataParallel):
+            sync_context = contextlib.nullcontext()
+        else:
+            sync_context = policy.no_sync()
+        with sync_context:
+            with memory_monitor.stage("forward"), memory_monitor.activations(policy):
+                loss, metrics = policy(qpos, image, action, is_pad, return_metrics=True)
+            with memory_monitor.stage("backward"):
+                (loss / group_size).backward()
+        if is_step:
+            with memory_monitor.stage("optimizer"):
+                optimizer.step()
+            optimizer.zero_grad()
+        # metrics stay on the device, they are only read every few steps
+        metrics["loss"] = loss.detach()
+        epoch_metrics.update(metrics)
+        if metric_logger is not None:
+            metric_logger.step(metrics, image.shape[0], epoch)
+        memory_monitor.step(policy, optimizer, getattr(iterator, "_workers", []))
+    return epoch_metrics.compute()
 
-def train(args):
+
+def train(args, episodes=None):
+    """Train a policy, return a summary of the run. `episodes` (a `SharedEpisodes`) are used
+    instead of reading `args.dataset_dir` if given."""
     torch.cuda.empty_cache()
     # get device
-    torch.cuda.set_device(4)
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')    
+    rank, local_rank, world_size = 0, 0, 1
+    if args.distributed:
+        rank, local_rank, world_size = init_distributed(args.dist_backend)
+    if torch.cuda.is_available():
+        torch.cuda.set_device(local_rank)
+        device = torch.device('cuda', local_rank)
+    else:
+        device = torch.device('cpu')
+        if args.distributed:
+            # share the cores of a node among its ranks
+            local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+            torch.set_num_threads(max(1, os.cpu_count() // local_world_size))
+    if getattr(args, "lora_rank", 0) > 0 and args.checkpoint is None:
+        raise ValueError("LoRA adapters fine-tune a trained model, pass its --checkpoint.")
     # load checkpoints (if any)
     ckpt = None
+    # fine-tuning a checkpoint with new adapters (rather than resuming its training)
+    finetune = False
     if args.checkpoint is not None:
+        checkpoint_path = args.checkpoint
         dataset_dir = args.dataset_dir
+        manifests = args.manifests
+        manifest_weights = args.manifest_weights
+        shard_dir = args.shard_dir
         save_dir = args.save_dir
         epoch = args.epoch
-        ckpt = torch.load(args.checkpoint, map_location=device)
+        distributed = args.distributed
+        dist_backend = args.dist_backend
+        teacher_path = args.teacher
+        lora_rank = getattr(args, "lora_rank", 0)
+        lora_alpha = getattr(args, "lora_alpha", 16)
+        lr = args.lr
+        # the checkpoint pickles `args`, so it cannot be loaded weights-only
+        ckpt = torch.load(args.checkpoint, map_location=device, weights_only=False)
         args = ckpt["args"]
+        # the backbone weights come from the checkpoint, do not fetch pretrained ones
+        args.pretrained_backbone = False
         args.dataset_dir = dataset_dir
+        args.manifests = manifests
+        args.manifest_weights = manifest_weights
+        args.shard_dir = shard_dir
         args.save_dir = save_dir
         args.epoch = epoch
+        args.distributed = distributed
+        args.dist_backend = dist_backend
+        args.teacher = teacher_path
+        if lora_rank > 0 and "adapters" not in ckpt:
+            # the adapters start from epoch 0, with the learning rate of the config
+            finetune = True
+            args.lora_rank = lora_rank
+            args.lora_alpha = lora_alpha
+            args.lr = lr
+            args.lora_base = os.path.abspath(checkpoint_path)
+    lora_rank = getattr(args, "lora_rank", 0)
+    if lora_rank > 0 and args.teacher is not None:
+        raise ValueError("LoRA fine-tuning cannot be combined with distillation.")
     # create saving directory
-    save_dir = os.path.join(
-        args.save_dir,
-        f'seed_{args.seed}_horizon_{args.action_horizon}_lr_{args.lr}_kl_{args.kl_weight}'
-    )
-    if not os.path.exists(save_dir):
+    save_dir = os.path.join(args.save_dir, run_name(args))
+    if is_main_process() and not os.path.exists(save_dir):
         os.mkdir(save_dir)
         os.mkdir(os.path.join(save_dir, "checkpoints"))
-    # create logger
+    # create logger (only rank 0 writes logs)
     log_path = os.path.join(save_dir, "log.txt")
-    logger = Logger(log_path)
+    logger = Logger(log_path) if is_main_process() else Logger(None)
     # set seed
-    set_seed(args.seed)
-    logger.dump(f"seed: {args.seed}, device: {device}")
-    # load data
-    logger.dump("Loading Data...")
-    train_dataloader, _ = load_data(args)
+    set_seed(args.seed + rank)
+    logger.dump(f"seed: {args.seed}, device: {device}, world size: {world_size}")
+    # load the teacher (if distilling), the student is trained in the normalized space of the teacher
+    teacher = None
+    teacher_norm_stats = None
+    if getattr(args, "teacher", None) is not None:
+        logger.dump(f"Distilling from {args.teacher}")
+        teacher_ckpt = torch.load(args.teacher, map_location=device, weights_only=False)
+        teacher_args = teacher_ckpt["args"]
+        teacher_args.pretrained_backbone = False
+        teacher = ACTPolicy(teacher_args).to(device)
+        teacher.model.load_state_dict(teacher_ckpt["model"])
+        teacher_norm_stats = teacher_ckpt["norm_stats"]
+        logger.dump(f"Number of teacher parameters: {teacher.model.__repr__()}")
     # instantiate policy and optimizer
     logger.dump("Getting Policy...")
     policy = ACTPolicy(args).to(device)
+    if lora_rank > 0:
+        # the base weights stay frozen, only the adapters (and their optimizer state) are trained
+        base_ckpt = ckpt if finetune else torch.load(args.lora_base, map_location=device, weights_only=False)
+        policy.model.load_state_dict(base_ckpt["model"])
+        # the adapted model is trained in the normalized space of the base model
+        base_norm_stats = base_ckpt["norm_stats"]
+        del base_ckpt
+        policy.add_adapters(lora_rank, args.lora_alpha)
+        logger.dump(f"LoRA adapters of rank {lora_rank} on {args.lora_base}")
     optimizer = policy.configure_optimizers()
-    if ckpt is not None:
-        policy.model.load_state_dict(ckpt["model"])
+    # the trained module computes the loss, i.e. the policy or its distillation
+    model = policy
+    if teacher is not None:
+        model = DistillationPolicy(
+            policy,
+            teacher,
+            task_weight=getattr(args, "distill_task_weight", 1.0),
+            action_weight=getattr(args, "distill_action_weight", 1.0),
+            feature_weight=getattr(args, "distill_feature_weight", 0.1)
+        ).to(device)
+        optimizer.add_param_group({"params": model.feature_proj.parameters()})
+    if ckpt is not None and not finetune:
+        if "adapters" in ckpt:
+            load_adapters(policy.model, ckpt["adapters"])
+        else:
+            policy.model.load_state_dict(ckpt["model"])
+        if teacher is not None and "feature_proj" in ckpt:
+            model.feature_proj.load_state_dict(ckpt["feature_proj"])
         optimizer.load_state_dict(ckpt["optimizer"])
     logger.dump(f"Number of parameters: {policy.model.__repr__()}")
+
+    def training_step(batch_data):
+        """A forward and backward pass on a batch, the speed the loader has to keep up with"""
+        image, qpos, action, is_pad = (tensor.to(device) for tensor in batch_data)
+        loss = model(qpos, image, action, is_pad)
+        loss.backward()
+        optimizer.zero_grad()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+
+    # load data
+    logger.dump("Loading Data...")
+    # memory breakdown every `memory_every` steps (and after loading the data)
+    memory_monitor = MemoryMonitor(device, getattr(args, "memory_every", 0), logger)
+    fixed_norm_stats = base_norm_stats if lora_rank > 0 else teacher_norm_stats
+    train_dataloader, norm_stats = load_data(args, fixed_norm_stats, episodes, step_fn=training_step,
+                                             memory_monitor=memory_monitor)
+    logger.dump(f"Data loader: {train_dataloader.num_workers} workers, prefetch {train_dataloader.prefetch_factor}, "
+                f"batch {args.batch} x {getattr(args, 'grad_accum_steps', 1)} accumulation steps")
+    # held-out episodes (validated by rank 0 only)
+    val_dataset = None
+    if is_main_process() and getattr(args, "val_ratio", 0) > 0:
+        val_dataset = load_val_data(args, norm_stats, episodes)
+        logger.dump(f"Training episodes: {len(train_dataloader.dataset)}, validation episodes: {len(val_dataset)}")
+    if memory_monitor.every > 0:
+        memory_monitor.log(memory_monitor.report(model, optimizer))
+    # gradients are all-reduced by DDP, frozen BatchNorm buffers never change
+    # and need no broadcasting
+    distill_model = model if teacher is not None else None
+    if args.distributed:
+        model = DistributedDataParallel(
+            model,
+            device_ids=[local_rank] if device.type == 'cuda' else None,
+            broadcast_buffers=False
+        )
+    # checkpoints are written in the background (only by rank 0)
+    if is_main_process():
+        ckpt_writer = CheckpointWriter(
+            os.path.join(save_dir, "checkpoints"),
+            keep_last=getattr(args, "keep_checkpoints", 0)
+        )
     # train
     logger.dump("Training...")
-    policy.train()
-    start_epoch = (ckpt["epoch"] + 1) if ckpt is not None else 0
+    model.train()
+    start_epoch = (ckpt["epoch"] + 1) if ckpt is not None and not finetune else 0
     assert start_epoch < args.epoch
-    for epoch in tqdm(range(start_epoch, args.epoch)):
-        loss = train_one_epoch(train_dataloader, policy, optimizer, device)
+    # scalar logs (JSON lines) next to log.txt, metrics are read every `metrics_every` steps
+    metric_logger = MetricLogger(
+        os.path.join(save_dir, "metrics.jsonl") if is_main_process() else None,
+        sync_every=getattr(args, "metrics_every", 50),
+        start_step=start_epoch * len(train_dataloader)
+    )
+    memory_monitor.metric_logger = metric_logger
+    memory_monitor.global_step = metric_logger.global_step
+    last_val_l1 = None
+    for epoch in tqdm(range(start_epoch, args.epoch), disable=not is_main_process()):
+        val_l1 = None
+        # reshuffle the shards of every rank (and redraw weighted episodes) each epoch
+        for shuffled in (train_dataloader.sampler, train_dataloader.dataset):
+            if hasattr(shuffled, "set_epoch"):
+                shuffled.set_epoch(epoch)
+        train_metrics = train_one_epoch(
+            train_dataloader, model, optimizer, device, getattr(args, "grad_accum_steps", 1),
+            metric_logger, epoch, memory_monitor
+        )
+        loss = train_metrics["loss"]
         logger.dump(f"In epoch[{epoch + 1}, {args.epoch}], the loss is: {loss}")
-        if (epoch + 1) % args.save_epochs == 0:
-            save_path = os.path.join(save_dir, "checkpoints", f'epoch_{epoch + 1}.pth')
-            torch.save(
-                {
-                    "args": args,
-                    "epoch": epoch,
-                    "norm_stats": train_dataloader.dataset.norm_stats,
-                    "model": policy.model.state_dict(),
-                    "optimizer": optimizer.state_dict()
-                },
-                save_path
+        metric_logger.log({"step": metric_logger.global_step, "epoch": epoch, "train": train_metrics})
+        save = is_main_process() and (epoch + 1) % args.save_epochs == 0
+        # every checkpoint is scored by its own validation L1, saving also validates
+        if val_dataset is not None and ((epoch + 1) % args.val_epochs == 0 or save):
+            val_results = validate(policy, val_dataset, device, args.val_batch, args.val_time_budget)
+            val_l1 = last_val_l1 = sum(val_results.values()) / len(val_results)
+            logger.dump(f"In epoch[{epoch + 1}, {args.epoch}], the validation L1 is: {val_l1} "
+                        f"({len(val_results)}/{len(val_dataset)} episodes)")
+            for path, episode_l1 in val_results.items():
+                logger.dump(f"    {os.path.basename(path)}: {episode_l1}")
+            metric_logger.log({
+                "step": metric_logger.global_step,
+                "epoch": epoch,
+                "val_l1": val_l1,
+                "val_episodes": {os.path.basename(path): l1 for path, l1 in val_results.items()}
+            })
+        if save:
+            state = {
+                "args": args,
+                "epoch": epoch,
+                "norm_stats": norm_stats,
+                "optimizer": optimizer.state_dict()
+            }
+            if lora_rank > 0:
+                # the base weights are those of `args.lora_base`, merge with `act_pytorch.utils.merge_adapters`
+                state["adapters"] = adapter_state_dict(policy.model)
+            else:
+                state["model"] = policy.model.state_dict()
+            if distill_model is not None:
+                # only needed to resume distillation, the student is `model`
+                state["feature_proj"] = distill_model.feature_proj.state_dict()
+            ckpt_writer.save(
+                state,
+                f'epoch_{epoch + 1}.pth',
+                # with validation, the best checkpoint is the one with the lowest validation L1
+                metric=val_l1 if val_dataset is not None else loss
             )
+    metric_logger.flush(args.epoch - 1)
+    metric_logger.close()
+    summary = {"save_dir": save_dir, "loss": loss, "val_l1": last_val_l1}
+    if is_main_process():
+        ckpt_writer.close()
+        logger.dump(f"Best checkpoint: {ckpt_writer.best}")
+        summary["best"] = ckpt_writer.best
+    logger.close()
+    if args.distributed:
+        dist.destroy_process_group()
+    return summary
             
 
 def main(argv=sys.argv[1:]):
     parser = make_parser()
     args = parser.parse_args(argv)
-    with open('configs/basic.toml', 'rb') as f:
-        _config = tomli.load(f)
-        # dataset
-        args.cameras = list(_config['dataset']['cameras'])
-        args.full_episode = bool(_config['dataset']['full_episode'])
-        args.norm_mode = str(_config['dataset']['norm_mode'])
-        # model
-        args.backbone = str(_config['model']['backbone'])
-        args.lr_backbone = float(_config['model']['lr_backbone'])
-        args.no_encoder = bool(_config['model']['no_encoder'])
-        args.state_dim = int(_config['model']['state_dim'])
-        args.action_dim = int(_config['model']['action_dim'])
-        args.action_horizon = int(_config['model']['action_horizon'])
-        args.latent_dim = int(_config['model']['latent_dim'])
-        args.hidden_dim = int(_config['model']['hidden_dim'])
-        args.nheads = int(_config['model']['nheads'])
-        args.dim_feedforward = int(_config['model']['dim_feedforward'])
-        args.enc_layers = int(_config['model']['enc_layers'])
-        args.dec_layers = int(_config['model']['enc_layers'])
-        args.dropout = float(_config['model']['dropout'])
-        args.pre_norm = bool(_config['model']['pre_norm'])
-        # train
-        args.kl_weight = float(_config['train']['kl_weight'])
-        args.lr = float(_config['train']['lr'])
-        args.weight_decay = float(_config['train']['weight_decay'])
-        args.batch = int(_config['train']['batch'])
-        args.epoch = int(_config['train']['epoch'])
-        args.seed = int(_config['train']['seed'])
-        args.save_epochs = int(_config['train']['save_epochs'])
+    load_config(args, args.config)
     train(args)
 
 